@@ -0,0 +1,293 @@
+"""HTTP/JSON search API over the retrieval engine, without Streamlit.
+
+    python api.py --port 8000 --workers 4 --corpus docs.jsonl
+
+``--corpus`` may also be a document store directory written by
+``python -m utils.docstore docs.jsonl DIR``; it is memory-mapped instead of
+parsed, so startup skips ingestion and workers share its pages.
+
+With ``SEARCH_BACKEND=elasticsearch`` the corpus is bulk-indexed into the
+cluster at ``ES_URL`` on startup (skipped if it is already there) and the
+Lexical, Semantic and Hybrid modes are served by one ``_msearch`` per query.
+
+Endpoints:
+
+* ``GET /health``: liveness, worker pid, corpus size, search backend, model warm-up state and startup timings
+* ``GET /ready``: 503 while this worker's embedding model is warming up, then 200
+* ``GET /metrics``: this worker's stage timings and counters (Prometheus text)
+* ``POST /search``: one query object, or ``{"queries": [...]}`` for a batch
+
+A query object is ``{"query": "...", "modes": [...], "filters": {...},
+"hybrid_weight": 0.6, "top_k": 5, "fusion": "linear", "trace": false}``;
+everything but ``query`` is optional. In a batch, top-level fields are
+defaults for every entry, and entries may be plain query strings.
+
+Workers are forked after the corpus is loaded and indexed, so they share it
+copy-on-write and accept connections from the same listening socket. Each
+worker then warms its embedding model in the background; the model is not
+loaded before the fork because torch's thread pools do not survive it.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.dummy_docs import DOCS, SAMPLE_QUERIES
+from utils.backends import get_backend
+from utils.docstore import is_docstore, open_docstore
+from utils.filters import TERM_FIELDS
+from utils.ingest import ingest, is_iso_date
+from utils.lexical import corpus_fingerprint
+from utils.retrieval import MODE_METHODS
+from utils.tracing import export_prometheus
+from utils.result_cache import cache_stats
+from utils.warmup import start_warmup, warmup_status, mark_startup, startup_timings
+
+API_HOST = os.environ.get("SEARCH_API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("SEARCH_API_PORT", 8000))
+API_WORKERS = int(os.environ.get("SEARCH_API_WORKERS", 2))
+CORPUS_PATH = os.environ.get("SEARCH_CORPUS_PATH", "")
+# Largest accepted batch and the queries of one batch run concurrently
+BATCH_MAX = int(os.environ.get("SEARCH_BATCH_MAX", 64))
+BATCH_WORKERS = int(os.environ.get("SEARCH_BATCH_WORKERS", 4))
+MAX_BODY_BYTES = 1 << 20
+FUSION_METHODS = ("linear", "rrf")
+
+class BadRequest(ValueError):
+    pass
+
+def load_corpus(path=None):
+    # Documents to serve, indexed up front so forked workers inherit the indexes
+    if path and os.path.isdir(path):
+        if not is_docstore(path):
+            raise SystemExit(f"{path} is not a document store")
+        docs = open_docstore(path)
+        fingerprint = docs.fingerprint
+    elif path:
+        with open(path, "rb") as f:
+            result = ingest(f, total_bytes=os.path.getsize(path))
+        if result.skipped:
+            logging.warning(f"Skipped {result.skipped} invalid records in {path}: {result.errors[:3]}")
+        if not result.docs:
+            raise SystemExit(f"No valid documents in {path}")
+        docs, fingerprint = result.docs, result.fingerprint
+    else:
+        docs, fingerprint = DOCS, corpus_fingerprint(DOCS)
+    backend = get_backend()
+    if backend.name == "local":
+        backend.index(docs, fingerprint)
+    else:
+        # Indexing into a remote backend encodes every title, and the
+        # embedding model must not be loaded before the fork, so a child does it
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+        process = ctx.Process(target=backend.index, args=(docs, fingerprint))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise SystemExit(f"Indexing into the {backend.name} backend failed")
+    return docs
+
+def parse_filters(filters):
+    # Checked here so a malformed value is a 400, not an error inside the index
+    if not isinstance(filters, dict):
+        raise BadRequest("'filters' must be an object")
+    for name, value in filters.items():
+        if name in TERM_FIELDS:
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(v, str) for v in values):
+                raise BadRequest(f"'filters.{name}' must be a string or a list of strings")
+        elif name in ("date_from", "date_to"):
+            if value is not None and not is_iso_date(value):
+                raise BadRequest(f"'filters.{name}' must be a YYYY-MM-DD date")
+        elif name == "tags_match":
+            if value not in ("any", "all"):
+                raise BadRequest("'filters.tags_match' must be 'any' or 'all'")
+        else:
+            raise BadRequest(f"unknown filter '{name}'; expected one of: {', '.join(TERM_FIELDS + ('date_from', 'date_to', 'tags_match'))}")
+    return filters
+
+def parse_query(entry, defaults=None):
+    params = {**(defaults or {}), **(entry if isinstance(entry, dict) else {"query": entry})}
+    query = params.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise BadRequest("'query' must be a non-empty string")
+    modes = params.get("modes")
+    if modes is not None and (not isinstance(modes, list) or any(m not in MODE_METHODS for m in modes)):
+        raise BadRequest(f"'modes' must be a list of: {', '.join(MODE_METHODS)}")
+    filters = params.get("filters")
+    if filters is not None:
+        filters = parse_filters(filters)
+    try:
+        hybrid_weight = float(params.get("hybrid_weight", 0.6))
+        top_k = int(params.get("top_k", 5))
+    except (TypeError, ValueError):
+        raise BadRequest("'hybrid_weight' must be a number and 'top_k' an integer")
+    if not 0.0 <= hybrid_weight <= 1.0:
+        raise BadRequest("'hybrid_weight' must be between 0 and 1")
+    if not 1 <= top_k <= 100:
+        raise BadRequest("'top_k' must be between 1 and 100")
+    fusion = params.get("fusion")
+    if fusion is not None and fusion not in FUSION_METHODS:
+        raise BadRequest(f"'fusion' must be one of: {', '.join(FUSION_METHODS)}")
+    return {
+        "query": query.strip(),
+        "modes": modes,
+        "filters": filters or None,
+        "hybrid_weight": hybrid_weight,
+        "top_k": top_k,
+        "fusion": fusion,
+    }, bool(params.get("trace", False))
+
+def run_query(docs, params, include_trace):
+    response = get_backend().search(user_docs=docs, **params)
+    mark_startup("first_result")
+    if not include_trace:
+        response.pop("plan_trace")
+        for mode in response["modes"].values():
+            mode.pop("trace")
+    return response
+
+_BATCH_POOL = None
+_BATCH_POOL_LOCK = threading.Lock()
+
+def get_batch_pool():
+    # Created lazily, so each forked worker gets its own threads
+    global _BATCH_POOL
+    with _BATCH_POOL_LOCK:
+        if _BATCH_POOL is None:
+            _BATCH_POOL = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="search-batch")
+        return _BATCH_POOL
+
+def run_batch(docs, payload):
+    entries = payload.get("queries")
+    if not isinstance(entries, list) or not entries:
+        raise BadRequest("'queries' must be a non-empty list")
+    if len(entries) > BATCH_MAX:
+        raise BadRequest(f"at most {BATCH_MAX} queries per batch")
+    defaults = {k: v for k, v in payload.items() if k != "queries"}
+    parsed = [parse_query(entry, defaults) for entry in entries]
+
+    def run(item):
+        params, include_trace = item
+        try:
+            return run_query(docs, params, include_trace)
+        except Exception as e:
+            # One failing query does not fail the batch
+            logging.error(f"Search error for '{params['query']}': {e}")
+            return {"query": params["query"], "error": str(e)}
+
+    return {"results": list(get_batch_pool().map(run, parsed))}
+
+class SearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SmartQueryLab"
+    # Set per server by make_server
+    docs = DOCS
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self._send(200, {"status": "ok", "worker": os.getpid(), "docs": len(self.docs),
+                                    "backend": get_backend().name, "model": warmup_status(), "startup": startup_timings(),
+                                    "cache": cache_stats()})
+        if self.path == "/ready":
+            warmup = warmup_status()
+            return self._send(503 if warmup["status"] == "warming" else 200, warmup)
+        if self.path == "/metrics":
+            return self._send(200, export_prometheus(), "text/plain; version=0.0.4")
+        self._send(404, {"error": f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            return self._send(404, {"error": f"unknown endpoint {self.path}"})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            return self._send(413, {"error": f"request body over {MAX_BODY_BYTES} bytes"})
+        try:
+            payload = json.loads(self.rfile.read(length) or b"null")
+            if not isinstance(payload, dict):
+                raise BadRequest("request body must be a JSON object")
+            if "queries" in payload:
+                return self._send(200, run_batch(self.docs, payload))
+            return self._send(200, run_query(self.docs, *parse_query(payload)))
+        except (BadRequest, json.JSONDecodeError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            logging.error(f"Search API error: {e}")
+            self._send(500, {"error": "internal error"})
+
+def make_server(host, port, docs):
+    handler = type("CorpusSearchHandler", (SearchHandler,), {"docs": docs})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def warm_up(server):
+    # The sample queries are only worth pre-ranking over the sample data
+    docs = server.RequestHandlerClass.docs
+    if docs is DOCS:
+        start_warmup(docs, SAMPLE_QUERIES)
+    else:
+        start_warmup()
+
+def serve(server, workers):
+    if workers <= 1 or not hasattr(os, "fork"):
+        warm_up(server)
+        server.serve_forever()
+        return
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            warm_up(server)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+    server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the search engine over HTTP/JSON")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="forked worker processes")
+    parser.add_argument("--corpus", default=CORPUS_PATH, help="JSON or JSONL documents, or a document store directory (default: sample data)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    docs = load_corpus(args.corpus)
+    server = make_server(args.host, args.port, docs)
+    logging.info(f"Serving {len(docs)} documents on http://{args.host}:{server.server_address[1]} with {args.workers} workers")
+    serve(server, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,21 @@ import streamlit as st
 from components.query_input import query_input
 from components.results_display import results_display
 from components.explain_toggle import explain_toggle
+from components.filters_panel import filters_panel
 import json
-from utils.dummy_docs import DOCS
+from utils.dummy_docs import DOCS, SAMPLE_QUERIES
+from utils.ingest import ingest
+from utils.retrieval import index_embeddings
+from utils.warmup import start_warmup, warmup_status, mark_startup, startup_timings
+from utils.result_cache import cache_stats, invalidate_corpus
+from utils.segments import SegmentedIndex
+from utils.backends import get_backend, SEARCH_BACKEND
 
 st.set_page_config(page_title="Smart Query Lab", layout="centered")
 
+# Load the embedding model and pre-rank the sample queries in the background while the page renders
+start_warmup(DOCS, SAMPLE_QUERIES)
+
 # --- Header with clear description ---
 st.title("🧪 Smart Query Lab: Search Mode Comparison")
 st.markdown("""
@@ -27,6 +37,14 @@ with st.expander("🚀 Quick Start Guide", expanded=True):
 # --- Sidebar with better organization ---
 st.sidebar.header("⚙️ Configuration")
 
+warmup = warmup_status()
+if warmup["status"] == "warming":
+    st.sidebar.info("⏳ Loading the embedding model... Lexical search is ready; semantic results wait for the model.")
+elif warmup["status"] == "ready":
+    st.sidebar.success(f"✅ Search engine ready (model loaded in {warmup['seconds']:.1f}s)")
+elif warmup["status"] == "failed":
+    st.sidebar.warning(f"⚠️ Model warm-up failed ({warmup['error']}); it will load on the first semantic query")
+
 # Hybrid Weight with better explanation
 st.sidebar.markdown("**🔧 Search Strategy Balance**")
 st.sidebar.markdown("""
@@ -39,6 +57,12 @@ hybrid_weight = st.sidebar.slider(
     0.0, 1.0, 0.6, 0.05,
     help="Balance between keyword matching and semantic understanding"
 )
+fusion = st.sidebar.radio(
+    "Hybrid Fusion Method",
+    ["linear", "rrf"],
+    format_func=lambda m: {"linear": "Weighted linear (min-max normalized)", "rrf": "Reciprocal rank fusion"}[m],
+    help="Weighted linear blends normalized scores; RRF blends rank positions and ignores score scales"
+)
 
 # Document upload with better instructions
 st.sidebar.markdown("---")
@@ -49,23 +73,68 @@ st.sidebar.markdown("Upload your own documents to test search on your content:")
 user_docs = None
 
 uploaded = st.sidebar.file_uploader(
-    "Upload JSON document set (<1MB)", 
-    type=["json"],
-    help="Upload a JSON file with an array of document objects. Each document should have: title, snippet, date, author, tags, type"
+    "Upload JSON or JSONL document set", 
+    type=["json", "jsonl"],
+    help="Upload a JSON array or JSON Lines file of document objects. Each document should have: title, snippet, date, author, tags, type"
 )
 
 if uploaded:
-    try:
-        user_docs = json.load(uploaded)
-        assert isinstance(user_docs, list)
+    # Ingest each upload once; reruns reuse the parsed and indexed documents.
+    # Uploads share one segmented index per session, so a re-upload with a
+    # few changed documents only indexes (or deletes) those documents.
+    upload_id = getattr(uploaded, "file_id", None) or (uploaded.name, uploaded.size)
+    ingested = st.session_state.get("ingested_upload")
+    if not ingested or ingested["id"] != upload_id:
+        try:
+            progress_bar = st.sidebar.progress(0.0, text="Indexing documents...")
+            result = ingest(
+                uploaded,
+                total_bytes=uploaded.size,
+                on_chunk=index_embeddings,
+                progress=lambda fraction, n: progress_bar.progress(fraction or 0.0, text=f"Indexed {n} documents..."),
+                build_index=False,
+            )
+            progress_bar.empty()
+            if not result.docs:
+                raise ValueError("no valid documents found")
+            if "upload_index" not in st.session_state:
+                st.session_state.upload_index = SegmentedIndex()
+            added, deleted = st.session_state.upload_index.sync(result.docs)
+            if ingested:
+                # The previous upload is gone; its cached results never will be hit again
+                invalidate_corpus(ingested["fingerprint"])
+            ingested = {"id": upload_id, "added": added, "deleted": deleted,
+                        "skipped": result.skipped, "errors": result.errors}
+            st.session_state.ingested_upload = ingested
+        except Exception as e:
+            st.sidebar.error(f"❌ Invalid document file: {e}")
+            ingested = None
+    if ingested:
+        # Background merges may have moved on since the upload; search the current segments
+        user_docs = st.session_state.upload_index.snapshot()
+        ingested["fingerprint"] = user_docs.fingerprint
+        if SEARCH_BACKEND != "local":
+            # Synced here rather than on the query path: only documents added or
+            # deleted since the last sync are sent, and reruns find nothing to do
+            try:
+                with st.spinner("Syncing documents to the search backend..."):
+                    get_backend().index(user_docs)
+            except Exception as e:
+                st.sidebar.error(f"❌ Could not index documents into '{SEARCH_BACKEND}': {e}")
         st.sidebar.success(f"✅ Loaded {len(user_docs)} documents successfully!")
-    except Exception as e:
-        st.sidebar.error(f"❌ Invalid JSON format: {e}")
-        user_docs = None
+        if ingested["added"] != len(user_docs) or ingested["deleted"]:
+            st.sidebar.caption(f"Indexed {ingested['added']} new and removed {ingested['deleted']} documents "
+                               f"since the previous upload")
+        if ingested["skipped"]:
+            st.sidebar.warning(f"⚠️ Skipped {ingested['skipped']} invalid records")
+            with st.sidebar.expander("Validation errors"):
+                for err in ingested["errors"]:
+                    st.caption(err)
 else:
     st.sidebar.info("💡 No file uploaded - using sample data")
 
 all_docs = user_docs if user_docs is not None else DOCS
+filters = filters_panel(all_docs)
 
 # Sample data section with better description
 st.sidebar.markdown("---")
@@ -90,16 +159,8 @@ st.sidebar.download_button(
 st.sidebar.markdown("---")
 st.sidebar.markdown("**🔍 Try These Queries**")
 st.sidebar.markdown("Click any query below to test it:")
-sample_queries = [
-    "elasticsearch performance",
-    "bm25 ranking", 
-    "semantic vector search",
-    "hybrid retrieval",
-    "scaling search systems"
-]
-
 # Make queries clickable
-for i, q in enumerate(sample_queries):
+for i, q in enumerate(SAMPLE_QUERIES):
     if st.sidebar.button(f"🔍 {q}", key=f"query_{i}"):
         st.session_state.sample_query = q
 
@@ -127,9 +188,10 @@ if query:
     st.markdown("---")
     st.markdown(f"### 📊 Search Results for: **'{query}'**")
     
-    from utils.llm import explain_retrieval_strategy_stream
+    from utils.llm import explain_retrieval_strategy_stream, last_explanation_stats
     with st.spinner("🔍 Searching and ranking documents..."):
-        results_display(query, filters=None, hybrid_weight=hybrid_weight, user_docs=all_docs)
+        results_display(query, filters=filters, hybrid_weight=hybrid_weight, user_docs=user_docs, fusion=fusion)
+    mark_startup("first_result")
     
     if explain:
         st.markdown("---")
@@ -144,6 +206,20 @@ if query:
             explanation_text += chunk
             # Update the placeholder with the accumulated text
             explanation_placeholder.markdown(explanation_text)
+
+        stats = last_explanation_stats()
+        if stats:
+            source = "cached" if stats["cached"] else f"first token in {stats['ttft_s'] * 1000:.0f} ms"
+            st.caption(f"🤖 {stats['provider']} ({stats['model']}) · {source}")
+
+    from utils.tracing import export_jsonl, export_prometheus
+    with st.expander("📈 Export timings and counters"):
+        st.markdown("Stage timings of recent searches, plus cache, fallback and error counters since startup.")
+        st.download_button("📥 Traces (JSON Lines)", data=export_jsonl(), file_name="traces.jsonl", mime="application/x-ndjson")
+        st.download_button("📥 Metrics (Prometheus text)", data=export_prometheus(), file_name="metrics.prom", mime="text/plain")
+        for name, stats in cache_stats().items():
+            st.caption(f"Cache `{name}`: {stats['hit_rate']:.0%} hit rate ({stats['hits']} hits, {stats['misses']} misses), "
+                       f"{stats['entries']}/{stats['max_entries']} entries")
 else:
     # Show helpful message when no query
     st.markdown("---")
@@ -155,3 +231,8 @@ st.markdown("""
 ---
 **🧪 Smart Query Lab** - Built for exploring search technologies and comparing retrieval strategies.
 """)
+
+mark_startup("first_render")
+labels = {"first_render": "first render", "model_ready": "model ready", "first_result": "first result"}
+timings = startup_timings()
+st.caption("🚀 Startup: " + " · ".join(f"{labels[k]} {timings[k]:.1f}s" for k in labels if k in timings))
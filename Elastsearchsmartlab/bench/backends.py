@@ -0,0 +1,83 @@
+"""The in-process engine versus the Elasticsearch backend, against the stub.
+
+Starts the Elasticsearch API stub (``bench/es_stub.py``) and the LLM stub
+for embeddings, indexes a synthetic corpus through both backends (the
+Elasticsearch one with ``_bulk``), then runs the same queries through each.
+It reports index time, per-query latency of the three ranking modes (one
+``_msearch`` round trip for Elasticsearch) and how much of each mode's
+top-k the two backends agree on.
+
+    cd Elastsearchsmartlab
+    python -m bench.backends --docs 5000 --queries 30 --es-latency-ms 2
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from bench.corpus import generate_corpus, generate_queries
+from bench.es_stub import start_stub as start_es_stub
+from bench.llm_stub import start_stub, stub_environment
+
+MODES = ["Lexical", "Semantic", "Hybrid"]
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process engine versus the Elasticsearch backend")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--fusion", default="linear", choices=["linear", "rrf"])
+    parser.add_argument("--es-latency-ms", type=float, default=2.0, help="stub latency per Elasticsearch request")
+    parser.add_argument("--bulk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    llm_server, llm_url = start_stub()
+    os.environ.update(stub_environment(llm_url))
+    es_server, es_url = start_es_stub(latency=args.es_latency_ms / 1000)
+    os.environ.setdefault("EMBEDDING_STORE_DIR", tempfile.mkdtemp(prefix="bench-embeddings-"))
+    os.environ.setdefault("RESULT_CACHE_SIZE", "0")
+    # Settings are read at import time, so the engine is imported only now
+    from utils.backends import LocalBackend, ElasticsearchBackend
+    from utils.lexical import corpus_fingerprint
+    from utils.retrieval import embedding_backend
+
+    docs = generate_corpus(args.docs)
+    queries = generate_queries(args.queries, 1)
+    fingerprint = corpus_fingerprint(docs)
+    local = LocalBackend()
+    remote = ElasticsearchBackend(es_url, "bench", bulk_size=args.bulk_size)
+    _, local_s = timed(lambda: local.index(docs, fingerprint))
+    # The first call also encodes every title, so index twice and time the second as pure _bulk
+    remote.index(docs, fingerprint)
+    name = remote.index_for(fingerprint, embedding_backend()[0])
+    remote._indexed.pop(name, None)
+    remote._request("DELETE", f"/{name}")
+    _, remote_s = timed(lambda: remote.index(docs, fingerprint))
+
+    latency = {"local": [], "elasticsearch": []}
+    agree = {mode: [] for mode in MODES}
+    for query in queries:
+        a, seconds = timed(lambda: local.search(query, MODES, top_k=args.k, fusion=args.fusion, user_docs=docs))
+        latency["local"].append(seconds * 1000)
+        b, seconds = timed(lambda: remote.search(query, MODES, top_k=args.k, fusion=args.fusion, user_docs=docs))
+        latency["elasticsearch"].append(seconds * 1000)
+        for mode in MODES:
+            titles = {r["title"] for r in a["modes"][mode]["results"]}
+            agree[mode].append(len(titles & {r["title"] for r in b["modes"][mode]["results"]}) / max(len(titles), 1))
+
+    print(f"{args.docs} documents, {len(queries)} queries, top-{args.k}, {args.fusion} fusion")
+    print(f"  index                local {local_s:8.3f} s    elasticsearch _bulk {remote_s:8.3f} s")
+    print(f"  3 modes p50          local {statistics.median(latency['local']):8.2f} ms   "
+          f"elasticsearch _msearch {statistics.median(latency['elasticsearch']):8.2f} ms")
+    for mode in MODES:
+        print(f"  top-{args.k} agreement  {mode:<9} {statistics.mean(agree[mode]):.3f}")
+    es_server.shutdown()
+    llm_server.shutdown()
+
+if __name__ == "__main__":
+    main()
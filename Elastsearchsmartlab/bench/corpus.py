@@ -0,0 +1,88 @@
+"""Synthetic document corpus in the DOCS schema, for benchmarks.
+
+    python -m bench.corpus 100000 > corpus.jsonl
+"""
+import argparse
+import json
+import random
+import sys
+from datetime import date, timedelta
+
+TOPICS = {
+    "elasticsearch": ["cluster", "shard", "replica", "mapping", "analyzer", "heap", "index", "node"],
+    "bm25": ["term", "frequency", "idf", "ranking", "lexical", "tokenizer", "stopword", "saturation"],
+    "vector": ["embedding", "cosine", "dense", "hnsw", "ann", "transformer", "similarity", "recall"],
+    "hybrid": ["fusion", "rrf", "blend", "rerank", "weighting", "precision", "pipeline", "signals"],
+    "scaling": ["sharding", "replication", "latency", "throughput", "caching", "autoscaling", "cost", "partition"],
+    "observability": ["metrics", "tracing", "dashboard", "alerting", "slowlog", "profiling", "logging", "sla"],
+    "llm": ["prompt", "rerank", "relevance", "generation", "grounding", "context", "tokens", "evaluation"],
+    "ingestion": ["bulk", "pipeline", "parsing", "schema", "batching", "backpressure", "etl", "connector"],
+}
+TITLE_TEMPLATES = [
+    "{Topic} {word} guide",
+    "Tuning {word} for {topic}",
+    "A primer on {topic} {word}",
+    "{Topic} in production: {word} lessons",
+    "Understanding {word} in {topic} systems",
+    "Scaling {topic} {word}",
+]
+SENTENCE_TEMPLATES = [
+    "Explains how {w1} and {w2} interact in {topic} deployments.",
+    "Covers {w1} trade-offs, {w2} tuning and common pitfalls.",
+    "Walks through a real incident caused by {w1} misconfiguration.",
+    "Includes benchmarks comparing {w1} with {w2} under load.",
+    "Shows how to monitor {w1} and alert on {w2} regressions.",
+    "Discusses when {topic} teams should prefer {w1} over {w2}.",
+    "Provides sample configs for {w1} and {w2} in {topic} clusters.",
+]
+TYPES = ["Guide", "Article", "Primer", "Case Study", "Whitepaper", "Tutorial", "Reference"]
+FIRST_NAMES = ["Priya", "Alex", "Morgan", "Samira", "Diego", "Chen", "Fatima", "Jonas", "Aiko", "Lena", "Omar", "Ravi"]
+LAST_NAMES = ["Singh", "Kim", "Lee", "Patel", "Alvarez", "Wang", "Haddad", "Berg", "Tanaka", "Novak", "Farouk", "Iyer"]
+START_DATE = date(2019, 1, 1)
+
+def _document(rng, number):
+    topic = rng.choice(list(TOPICS))
+    words = TOPICS[topic]
+    title = rng.choice(TITLE_TEMPLATES).format(topic=topic, Topic=topic.capitalize(), word=rng.choice(words))
+    # Numbered so titles stay distinct and every document needs its own embedding
+    title = f"{title}, part {number}"
+    sentences = [
+        rng.choice(SENTENCE_TEMPLATES).format(topic=topic, w1=rng.choice(words), w2=rng.choice(words))
+        for _ in range(rng.randint(3, 7))
+    ]
+    other = rng.choice(list(TOPICS))
+    return {
+        "title": title,
+        "snippet": " ".join(sentences),
+        "date": (START_DATE + timedelta(days=rng.randrange(7 * 365))).isoformat(),
+        "author": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "tags": sorted({topic, other, rng.choice(words)}),
+        "type": rng.choice(TYPES),
+    }
+
+def iter_corpus(num_docs, seed=0):
+    rng = random.Random(seed)
+    for number in range(1, num_docs + 1):
+        yield _document(rng, number)
+
+def generate_corpus(num_docs, seed=0):
+    return list(iter_corpus(num_docs, seed))
+
+def generate_queries(num_queries, seed=1):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        topic = rng.choice(list(TOPICS))
+        queries.append(" ".join([topic] + rng.sample(TOPICS[topic], 2)))
+    return queries
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic corpus as JSON Lines to stdout")
+    parser.add_argument("num_docs", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for doc in iter_corpus(args.num_docs, args.seed):
+        sys.stdout.write(json.dumps(doc) + "\n")
+
+if __name__ == "__main__":
+    main()
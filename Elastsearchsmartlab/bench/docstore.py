@@ -0,0 +1,85 @@
+"""Memory and startup cost of a list of dicts versus the columnar DocStore.
+
+Generates a synthetic corpus, then measures the Python heap held by the
+documents in each layout, the time to get a searchable corpus at startup
+(parsing and validating JSONL versus opening a saved store memory-mapped),
+the cost of materialising a page of results, and checks that both layouts
+produce identical lexical rankings.
+
+    cd Elastsearchsmartlab
+    python -m bench.docstore --docs 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from bench.corpus import generate_corpus, generate_queries
+from utils.docstore import DocStore, open_docstore
+from utils.fusion import top_k
+from utils.ingest import ingest
+from utils.lexical import LexicalIndex, corpus_fingerprint
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def held_mb(fn):
+    # Python heap still allocated once ``fn`` returns, i.e. what its result keeps alive
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current / 2**20
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and startup cost of list-of-dicts versus DocStore")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    queries = generate_queries(args.queries)
+    docs, list_mb = held_mb(lambda: [json.loads(json.dumps(doc)) for doc in generate_corpus(args.docs)])
+    store, store_mb = held_mb(lambda: DocStore.from_docs(docs))
+    assert store.fingerprint == corpus_fingerprint(docs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "corpus.jsonl")
+        with open(path, "w") as f:
+            f.writelines(json.dumps(doc) + "\n" for doc in docs)
+        store.save(os.path.join(tmp, "store"))
+
+        def parse():
+            with open(path, "rb") as f:
+                return ingest(f, build_index=False).docs
+        _, parse_s = timed(parse)
+        mapped, open_s = timed(lambda: open_docstore(os.path.join(tmp, "store")))
+        mapped_mb = sum(len(v) for v in mapped.vocab) / 2**20
+
+        index = LexicalIndex(docs)
+        agree = 0
+        page_ms = {"list": [], "docstore": []}
+        for query in queries:
+            ids = top_k(index.search(query), args.k)
+            for name, corpus in (("list", docs), ("docstore", mapped)):
+                results, seconds = timed(lambda: [{**corpus[i], "score": 1.0} for i in ids])
+                page_ms[name].append(seconds * 1000)
+            agree += all(mapped[i] == docs[i] for i in ids)
+        del mapped
+
+    print(f"{args.docs} documents")
+    print(f"  held in memory       list of dicts {list_mb:8.1f} MB   docstore {store_mb:8.1f} MB "
+          f"({store.nbytes / 2**20:.1f} MB of columns)   mmap-opened {mapped_mb:6.2f} MB heap")
+    print(f"  startup              parse JSONL   {parse_s:8.3f} s    open mmap {open_s:8.3f} s")
+    print(f"  top-{args.k} page p50      list of dicts {statistics.median(page_ms['list']):8.3f} ms   "
+          f"docstore {statistics.median(page_ms['docstore']):8.3f} ms")
+    print(f"  identical results    {agree}/{len(queries)} queries")
+
+if __name__ == "__main__":
+    main()
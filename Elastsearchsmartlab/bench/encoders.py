@@ -0,0 +1,83 @@
+"""Throughput and parity of the local embedding backends.
+
+Encodes synthetic document texts with every backend and process count and
+reports documents per second, plus how closely each backend reproduces the
+single-process torch reference: per-document cosine similarity and how many
+of each query's top-10 neighbours survive.
+
+    cd Elastsearchsmartlab
+    python -m bench.encoders --docs 5000 --backends torch quantized onnx onnx-int8 --processes 1 4
+"""
+import argparse
+import json
+import time
+import numpy as np
+from bench.corpus import generate_corpus, generate_queries
+from utils.encoders import ST_BACKENDS, encode_texts, shutdown_pools
+from utils.fusion import top_k
+
+def parity(reference, vectors, ref_queries, queries, k=10):
+    cosines = np.sum(reference * vectors, axis=1)
+    overlap = [
+        len(set(top_k(reference @ rq, k).tolist()) & set(top_k(vectors @ q, k).tolist())) / k
+        for rq, q in zip(ref_queries, queries)
+    ]
+    return {
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        f"top{k}_overlap": float(np.mean(overlap)),
+    }
+
+def bench_backend(texts, queries, model_name, backend, processes, batch_size):
+    # Warm-up loads the model (and starts the worker pool) outside the timed run
+    encode_texts(texts[:batch_size * processes], model_name, backend, processes, batch_size)
+    start = time.perf_counter()
+    vectors = encode_texts(texts, model_name, backend, processes, batch_size)
+    elapsed = time.perf_counter() - start
+    query_vectors = encode_texts(queries, model_name, backend, 1, batch_size)
+    return vectors, query_vectors, {
+        "backend": backend,
+        "processes": processes,
+        "docs": len(texts),
+        "seconds": elapsed,
+        "docs_per_s": len(texts) / elapsed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Documents per second and embedding parity of each encoder backend")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backends", nargs="+", default=list(ST_BACKENDS), choices=ST_BACKENDS)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    texts = [f"{doc['title']}. {doc['snippet']}" for doc in generate_corpus(args.docs)]
+    queries = generate_queries(args.queries)
+    reference = bench_backend(texts, queries, args.model, "torch", 1, args.batch_size)
+    rows = []
+    print(f"{'backend':>10} {'procs':>5} {'docs/s':>9} {'mean cos':>9} {'min cos':>8} {'top10':>6}")
+    for backend in args.backends:
+        for processes in args.processes:
+            if backend == "torch" and processes == 1:
+                vectors, query_vectors, row = reference
+            else:
+                try:
+                    vectors, query_vectors, row = bench_backend(texts, queries, args.model, backend,
+                                                                processes, args.batch_size)
+                except ImportError as e:
+                    print(f"{backend:>10} {processes:>5} skipped: {e}")
+                    continue
+            row.update(parity(reference[0], vectors, reference[1], query_vectors))
+            rows.append(row)
+            print(f"{backend:>10} {processes:>5} {row['docs_per_s']:>9.0f} {row['mean_cosine']:>9.4f} "
+                  f"{row['min_cosine']:>8.4f} {row['top10_overlap']:>6.2f}")
+    shutdown_pools()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == "__main__":
+    main()
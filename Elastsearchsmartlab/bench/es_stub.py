@@ -0,0 +1,331 @@
+"""Local HTTP server speaking the subset of the Elasticsearch REST API the
+search backend uses, for tests and benchmarks without a cluster.
+
+* ``PUT /{index}``, ``DELETE /{index}``, ``GET /{index}/_mapping``, ``GET /{index}/_count``
+* ``POST /_bulk`` (``index`` and ``delete`` actions) and ``POST /{index}/_refresh``
+* ``POST /_msearch``: ``match`` / ``multi_match`` text queries in a ``bool``
+  with ``filter`` clauses (``term``, ``terms``, ``range``) and a ``boost``,
+  top-level ``knn`` (exact cosine, scored ``(1 + cos) / 2``), both at once
+  (scores summed, as in Elasticsearch), and the ``rrf`` retriever
+
+Text queries are BM25 over title and snippet as one field. As in
+Elasticsearch, writes become searchable after a refresh. Every request
+waits ``latency`` seconds.
+
+    python -m bench.es_stub --port 9200 --latency-ms 5
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from utils.filters import FilterIndex
+from utils.fusion import top_k
+from utils.lexical import LexicalIndex
+
+class StubIndex:
+    def __init__(self, body):
+        self.mappings = body.get("mappings", {})
+        self.settings = body.get("settings", {})
+        self.sources = {}
+        self.refresh()
+
+    def refresh(self):
+        # A point-in-time view of the documents, as searched until the next refresh
+        self.ids = list(self.sources)
+        docs = [self.sources[i] for i in self.ids]
+        self.lexical = LexicalIndex(docs)
+        self.filters = FilterIndex(docs)
+        vectors = [doc.get("embedding") for doc in docs]
+        if vectors and all(v is not None for v in vectors):
+            matrix = np.asarray(vectors, dtype=np.float32)
+            self.vectors = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        else:
+            self.vectors = None
+
+    def filter_mask(self, clauses):
+        if isinstance(clauses, dict):
+            clauses = [clauses]
+        mask = np.ones(len(self.ids), dtype=bool)
+        for clause in clauses or []:
+            if "bool" in clause:
+                mask &= self.filter_mask(clause["bool"].get("filter", [])) & self.filter_mask(clause["bool"].get("must", []))
+            elif "term" in clause or "terms" in clause:
+                (field, values), = (clause.get("term") or clause["terms"]).items()
+                mask &= self.filters._term_mask(field, values if isinstance(values, list) else [values])
+            elif "range" in clause:
+                (field, bounds), = clause["range"].items()
+                if field != "date":
+                    raise ValueError(f"range on '{field}' is not supported")
+                if "gte" in bounds:
+                    mask &= self.filters.dates >= np.datetime64(bounds["gte"], "D")
+                if "lte" in bounds:
+                    mask &= self.filters.dates <= np.datetime64(bounds["lte"], "D")
+            elif "match_all" not in clause:
+                raise ValueError(f"unsupported filter clause {sorted(clause)}")
+        return mask
+
+    def query_scores(self, query):
+        # Scores of matching documents, NaN elsewhere
+        scores = np.full(len(self.ids), np.nan, dtype=np.float32)
+        if "match_all" in query:
+            scores[:] = 1.0
+            return scores
+        if "match" in query or "multi_match" in query:
+            if "match" in query:
+                (_, text), = query["match"].items()
+                text = text["query"] if isinstance(text, dict) else text
+            else:
+                text = query["multi_match"]["query"]
+            bm25 = self.lexical.search(text)
+            scores[bm25 > 0] = bm25[bm25 > 0]
+            return scores
+        if "bool" in query:
+            clause = query["bool"]
+            must = clause.get("must", [])
+            must = must if isinstance(must, list) else [must]
+            if must:
+                parts = [self.query_scores(q) for q in must]
+                matched = np.logical_and.reduce([~np.isnan(p) for p in parts])
+                scores = sum(np.nan_to_num(p, nan=0.0) for p in parts).astype(np.float32)
+                scores[~matched] = np.nan
+            else:
+                scores[:] = 0.0
+            scores[~self.filter_mask(clause.get("filter", []))] = np.nan
+            return scores * clause.get("boost", 1.0)
+        raise ValueError(f"unsupported query {sorted(query)}")
+
+    def knn_scores(self, knn):
+        scores = np.full(len(self.ids), np.nan, dtype=np.float32)
+        if self.vectors is None or not len(self.ids):
+            return scores
+        q = np.asarray(knn["query_vector"], dtype=np.float32)
+        similarity = (1 + self.vectors @ (q / (np.linalg.norm(q) + 1e-12))) / 2
+        similarity[~self.filter_mask(knn.get("filter", []))] = np.nan
+        valid = np.flatnonzero(~np.isnan(similarity))
+        best = valid[top_k(similarity[valid], knn.get("k", 10))]
+        scores[best] = similarity[best] * knn.get("boost", 1.0)
+        return scores
+
+    def retriever_scores(self, retriever):
+        if "standard" in retriever:
+            return self.query_scores(retriever["standard"].get("query", {"match_all": {}}))
+        if "knn" in retriever:
+            return self.knn_scores(retriever["knn"])
+        if "rrf" in retriever:
+            rrf = retriever["rrf"]
+            k = rrf.get("rank_constant", 60)
+            window = rrf.get("rank_window_size", 10)
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            matched = np.zeros(len(self.ids), dtype=bool)
+            for child in rrf["retrievers"]:
+                child_scores = self.retriever_scores(child)
+                valid = np.flatnonzero(~np.isnan(child_scores))
+                ranked = valid[top_k(child_scores[valid], window)]
+                scores[ranked] += 1.0 / (k + np.arange(1, len(ranked) + 1))
+                matched[ranked] = True
+            scores[~matched] = np.nan
+            return scores
+        raise ValueError(f"unsupported retriever {sorted(retriever)}")
+
+    def search(self, body):
+        start = time.perf_counter()
+        if "retriever" in body:
+            scores = self.retriever_scores(body["retriever"])
+        else:
+            parts = []
+            if "query" in body:
+                parts.append(self.query_scores(body["query"]))
+            knns = body.get("knn", [])
+            for knn in (knns if isinstance(knns, list) else [knns]):
+                parts.append(self.knn_scores(knn))
+            if not parts:
+                parts.append(self.query_scores({"match_all": {}}))
+            # A document matching any part scores the sum of the parts it matched
+            matched = np.logical_or.reduce([~np.isnan(p) for p in parts])
+            scores = sum(np.nan_to_num(p, nan=0.0) for p in parts).astype(np.float32)
+            scores[~matched] = np.nan
+        valid = np.flatnonzero(~np.isnan(scores))
+        best = valid[top_k(scores[valid], body.get("size", 10))]
+        excludes = set((body.get("_source") or {}).get("excludes", [])) if isinstance(body.get("_source"), dict) else set()
+        hits = [{
+            "_index": None,
+            "_id": self.ids[i],
+            "_score": float(scores[i]),
+            "_source": {k: v for k, v in self.sources[self.ids[i]].items() if k not in excludes},
+        } for i in best]
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "hits": {"total": {"value": len(valid), "relation": "eq"},
+                     "max_score": hits[0]["_score"] if hits else None, "hits": hits},
+        }
+
+class EsStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set per server by make_server
+    latency = 0.0
+    indices = {}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, error_type, reason):
+        self._send_json(status, {"error": {"type": error_type, "reason": reason}, "status": status})
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _ndjson(self, data):
+        return [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+
+    def _parts(self):
+        return [p for p in self.path.split("?")[0].split("/") if p]
+
+    def _handle(self, method):
+        time.sleep(self.latency)
+        data = self._body()
+        parts = self._parts()
+        try:
+            with self.lock:
+                if not parts:
+                    return self._send_json(200, {"name": "es-stub", "version": {"number": "8.15.0"},
+                                                 "tagline": "You Know, for Search"})
+                if parts[-1] == "_bulk":
+                    return self._bulk(parts[0] if len(parts) > 1 else None, self._ndjson(data))
+                if parts[-1] == "_msearch":
+                    return self._msearch(parts[0] if len(parts) > 1 else None, self._ndjson(data))
+                name = parts[0]
+                if len(parts) == 1 and method == "PUT":
+                    if name in self.indices:
+                        return self._error(400, "resource_already_exists_exception", f"index [{name}] already exists")
+                    self.indices[name] = StubIndex(json.loads(data or b"{}"))
+                    return self._send_json(200, {"acknowledged": True, "shards_acknowledged": True, "index": name})
+                if name not in self.indices:
+                    return self._error(404, "index_not_found_exception", f"no such index [{name}]")
+                if len(parts) == 1 and method == "DELETE":
+                    del self.indices[name]
+                    return self._send_json(200, {"acknowledged": True})
+                if parts[1:] == ["_mapping"] and method == "GET":
+                    return self._send_json(200, {name: {"mappings": self.indices[name].mappings}})
+                if parts[1:] == ["_count"]:
+                    return self._send_json(200, {"count": len(self.indices[name].ids)})
+                if parts[1:] == ["_refresh"]:
+                    self.indices[name].refresh()
+                    return self._send_json(200, {"_shards": {"total": 1, "successful": 1, "failed": 0}})
+                if parts[1:] == ["_search"]:
+                    return self._send_json(200, self.indices[name].search(json.loads(data or b"{}")))
+            self._error(400, "illegal_argument_exception", f"unsupported request {method} {self.path}")
+        except (ValueError, KeyError, TypeError) as e:
+            self._error(400, "parsing_exception", f"{type(e).__name__}: {e}")
+
+    def _bulk(self, default_index, lines):
+        items = []
+        errors = False
+        i = 0
+        while i < len(lines):
+            (action, meta), = lines[i].items()
+            name = meta.get("_index", default_index)
+            index = self.indices.get(name)
+            if action in ("index", "create"):
+                source = lines[i + 1]
+                i += 2
+            else:
+                source = None
+                i += 1
+            if index is None:
+                errors = True
+                items.append({action: {"_index": name, "_id": meta.get("_id"), "status": 404,
+                                       "error": {"type": "index_not_found_exception", "reason": f"no such index [{name}]"}}})
+                continue
+            if action == "delete":
+                found = index.sources.pop(meta["_id"], None) is not None
+                items.append({action: {"_index": name, "_id": meta["_id"], "status": 200 if found else 404,
+                                       "result": "deleted" if found else "not_found"}})
+            elif action in ("index", "create"):
+                created = meta["_id"] not in index.sources
+                index.sources[meta["_id"]] = source
+                items.append({action: {"_index": name, "_id": meta["_id"], "status": 201 if created else 200,
+                                       "result": "created" if created else "updated"}})
+            else:
+                raise ValueError(f"unsupported bulk action '{action}'")
+        self._send_json(200, {"took": 0, "errors": errors, "items": items})
+
+    def _msearch(self, default_index, lines):
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            name = header.get("index", default_index)
+            index = self.indices.get(name)
+            if index is None:
+                responses.append({"error": {"type": "index_not_found_exception", "reason": f"no such index [{name}]"},
+                                  "status": 404})
+                continue
+            try:
+                response = index.search(body)
+            except (ValueError, KeyError, TypeError) as e:
+                responses.append({"error": {"type": "parsing_exception", "reason": f"{type(e).__name__}: {e}"},
+                                  "status": 400})
+                continue
+            for hit in response["hits"]["hits"]:
+                hit["_index"] = name
+            responses.append({**response, "status": 200})
+        self._send_json(200, {"took": 0, "responses": responses})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+def make_server(host="127.0.0.1", port=0, latency=0.0):
+    handler = type("ConfiguredEsStubHandler", (EsStubHandler,), {
+        "latency": latency,
+        "indices": {},
+        "lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_stub(**kwargs):
+    """Serve the stub from a daemon thread; returns ``(server, base_url)``.
+    Call ``server.shutdown()`` to stop it."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="es-stub", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Elasticsearch API stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency_ms / 1000)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Elasticsearch stub listening on {base_url}")
+    print(f"  export SEARCH_BACKEND=elasticsearch ES_URL={base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
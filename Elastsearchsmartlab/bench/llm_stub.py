@@ -0,0 +1,230 @@
+"""Local HTTP server imitating the OpenAI, Groq and Cohere APIs.
+
+Serves the endpoints the app calls, with deterministic answers so runs are
+repeatable:
+
+* ``POST .../chat/completions`` (OpenAI and Groq, JSON or server-sent events)
+* ``POST /v1/embed`` (Cohere; hashed bag-of-words vectors)
+* ``POST /v1/generate`` (Cohere, JSON or streamed JSON lines)
+
+Relevance prompts get token-overlap scores, as a JSON array for batch
+prompts. Every request waits ``latency`` plus up to ``jitter`` seconds and
+fails with HTTP 500 at ``error_rate``.
+
+    python -m bench.llm_stub --port 8765 --latency-ms 80 --error-rate 0.05
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUERY_RE = re.compile(r"Given the query: '(.*?)', rate the relevance", re.S)
+ENTRY_RE = re.compile(r"^\[(\d+)\] Title: (.*)$", re.M)
+TOKEN_RE = re.compile(r"\w+")
+EXPLANATION = (
+    "This mode ranks documents with a stub scorer. It is fast and deterministic, "
+    "which makes it useful for benchmarks, but it says nothing about real relevance."
+)
+
+def _tokens(text):
+    return set(TOKEN_RE.findall(text.lower()))
+
+def _overlap(query, text):
+    terms = _tokens(query)
+    return round(len(terms & _tokens(text)) / len(terms), 2) if terms else 0.0
+
+def completion_text(prompt):
+    match = QUERY_RE.search(prompt)
+    if not match:
+        return EXPLANATION
+    query = match.group(1)
+    entries = ENTRY_RE.findall(prompt)
+    if entries:
+        body = prompt[prompt.find("[0] Title:"):]
+        blocks = re.split(r"^\[\d+\] ", body, flags=re.M)[1:]
+        return json.dumps([{"id": int(i), "score": _overlap(query, block)} for (i, _), block in zip(entries, blocks)])
+    return str(_overlap(query, prompt[match.end():]))
+
+def embed_text(text, dim):
+    # Feature hashing: each token adds +-1 to one bucket, then L2-normalise
+    vec = [0.0] * dim
+    for token in TOKEN_RE.findall(text.lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vec[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [round(v / norm, 4) for v in vec]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Set per server by make_server
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    dim = 384
+    rng = random.Random(0)
+    rng_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _delay_or_fail(self):
+        with self.rng_lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failed = self.rng.random() < self.error_rate
+        time.sleep(delay)
+        return failed
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json(400, {"message": "invalid JSON body"})
+        failed = self._delay_or_fail()
+        if self.path.endswith("/chat/completions"):
+            if failed:
+                return self._send_json(500, {"error": {"message": "stub error", "type": "server_error"}})
+            return self._chat(payload)
+        if self.path.endswith("/embed"):
+            if failed:
+                return self._send_json(500, {"message": "stub error"})
+            return self._embed(payload)
+        if self.path.endswith("/generate"):
+            if failed:
+                return self._send_json(500, {"message": "stub error"})
+            return self._generate(payload)
+        self._send_json(404, {"message": f"unknown endpoint {self.path}"})
+
+    def _chat(self, payload):
+        prompt = "\n".join(m.get("content", "") for m in payload.get("messages", []))
+        text = completion_text(prompt)
+        model = payload.get("model", "stub")
+        created = int(time.time())
+        if not payload.get("stream"):
+            return self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(text.split()),
+                          "total_tokens": len(prompt.split()) + len(text.split())},
+            })
+        self._start_chunked("text/event-stream")
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for word in re.findall(r"\S+\s*", text):
+            event = {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        done = {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self._write_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _embed(self, payload):
+        texts = payload.get("texts") or []
+        self._send_json(200, {
+            "id": uuid.uuid4().hex,
+            "texts": texts,
+            "embeddings": [embed_text(t, self.dim) for t in texts],
+            "meta": {"api_version": {"version": "1"}},
+            "response_type": "embeddings_floats",
+        })
+
+    def _generate(self, payload):
+        prompt = payload.get("prompt", "")
+        text = completion_text(prompt)
+        generation = {"id": uuid.uuid4().hex, "text": text, "finish_reason": "COMPLETE"}
+        if not payload.get("stream"):
+            return self._send_json(200, {"id": uuid.uuid4().hex, "generations": [generation],
+                                         "prompt": prompt, "meta": {"api_version": {"version": "1"}}})
+        self._start_chunked("application/stream+json")
+        for index, word in enumerate(re.findall(r"\S+\s*", text)):
+            line = {"index": index, "text": word, "is_finished": False}
+            self._write_chunk((json.dumps(line) + "\n").encode("utf-8"))
+        final = {"is_finished": True, "finish_reason": "COMPLETE",
+                 "response": {"id": uuid.uuid4().hex, "generations": [generation], "prompt": prompt}}
+        self._write_chunk((json.dumps(final) + "\n").encode("utf-8"))
+        self._write_chunk(b"")
+
+def make_server(host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, dim=384, seed=0):
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "latency": latency,
+        "jitter": jitter,
+        "error_rate": error_rate,
+        "dim": dim,
+        "rng": random.Random(seed),
+        "rng_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_stub(**kwargs):
+    """Serve the stub from a daemon thread; returns ``(server, base_url)``.
+    Call ``server.shutdown()`` to stop it."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+def stub_environment(base_url, openai=False):
+    # Environment variables pointing the app's clients at the stub; secrets
+    # files are ignored so keys in them can never reach the real providers
+    env = {
+        "SECRETS_PATH": "",
+        "COHERE_API_KEY": "stub",
+        "CO_API_URL": base_url,
+        "GROQ_API_KEY": "stub",
+        "GROQ_API_URL": f"{base_url}/openai/v1/chat/completions",
+    }
+    if openai:
+        env.update({"OPENAI_API_KEY": "stub", "OPENAI_BASE_URL": f"{base_url}/v1"})
+    return env
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the OpenAI/Groq/Cohere stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    args = parser.parse_args()
+    server = make_server(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000, args.error_rate, args.dim)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"LLM stub listening on {base_url}")
+    for name, value in stub_environment(base_url, openai=True).items():
+        print(f"  export {name}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Latency, throughput and memory benchmark for every search mode.
+
+Generates a synthetic corpus per size, points the LLM and Cohere embedding
+clients at the local stub (unless ``--no-stub``) and reports, per mode,
+p50/p95 latency, throughput and peak memory of a single query.
+
+    cd Elastsearchsmartlab
+    python -m bench.run --sizes 1000 10000 100000 --queries 50 --concurrency 4
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bench.corpus import generate_corpus, generate_queries
+from bench.llm_stub import start_stub, stub_environment
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_MODES = ["Lexical", "Semantic", "Hybrid", "LLM Rerank"]
+ALL_MODES = DEFAULT_MODES + ["LLM"]
+
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def build_indexes(retrieval, docs, query):
+    # Everything a first query would otherwise pay for, timed step by step
+    from utils.lexical import corpus_fingerprint, get_lexical_index
+    timings = {}
+    start = time.perf_counter()
+    fingerprint = corpus_fingerprint(docs)
+    timings["fingerprint_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    get_lexical_index(docs, fingerprint)
+    timings["lexical_index_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(0, len(docs), 10000):
+        retrieval.index_embeddings(docs[i:i + 10000])
+    timings["embed_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    retrieval.get_semantic_scores(query, docs, fingerprint)
+    timings["semantic_index_s"] = time.perf_counter() - start
+    return fingerprint, timings
+
+def run_query(retrieval, docs, fingerprint, query, mode):
+    # A fresh plan per query, so no signal is reused across modes or runs
+    from utils.query_plan import QueryPlan
+    plan = QueryPlan(query, docs, retrieval.SIGNAL_SCORERS, fingerprint)
+    return retrieval.rank_plan(plan, mode)
+
+def bench_mode(retrieval, docs, fingerprint, queries, mode, concurrency):
+    tracemalloc.start()
+    run_query(retrieval, docs, fingerprint, queries[0], mode)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    def timed(query):
+        start = time.perf_counter()
+        run_query(retrieval, docs, fingerprint, query, mode)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = np.array(list(pool.map(timed, queries)))
+    wall = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "queries": len(queries),
+        "concurrency": concurrency,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "qps": len(queries) / wall if wall > 0 else float("inf"),
+        "peak_query_mb": peak / (1024 * 1024),
+    }
+
+def print_table(results):
+    header = f"{'docs':>9} {'mode':<11} {'p50 ms':>9} {'p95 ms':>9} {'qps':>8} {'peak MB':>8} {'rss MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if r.get("skipped"):
+            print(f"{r['num_docs']:>9} {r['mode']:<11} skipped: {r['skipped']}")
+            continue
+        print(f"{r['num_docs']:>9} {r['mode']:<11} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+              f"{r['qps']:>8.1f} {r['peak_query_mb']:>8.1f} {r['rss_mb']:>8.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Lexical, Semantic, Hybrid and LLM search modes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="corpus sizes (documents)")
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES, choices=ALL_MODES)
+    parser.add_argument("--queries", type=int, default=30, help="timed queries per mode and size")
+    parser.add_argument("--concurrency", type=int, default=1, help="queries in flight at once")
+    parser.add_argument("--llm-max-docs", type=int, default=2000,
+                        help="largest corpus for the full-corpus LLM mode (one prompt per LLM_BATCH_SIZE docs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-stub", action="store_true", help="use the real providers configured in the environment")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stub latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="extra random stub latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub requests failing with HTTP 500")
+    parser.add_argument("--dim", type=int, default=384, help="stub embedding dimension")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if not args.no_stub:
+        server, base_url = start_stub(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                                      error_rate=args.error_rate, dim=args.dim, seed=args.seed)
+        os.environ.update(stub_environment(base_url))
+        print(f"LLM stub on {base_url} ({args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, {args.error_rate:.0%} errors)")
+    # Keep benchmark embeddings out of the app's store and measure uncached LLM scoring and ranking
+    os.environ.setdefault("EMBEDDING_STORE_DIR", tempfile.mkdtemp(prefix="bench-embeddings-"))
+    os.environ.setdefault("LLM_CACHE", "0")
+    os.environ.setdefault("RESULT_CACHE_SIZE", "0")
+    os.environ.setdefault("QUERY_EMBEDDING_CACHE_SIZE", "0")
+    # Settings are read at import time, so retrieval is imported only now
+    from utils import retrieval
+
+    queries = generate_queries(args.queries, args.seed + 1)
+    results = []
+    for size in args.sizes:
+        docs = generate_corpus(size, args.seed)
+        fingerprint, timings = build_indexes(retrieval, docs, queries[0])
+        print(f"\n{size} docs: " + ", ".join(f"{k} {v:.2f}" for k, v in timings.items()))
+        for mode in args.modes:
+            row = {"num_docs": size, **timings}
+            if mode == "LLM" and size > args.llm_max_docs:
+                results.append({**row, "mode": mode, "skipped": f"more than --llm-max-docs={args.llm_max_docs}"})
+                continue
+            results.append({**row, **bench_mode(retrieval, docs, fingerprint, queries, mode, args.concurrency),
+                            "rss_mb": _rss_mb()})
+        del docs
+
+    print()
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json}")
+    if not args.no_stub:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
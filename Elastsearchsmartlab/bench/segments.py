@@ -0,0 +1,84 @@
+"""Cost of corpus updates: full rebuilds versus segment-based indexing.
+
+Builds a synthetic corpus, then times adding and deleting a batch of
+documents both ways: rebuilding the whole-corpus BM25 and filter indexes,
+and flushing a new segment or tombstoning into a SegmentedIndex. It also
+times a forced merge and the query latency of each layout, and checks the
+segmented BM25 top-10 against the whole-corpus index.
+
+    cd Elastsearchsmartlab
+    python -m bench.segments --docs 100000 --batch 100
+"""
+import argparse
+import statistics
+import time
+import numpy as np
+from bench.corpus import generate_corpus, generate_queries
+from utils.filters import FilterIndex
+from utils.fusion import top_k
+from utils.lexical import LexicalIndex
+from utils.segments import SegmentedIndex, doc_key
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+def rebuild(docs):
+    return LexicalIndex(docs), FilterIndex(docs)
+
+def query_ms(search, queries):
+    times = []
+    for query in queries:
+        _, seconds = timed(lambda: search(query))
+        times.append(seconds * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="Update cost of whole-corpus rebuilds versus segments")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=100, help="documents added, then deleted")
+    parser.add_argument("--segments", type=int, default=4, help="segments the initial corpus is written as")
+    parser.add_argument("--queries", type=int, default=30)
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.docs + args.batch)
+    docs, extra = corpus[:args.docs], corpus[args.docs:]
+    queries = generate_queries(args.queries)
+
+    (flat, _), full_s = timed(lambda: rebuild(docs))
+    index = SegmentedIndex(merge_factor=args.segments + 2, background_merges=False)
+    step = -(-len(docs) // args.segments)
+    _, initial_s = timed(lambda: [index.add(docs[i:i + step]) for i in range(0, len(docs), step)])
+
+    snapshot = index.snapshot()
+    agree = np.mean([
+        len(set(top_k(flat.search(q), 10).tolist()) & set(top_k(snapshot.bm25_scores(q), 10).tolist())) / 10
+        for q in queries
+    ])
+    flat_ms = query_ms(flat.search, queries)
+    segmented_ms = query_ms(lambda q: index.snapshot().bm25_scores(q), queries)
+
+    _, add_rebuild_s = timed(lambda: rebuild(docs + extra))
+    _, add_s = timed(lambda: index.add(extra))
+    _, delete_s = timed(lambda: index.delete([doc_key(doc) for doc in extra]))
+    _, delete_rebuild_s = timed(lambda: rebuild(docs))
+    # Enough one-document segments to trip the merge policy on the next flush
+    merge_factor, index.merge_factor = index.merge_factor, len(docs)
+    for doc in extra[:merge_factor]:
+        index.add([doc])
+    index.merge_factor = merge_factor
+    before = len(index.stats()["segments"])
+    _, merge_s = timed(lambda: index.add(extra[merge_factor:merge_factor + 1]))
+    after = len(index.stats()["segments"])
+
+    print(f"{args.docs} documents, batches of {len(extra)}")
+    print(f"  initial build        whole corpus {full_s:8.3f} s   {args.segments} segments {initial_s:8.3f} s")
+    print(f"  add batch            rebuild      {add_rebuild_s:8.3f} s   new segment  {add_s:8.3f} s")
+    print(f"  delete batch         rebuild      {delete_rebuild_s:8.3f} s   tombstones   {delete_s:8.3f} s")
+    print(f"  flush + tiered merge {before + 1} -> {after} segments in {merge_s:.3f} s")
+    print(f"  BM25 query p50       whole corpus {flat_ms:8.2f} ms  segmented    {segmented_ms:8.2f} ms")
+    print(f"  top-10 agreement     {agree:.3f}")
+
+if __name__ == "__main__":
+    main()
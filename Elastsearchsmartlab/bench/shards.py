@@ -0,0 +1,90 @@
+"""Throughput of sharded scatter-gather scoring as shards (cores) are added.
+
+Builds a synthetic corpus with random unit embeddings and, for each shard
+count, times BM25 and cosine scoring of the whole corpus: the dense path
+the search modes use and the per-shard top-k path. Shard count 0 is the
+single-process baseline, and every sharded top-k is checked against it
+(by score, since documents with tied scores may swap places).
+
+    cd Elastsearchsmartlab
+    python -m bench.shards --docs 200000 --shards 0 1 2 4 8
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+
+def median_ms(fn, queries):
+    times = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling of sharded BM25 and cosine scoring with worker processes")
+    parser.add_argument("--docs", type=int, default=200000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[0, 1, 2, 4, 8], help="0 = single-process baseline")
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    os.environ.setdefault("EMBEDDING_STORE_DIR", tempfile.mkdtemp(prefix="bench-shards-"))
+    from bench.corpus import generate_corpus, generate_queries
+    from utils.embedding_store import get_embedding_store
+    from utils.fusion import top_k
+    from utils.lexical import LexicalIndex
+    from utils.shards import ShardedCorpus
+
+    docs = generate_corpus(args.docs)
+    queries = generate_queries(args.queries)
+    rng = np.random.default_rng(0)
+    store = get_embedding_store("bench-random")
+
+    def encode(texts):
+        return rng.standard_normal((len(texts), args.dim)).astype(np.float32)
+    matrix = store.get_embeddings([doc["title"] for doc in docs], encode)
+    q_embs = {q: rng.standard_normal(args.dim).astype(np.float32) for q in queries}
+    q_embs = {q: v / np.linalg.norm(v) for q, v in q_embs.items()}
+    lexical = LexicalIndex(docs)
+
+    def top_scores(scores):
+        return np.sort(scores[top_k(scores, args.k)])
+    truth = {q: (top_scores(lexical.search(q)), top_scores(matrix @ q_embs[q])) for q in queries}
+
+    print(f"{args.docs} documents, {os.cpu_count()} CPUs")
+    print(f"{'shards':>6} {'build s':>8} {'bm25 ms':>8} {'bm25 qps':>9} {'top-k ms':>9} "
+          f"{'cos ms':>7} {'cos qps':>8} {'top-k ms':>9} {'exact':>6}")
+    for num_shards in args.shards:
+        if num_shards == 0:
+            build_s = 0.0
+            bm25_ms = median_ms(lambda q: lexical.search(q), queries)
+            bm25_top_ms = median_ms(lambda q: top_k(lexical.search(q), args.k), queries)
+            cos_ms = median_ms(lambda q: matrix @ q_embs[q], queries)
+            cos_top_ms = median_ms(lambda q: top_k(matrix @ q_embs[q], args.k), queries)
+            exact = 1.0
+        else:
+            start = time.perf_counter()
+            sharded = ShardedCorpus(docs, num_shards)
+            sharded.ensure_embeddings(store, encode)
+            sharded.semantic(store.model_name, q_embs[queries[0]], args.k)
+            build_s = time.perf_counter() - start
+            bm25_ms = median_ms(lambda q: sharded.bm25(q), queries)
+            bm25_top_ms = median_ms(lambda q: sharded.bm25(q, args.k), queries)
+            cos_ms = median_ms(lambda q: sharded.semantic(store.model_name, q_embs[q]), queries)
+            cos_top_ms = median_ms(lambda q: sharded.semantic(store.model_name, q_embs[q], args.k), queries)
+            hits = [
+                np.allclose(np.sort(sharded.bm25(q, args.k)[1]), truth[q][0]) +
+                np.allclose(np.sort(sharded.semantic(store.model_name, q_embs[q], args.k)[1]), truth[q][1], atol=1e-5)
+                for q in queries
+            ]
+            exact = sum(hits) / (2 * len(queries))
+            sharded.close()
+        print(f"{num_shards or 'none':>6} {build_s:>8.2f} {bm25_ms:>8.2f} {1000 / bm25_ms:>9.0f} {bm25_top_ms:>9.2f} "
+              f"{cos_ms:>7.2f} {1000 / cos_ms:>8.0f} {cos_top_ms:>9.2f} {exact:>6.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import streamlit as st
+from utils.filters import get_filter_index
+from utils.lexical import corpus_fingerprint
+
+def filters_panel(docs):
+    st.sidebar.markdown("---")
+    st.sidebar.markdown("**🏷️ Filters**")
+    st.sidebar.markdown("Narrow the documents before any scoring runs:")
+    index = get_filter_index(docs, corpus_fingerprint(docs))
+    filters = {}
+
+    tags = st.sidebar.multiselect("Tags", index.values("tags"), help="Documents with any (or all) of these tags")
+    if tags:
+        filters["tags"] = tags
+        if len(tags) > 1 and st.sidebar.toggle("Require all selected tags", value=False):
+            filters["tags_match"] = "all"
+    types = st.sidebar.multiselect("Type", index.values("type"))
+    if types:
+        filters["type"] = types
+    authors = st.sidebar.multiselect("Author", index.values("author"))
+    if authors:
+        filters["author"] = authors
+
+    low, high = index.date_bounds()
+    if low is not None and low < high:
+        low, high = low.astype(object), high.astype(object)
+        selected = st.sidebar.date_input("Date range", value=(low, high), min_value=low, max_value=high)
+        # Only filter once a full range different from the corpus bounds is picked
+        if isinstance(selected, (tuple, list)) and len(selected) == 2 and tuple(selected) != (low, high):
+            filters["date_from"] = selected[0].isoformat()
+            filters["date_to"] = selected[1].isoformat()
+
+    return filters or None
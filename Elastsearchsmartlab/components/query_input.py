@@ -16,7 +16,7 @@ def query_input():
         - **Lexical Search (BM25)**: Finds documents with exact keyword matches
         - **Semantic Search**: Finds documents with similar meaning using AI embeddings  
         - **Hybrid Search**: Combines both approaches for better results
-        - **LLM Scoring**: Uses AI to rate document relevance
+        - **LLM Rerank**: Uses AI to rerank the top hybrid candidates
         """)
         
         # Better sample queries section
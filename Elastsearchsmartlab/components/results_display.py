@@ -1,23 +1,76 @@
 import streamlit as st
-from utils.retrieval import get_simulated_results
+from components.trace_panel import trace_panel
+from utils.retrieval import plan_query, rank_plan, SEARCH_MODES
+from utils.search_client import remote_search, SEARCH_API_URL
+from utils.backends import get_backend, SEARCH_BACKEND
+from utils.tracing import start_trace, span
 
-def results_display(query, filters=None, hybrid_weight=0.6, user_docs=None):
-    modes = ["Lexical", "Semantic", "Hybrid", "LLM"]
+def results_display(query, filters=None, hybrid_weight=0.6, user_docs=None, fusion=None):
+    # The search API serves its own corpus, so uploaded documents are always searched in-process
+    if SEARCH_API_URL and user_docs is None:
+        return _remote_results_display(query, filters, hybrid_weight, fusion)
+    if SEARCH_BACKEND != "local":
+        return _backend_results_display(query, filters, hybrid_weight, user_docs, fusion)
+    modes = SEARCH_MODES
+    # One plan per (query, corpus): every signal is scored once and shared by all modes
+    with start_trace("Query plan", query=query) as plan_trace:
+        plan = plan_query(query, filters=filters, user_docs=user_docs)
+    trace_panel(plan_trace.to_dict(), "⏱️ Query planning")
     cols = st.columns(len(modes))
     for idx, m in enumerate(modes):
         with cols[idx]:
             st.markdown(f"#### {m}")
-            results = get_simulated_results(query, m, filters=filters, hybrid_weight=hybrid_weight, user_docs=user_docs)
-            # Always show at least 1 result, even if below threshold
-            filtered_results = [r for r in results if r['score'] >= 0.30]
-            if not filtered_results and results:
-                filtered_results = [results[0]]
-            if not filtered_results:
-                st.info("No results.")
-                continue
-            for i, res in enumerate(filtered_results, 1):
-                st.write(f"**{i}. {res['title']}** — Score: {res['score']:.2f}")
-                st.caption(res['snippet'][:100] + ("..." if len(res['snippet']) > 100 else ""))
-                st.markdown(f"*Author:* {res['author']} | *Date:* {res['date']}")
-                st.markdown(f"_Method: {res['method']}_")
-                st.markdown("---")
+            # Signals are scored lazily, so each column's trace shows the work it triggered
+            with start_trace(m, query=query) as trace:
+                results = rank_plan(plan, m, hybrid_weight=hybrid_weight, fusion=fusion)
+                with span("render", results=len(results)):
+                    _render_results(results, filters)
+            trace_panel(trace.to_dict())
+
+def _remote_results_display(query, filters, hybrid_weight, fusion):
+    try:
+        response = remote_search(query, SEARCH_MODES, filters, hybrid_weight, fusion=fusion)
+    except Exception as e:
+        st.error(f"❌ Search API unavailable ({SEARCH_API_URL}): {e}")
+        return
+    _response_display(response, filters, "search API")
+
+def _backend_results_display(query, filters, hybrid_weight, user_docs, fusion):
+    # Uploads are synced into the backend by app.py when they are ingested
+    backend = get_backend()
+    try:
+        response = backend.search(query, SEARCH_MODES, filters, hybrid_weight, fusion=fusion, user_docs=user_docs)
+    except Exception as e:
+        st.error(f"❌ Search backend '{backend.name}' unavailable: {e}")
+        return
+    _response_display(response, filters, backend.name)
+
+def _response_display(response, filters, source):
+    trace_panel(response["plan_trace"], f"⏱️ Query planning ({source})")
+    cols = st.columns(len(SEARCH_MODES))
+    for idx, m in enumerate(SEARCH_MODES):
+        with cols[idx]:
+            st.markdown(f"#### {m}")
+            _render_results(response["modes"][m]["results"], filters)
+            trace_panel(response["modes"][m]["trace"], f"⏱️ Timings ({source})")
+
+def _render_results(results, filters):
+    # Always show at least 1 result, even if below threshold
+    filtered_results = [r for r in results if r['score'] >= 0.30]
+    if not filtered_results and results:
+        filtered_results = [results[0]]
+    if not filtered_results:
+        st.info("No results." if not filters else "No documents match the selected filters.")
+        return
+    for i, res in enumerate(filtered_results, 1):
+        st.write(f"**{i}. {res['title']}** — Score: {res['score']:.2f}")
+        st.caption(res['snippet'][:100] + ("..." if len(res['snippet']) > 100 else ""))
+        st.markdown(f"*Author:* {res['author']} | *Date:* {res['date']}")
+        st.markdown(f"_Method: {res['method']}_")
+        if "stage_scores" in res:
+            stages = res["stage_scores"]
+            if "rerank" in stages:
+                st.caption(f"Retrieve (hybrid): {stages['retrieve']:.2f} → Rerank (LLM): {stages['rerank']:.2f}")
+            else:
+                st.caption(f"Retrieve (hybrid): {stages['retrieve']:.2f} → Rerank (LLM): unavailable")
+        st.markdown("---")
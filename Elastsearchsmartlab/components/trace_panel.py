@@ -0,0 +1,21 @@
+import streamlit as st
+
+def _format_attrs(attrs):
+    return " · ".join(f"{k}={v}" for k, v in attrs.items() if k != "error")
+
+def trace_panel(trace, label="⏱️ Timings"):
+    # ``trace`` is a Trace.to_dict(), from this process or from the search API
+    with st.expander(f"{label} ({trace['duration_ms']:.0f} ms)", expanded=False):
+        if not trace["spans"]:
+            st.caption("No stages ran; everything came from the query plan cache.")
+        for s in trace["spans"]:
+            indent = "&nbsp;" * 4 * s["depth"]
+            line = f"{indent}`{s['name']}` **{s['duration_ms']:.1f} ms**"
+            details = _format_attrs(s["attrs"])
+            if details:
+                line += f" · {details}"
+            if "error" in s["attrs"]:
+                line += f" · ❌ {s['attrs']['error']}"
+            st.markdown(line, unsafe_allow_html=True)
+        if trace["counters"]:
+            st.caption(" · ".join(f"{name}: {value}" for name, value in sorted(trace["counters"].items())))
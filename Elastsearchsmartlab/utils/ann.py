@@ -0,0 +1,161 @@
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils.fusion import top_k
+
+# "auto" switches to IVF once the corpus reaches ANN_MIN_DOCS, "ivf" always
+# uses it and "exact" always brute-forces
+ANN_MODE = os.environ.get("SEMANTIC_ANN", "auto")
+ANN_MIN_DOCS = int(os.environ.get("SEMANTIC_ANN_MIN_DOCS", 20000))
+ANN_NPROBE = int(os.environ.get("SEMANTIC_ANN_NPROBE", 16))
+
+def use_ann(num_docs, mode=None):
+    mode = mode or ANN_MODE
+    if mode == "exact":
+        return False
+    if mode == "ivf":
+        return True
+    return num_docs >= ANN_MIN_DOCS
+
+def default_nlist(num_docs):
+    return max(1, min(int(4 * np.sqrt(num_docs)), num_docs))
+
+def exact_search(vectors, q, k):
+    scores = vectors @ q
+    top = top_k(scores, k)
+    return top, scores[top]
+
+class IVFFlatIndex:
+    """Inverted-file index over L2-normalised vectors.
+
+    Vectors are clustered with spherical k-means into ``nlist`` lists; a
+    query scans only the ``nprobe`` lists whose centroids are closest, so
+    ``nprobe`` trades recall for latency (``nprobe == nlist`` is exact).
+    """
+
+    def __init__(self, vectors, nlist=None, n_iter=10, train_size=None, seed=0, chunk_size=65536):
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(self.vectors)
+        self.nlist = nlist or default_nlist(n)
+        self.chunk_size = chunk_size
+        rng = np.random.default_rng(seed)
+        train_size = min(n, train_size or max(self.nlist * 64, 10000))
+        sample = self.vectors[rng.choice(n, train_size, replace=False)] if train_size < n else self.vectors
+        self.centroids = self._train(sample, n_iter, rng)
+        assignments = self._assign(self.vectors, self.centroids)
+        self.order = np.argsort(assignments, kind="stable").astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=self.nlist))])
+
+    def _assign(self, vectors, centroids):
+        out = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.chunk_size):
+            chunk = vectors[start:start + self.chunk_size]
+            out[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        return out
+
+    def _train(self, sample, n_iter, rng):
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=self.nlist)
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = (sums / np.maximum(norms, 1e-8)).astype(np.float32)
+        return centroids
+
+    def candidates(self, q, nprobe=None):
+        nprobe = min(nprobe or ANN_NPROBE, self.nlist)
+        probe = top_k(self.centroids @ q, nprobe)
+        ids = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+        return ids, self.vectors[ids] @ q
+
+    def search(self, q, k, nprobe=None):
+        ids, scores = self.candidates(q, nprobe)
+        top = top_k(scores, k)
+        return ids[top], scores[top]
+
+_INDEX_CACHE = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+
+def get_ann_index(key, vectors, **params):
+    with _INDEX_LOCK:
+        index = _INDEX_CACHE.get(key)
+        if index is not None:
+            _INDEX_CACHE.move_to_end(key)
+            return index
+    index = IVFFlatIndex(vectors, **params)
+    with _INDEX_LOCK:
+        _INDEX_CACHE[key] = index
+        while len(_INDEX_CACHE) > 4:
+            _INDEX_CACHE.popitem(last=False)
+    return index
+
+def recall_report(vectors, queries, k=10, nlists=(None,), nprobes=(1, 4, 8, 16, 32, 64)):
+    """Recall@k and mean latency of IVF settings against exact search."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    start = time.perf_counter()
+    truth = [set(exact_search(vectors, q, k)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    rows = []
+    for nlist in nlists:
+        start = time.perf_counter()
+        index = IVFFlatIndex(vectors, nlist=nlist)
+        build_s = time.perf_counter() - start
+        for nprobe in nprobes:
+            if nprobe > index.nlist:
+                continue
+            hits = 0
+            start = time.perf_counter()
+            for q, expected in zip(queries, truth):
+                ids, _ = index.search(q, k, nprobe=nprobe)
+                hits += len(expected.intersection(ids.tolist()))
+            ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            rows.append({
+                "nlist": index.nlist,
+                "nprobe": nprobe,
+                "recall_at_k": hits / (k * len(queries)),
+                "ann_ms": ann_ms,
+                "exact_ms": exact_ms,
+                "build_s": build_s,
+            })
+    return rows
+
+def _synthetic_vectors(n, dim, clusters, rng):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs exact search report for the IVF-flat index")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, nargs="*", default=[None])
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument("--store", help="Use vectors from the embedding store of this model instead of synthetic ones")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    if args.store:
+        from utils.embedding_store import get_embedding_store
+        store = get_embedding_store(args.store)
+        vectors = store.all_vectors()
+    else:
+        vectors = _synthetic_vectors(args.docs, args.dim, max(1, args.docs // 100), rng)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    print(f"{'nlist':>6} {'nprobe':>6} {'recall@' + str(args.k):>10} {'ann ms':>8} {'exact ms':>9} {'build s':>8}")
+    for row in recall_report(vectors, queries, args.k, args.nlist, args.nprobe):
+        print(f"{row['nlist']:>6} {row['nprobe']:>6} {row['recall_at_k']:>10.3f} {row['ann_ms']:>8.2f} {row['exact_ms']:>9.2f} {row['build_s']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import numpy as np
+from utils.clients import get_http_session, get_secret
+from utils.dummy_docs import DOCS
+from utils.embedding_store import get_embedding_store
+from utils.filters import TERM_FIELDS, get_filter_index
+from utils.fusion import RRF_K, max_norm, min_max, top_k as top_k_indices
+from utils.lexical import corpus_fingerprint, get_lexical_index
+from utils.result_cache import cached_query_embedding
+from utils.retrieval import search, embedding_backend, SEARCH_MODES, MODE_METHODS
+from utils.tracing import span, incr, start_trace
+
+# Where searches run: "local" (the in-process engine) or "elasticsearch"
+# (an Elasticsearch-compatible REST endpoint at ES_URL)
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "local")
+SEARCH_BACKENDS = ("local", "elasticsearch")
+ES_URL = os.environ.get("ES_URL", "http://localhost:9200").rstrip("/")
+ES_INDEX = os.environ.get("ES_INDEX", "smart-query-lab")
+ES_TIMEOUT = float(os.environ.get("ES_TIMEOUT", 30))
+# Documents per _bulk request, and kNN candidates examined per shard
+ES_BULK_SIZE = int(os.environ.get("ES_BULK_SIZE", 500))
+ES_NUM_CANDIDATES = int(os.environ.get("ES_NUM_CANDIDATES", 100))
+
+# Modes the cluster ranks itself; the LLM modes are always ranked in-process
+ES_MODES = ("Lexical", "Semantic", "Hybrid")
+ES_METHODS = {
+    "Lexical": "Elasticsearch BM25 (match)",
+    "Semantic": "Elasticsearch kNN (dense_vector)",
+    "Hybrid": "Elasticsearch BM25 + kNN",
+}
+
+class ElasticsearchError(RuntimeError):
+    pass
+
+class SearchBackend:
+    """Where queries run.
+
+    ``index`` makes a corpus searchable (idempotently: an already indexed
+    corpus is skipped) and ``search`` ranks a query under each mode,
+    returning the same dict as ``utils.retrieval.search``.
+    """
+
+    name = None
+
+    def index(self, docs, fingerprint=None):
+        raise NotImplementedError
+
+    def search(self, query, modes=None, filters=None, hybrid_weight=0.6, top_k=5, fusion=None, user_docs=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class LocalBackend(SearchBackend):
+    """The in-process engine in ``utils/retrieval.py``."""
+
+    name = "local"
+
+    def index(self, docs, fingerprint=None):
+        fingerprint = fingerprint or corpus_fingerprint(docs)
+        # Segmented snapshots carry their own per-segment indexes
+        if getattr(docs, "segments", None) is None:
+            get_lexical_index(docs, fingerprint)
+            get_filter_index(docs, fingerprint)
+        return len(docs)
+
+    def search(self, query, modes=None, filters=None, hybrid_weight=0.6, top_k=5, fusion=None, user_docs=None):
+        return search(query, modes, filters, hybrid_weight, top_k, fusion, user_docs)
+
+def es_filter_clauses(filters):
+    # The FilterIndex semantics as Elasticsearch filter clauses; keyword
+    # fields are mapped with a lowercase normalizer, so matching is case-insensitive
+    clauses = []
+    for field in TERM_FIELDS:
+        values = (filters or {}).get(field)
+        if not values:
+            continue
+        values = [str(v).lower() for v in (values if isinstance(values, (list, tuple, set)) else [values])]
+        if field == "tags" and filters.get("tags_match") == "all":
+            clauses.extend({"term": {field: value}} for value in values)
+        else:
+            clauses.append({"terms": {field: values}})
+    dates = {}
+    if (filters or {}).get("date_from"):
+        dates["gte"] = str(filters["date_from"])
+    if (filters or {}).get("date_to"):
+        dates["lte"] = str(filters["date_to"])
+    if dates:
+        clauses.append({"range": {"date": dates}})
+    return clauses
+
+def index_body(dims, meta):
+    keyword = {"type": "keyword", "normalizer": "lowercase"}
+    return {
+        "settings": {"analysis": {"normalizer": {"lowercase": {"type": "custom", "filter": ["lowercase"]}}}},
+        "mappings": {
+            # What is indexed, so a restarted process can tell whether to reindex
+            "_meta": meta,
+            "properties": {
+                # BM25 runs on title and snippet as one field, like the local index
+                "title": {"type": "text", "copy_to": "text"},
+                "snippet": {"type": "text", "copy_to": "text"},
+                "text": {"type": "text"},
+                "date": {"type": "date", "format": "yyyy-MM-dd", "ignore_malformed": True},
+                "author": keyword,
+                "type": keyword,
+                "tags": keyword,
+                "embedding": {"type": "dense_vector", "dims": dims, "index": True, "similarity": "cosine"},
+            },
+        },
+    }
+
+def linear_blend(lexical_hits, knn_hits, hybrid_weight, top_k):
+    # The local engine's linear fusion over the two candidate lists: BM25 is
+    # divided by its best score (unmatched documents score 0, as locally)
+    # and kNN is min-max scaled; a document missing from a list gets 0 for it
+    ids = list(dict.fromkeys(hit["_id"] for hit in lexical_hits + knn_hits))
+    position = {doc_id: n for n, doc_id in enumerate(ids)}
+    lexical = np.zeros(len(ids), dtype=np.float32)
+    semantic = np.zeros(len(ids), dtype=np.float32)
+    for hit in lexical_hits:
+        lexical[position[hit["_id"]]] = hit["_score"] or 0.0
+    if knn_hits:
+        rows = [position[hit["_id"]] for hit in knn_hits]
+        semantic[rows] = min_max(np.array([hit["_score"] or 0.0 for hit in knn_hits], dtype=np.float32))
+    fused = hybrid_weight * semantic + (1 - hybrid_weight) * max_norm(lexical)
+    return [(ids[i], float(fused[i])) for i in top_k_indices(fused, top_k)]
+
+def local_scale(mode, hits):
+    # Hit scores on the local engine's scales, so a score threshold keeps the
+    # same results on either backend: BM25 divided by the best score (the
+    # corpus maximum, as max_norm does locally), kNN's (1 + cos) / 2 back to
+    # the cosine, and the two-retriever rrf sum scaled to 1 for a document
+    # ranked first by both, like reciprocal_rank_fusion
+    scores = np.array([hit["_score"] or 0.0 for hit in hits], dtype=np.float32)
+    if mode == "Lexical":
+        return max_norm(scores)
+    if mode == "Semantic":
+        return 2 * scores - 1
+    return scores * (RRF_K + 1) / 2
+
+def _digest(doc):
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _ndjson(lines):
+    return "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+
+class ElasticsearchBackend(SearchBackend):
+    """An Elasticsearch-compatible cluster, over pooled HTTP connections.
+
+    Documents are written with ``_bulk`` together with their title
+    embeddings, computed by the engine's embedding backend so the cluster's
+    kNN and the local semantic mode use the same vectors. A search sends
+    every mode as one ``_msearch`` round trip: a BM25 ``match``, a ``knn``
+    search, and the hybrid as an ``rrf`` retriever or, for ``linear``
+    fusion, both candidate lists blended here by ``linear_blend``. The LLM
+    modes are ranked in-process over the same documents.
+
+    Each corpus and embedding model gets its own index under ``ES_INDEX``.
+    A segmented upload keeps one index for its whole life, named after its
+    uid: each generation only writes the documents added or changed since
+    the last sync and deletes the removed ones. Any other corpus is
+    immutable and named after its fingerprint, so indexing a new corpus
+    never deletes one that searches may still be reading.
+    """
+
+    name = "elasticsearch"
+
+    def __init__(self, url=None, index=None, timeout=None, bulk_size=None):
+        self.url = (url or ES_URL).rstrip("/")
+        self.index_name = index or ES_INDEX
+        self.timeout = timeout or ES_TIMEOUT
+        self.bulk_size = bulk_size or ES_BULK_SIZE
+        # Index name -> fingerprint of the corpus version it holds
+        self._indexed = {}
+        # Index name -> {document key: (segment id, content digest)} of a segmented corpus
+        self._synced = {}
+        # Corpus identity -> its index, so a rebuild for another model drops the old one
+        self._corpus_index = {}
+        # Guards only these dicts; indexing runs under its index's own lock
+        self._lock = threading.Lock()
+        self._index_locks = {}
+
+    def _headers(self, ndjson=False):
+        headers = {"Content-Type": "application/x-ndjson" if ndjson else "application/json"}
+        api_key = get_secret("es_api_key")
+        if api_key:
+            headers["Authorization"] = f"ApiKey {api_key}"
+        return headers
+
+    def _request(self, method, path, body=None, ndjson=None, allow=()):
+        auth = None
+        if not get_secret("es_api_key") and get_secret("es_username"):
+            auth = (get_secret("es_username"), get_secret("es_password") or "")
+        response = get_http_session().request(
+            method, f"{self.url}{path}",
+            data=ndjson if ndjson is not None else (json.dumps(body).encode("utf-8") if body is not None else None),
+            headers=self._headers(ndjson is not None), auth=auth, timeout=self.timeout,
+        )
+        if response.status_code in allow:
+            return None
+        if response.status_code >= 400:
+            try:
+                error = response.json().get("error")
+                reason = error.get("reason") if isinstance(error, dict) else error
+            except ValueError:
+                reason = response.text[:200]
+            raise ElasticsearchError(f"{method} {path} returned {response.status_code}: {reason}")
+        return response.json()
+
+    def index_for(self, identity, model_name):
+        # Lowercase hex, as index names must be lowercase
+        key = hashlib.sha1(f"{identity}:{model_name}".encode("utf-8")).hexdigest()[:12]
+        return f"{self.index_name}-{key}"
+
+    def corpus_index(self, docs, fingerprint, model_name):
+        return self.index_for(getattr(docs, "uid", None) or fingerprint, model_name)
+
+    def indexed_meta(self, name):
+        mapping = self._request("GET", f"/{name}/_mapping", allow=(404,))
+        if not mapping:
+            return None
+        return next(iter(mapping.values()), {}).get("mappings", {}).get("_meta") or {}
+
+    def index(self, docs, fingerprint=None):
+        fingerprint = fingerprint or corpus_fingerprint(docs)
+        model_name, encode, _ = embedding_backend()
+        identity = getattr(docs, "uid", None) or fingerprint
+        name = self.index_for(identity, model_name)
+        if self._indexed.get(name) == fingerprint:
+            return 0
+        with self._lock:
+            lock = self._index_locks.setdefault(name, threading.Lock())
+        # Encoding and _bulk calls only hold up callers indexing the same index
+        with lock:
+            if self._indexed.get(name) == fingerprint:
+                return 0
+            with span("es.index", docs=len(docs), index=name):
+                if getattr(docs, "uid", None):
+                    written = self._sync(name, docs, model_name, encode)
+                else:
+                    written = self._ensure(name, docs, fingerprint, model_name, encode)
+        with self._lock:
+            self._indexed[name] = fingerprint
+            previous = self._corpus_index.get(identity)
+            self._corpus_index[identity] = name
+        if previous not in (None, name):
+            # Rebuilt for another embedding model; the old vectors are never searched again
+            self._request("DELETE", f"/{previous}", allow=(404,))
+            with self._lock:
+                self._indexed.pop(previous, None)
+                self._synced.pop(previous, None)
+        return written
+
+    def _ensure(self, name, docs, fingerprint, model_name, encode):
+        # An immutable corpus: a complete index is reused as is, by any process
+        meta = self.indexed_meta(name)
+        if meta is not None and meta.get("docs") == len(docs) and \
+                self._request("GET", f"/{name}/_count")["count"] == len(docs):
+            return 0
+        # An index left incomplete by an interrupted build was never searched
+        if meta is not None:
+            self._request("DELETE", f"/{name}", allow=(404,))
+        # Document ids are corpus positions
+        positions = range(len(docs))
+        self._write(name, docs, positions, [str(i) for i in positions], encode, model_name,
+                    create={"fingerprint": fingerprint, "model": model_name, "docs": len(docs)})
+        return len(docs)
+
+    def _sync(self, name, docs, model_name, encode):
+        # Document ids are document keys. A merge moves documents to a new
+        # segment without changing them, so only moved documents whose
+        # content differs are written again
+        synced = self._synced.get(name) or {}
+        entries = docs.entries()
+        live = {key for key, _ in entries}
+        deletes = [key for key in synced if key not in live]
+        positions, written = [], {}
+        for position, (key, segment_id) in enumerate(entries):
+            known = synced.get(key)
+            if known is not None and known[0] == segment_id:
+                continue
+            digest = _digest(docs[position])
+            if known is not None and known[1] == digest:
+                synced[key] = (segment_id, digest)
+                continue
+            positions.append(position)
+            written[key] = (segment_id, digest)
+        # An index holding nothing this process wrote (new, emptied, or left
+        # by an earlier process) is created afresh, with the right dimensions
+        create = {"corpus": docs.uid, "model": model_name} if not synced else None
+        if create:
+            self._request("DELETE", f"/{name}", allow=(404,))
+        self._write(name, docs, positions, [entries[p][0] for p in positions], encode, model_name,
+                    deletes=deletes, create=create)
+        for key in deletes:
+            del synced[key]
+        synced.update(written)
+        self._synced[name] = synced
+        return len(positions) + len(deletes)
+
+    def _write(self, name, docs, positions, ids, encode, model_name, deletes=(), create=None):
+        # ``create`` is the _meta of an index to create before the first write
+        store = get_embedding_store(model_name)
+        for start in range(0, len(positions), self.bulk_size):
+            chunk = [docs[int(i)] for i in positions[start:start + self.bulk_size]]
+            with span("es.embed", docs=len(chunk)):
+                vectors = store.vectors_at(store.get_rows([doc["title"] for doc in chunk], encode))
+            if create is not None:
+                self._request("PUT", f"/{name}", index_body(vectors.shape[1], create))
+                create = None
+            lines = []
+            for doc_id, doc, vector in zip(ids[start:start + self.bulk_size], chunk, vectors):
+                lines.append({"index": {"_index": name, "_id": doc_id}})
+                lines.append({**doc, "embedding": [round(float(v), 6) for v in vector]})
+            self._bulk(lines, len(chunk))
+        if create is not None:
+            self._request("PUT", f"/{name}", index_body(1, create))
+        for start in range(0, len(deletes), self.bulk_size):
+            chunk = deletes[start:start + self.bulk_size]
+            self._bulk([{"delete": {"_index": name, "_id": key}} for key in chunk], len(chunk))
+        if len(positions) or deletes:
+            self._request("POST", f"/{name}/_refresh")
+
+    def _bulk(self, lines, num_docs):
+        with span("es.bulk", docs=num_docs):
+            response = self._request("POST", "/_bulk", ndjson=_ndjson(lines))
+        if response.get("errors"):
+            failed = [item for item in response["items"] if next(iter(item.values())).get("error")]
+            incr("errors", stage="es.bulk")
+            logging.error(f"Elasticsearch bulk errors: {[next(iter(f.values()))['error'] for f in failed[:3]]}")
+            raise ElasticsearchError(f"{len(failed)} of {num_docs} documents were not written")
+
+    def _bodies(self, modes, query, q_emb, filters, hybrid_weight, top_k, fusion):
+        clauses = es_filter_clauses(filters)
+        match = {"match": {"text": {"query": query}}}
+        num_candidates = max(top_k, ES_NUM_CANDIDATES)
+        knn = {"field": "embedding", "query_vector": q_emb, "k": top_k, "num_candidates": num_candidates}
+        if clauses:
+            knn["filter"] = {"bool": {"filter": clauses}}
+        lexical = {"bool": {"must": [match], "filter": clauses}}
+        source = {"excludes": ["embedding", "text"]}
+        # (mode, body) pairs; a mode may need more than one search
+        searches = []
+        for mode in modes:
+            if mode == "Lexical":
+                searches.append((mode, {"query": lexical, "size": top_k, "_source": source}))
+            elif mode == "Semantic":
+                searches.append((mode, {"knn": knn, "size": top_k, "_source": source}))
+            elif (fusion or "linear") == "rrf":
+                searches.append((mode, {"retriever": {"rrf": {
+                    "retrievers": [{"standard": {"query": lexical}}, {"knn": knn}],
+                    "rank_constant": RRF_K,
+                    "rank_window_size": num_candidates,
+                }}, "size": top_k, "_source": source}))
+            else:
+                # Raw BM25 and kNN scores are on unrelated scales, so both
+                # candidate lists come back for linear_blend
+                searches.append((mode, {"query": lexical, "size": num_candidates, "_source": source}))
+                searches.append((mode, {"knn": {**knn, "k": num_candidates}, "size": num_candidates, "_source": source}))
+        return searches
+
+    def search(self, query, modes=None, filters=None, hybrid_weight=0.6, top_k=5, fusion=None, user_docs=None):
+        modes = modes or SEARCH_MODES
+        unknown = [m for m in modes if m not in MODE_METHODS]
+        if unknown:
+            raise ValueError(f"Unknown search mode(s): {', '.join(unknown)}")
+        docs = user_docs if user_docs is not None else DOCS
+        remote = [m for m in modes if m in ES_MODES]
+        local = [m for m in modes if m not in ES_MODES]
+        by_mode = {}
+        with start_trace("Query plan", query=query, backend=self.name) as plan_trace:
+            if remote:
+                fingerprint = corpus_fingerprint(docs)
+                model_name, _, encode_query = embedding_backend()
+                name = self.corpus_index(docs, fingerprint, model_name)
+                # Corpora are indexed when loaded or uploaded; only one never
+                # indexed before (e.g. the sample documents) is indexed here.
+                # A newer generation of an upload is searched as last synced
+                if name not in self._indexed:
+                    self.index(docs, fingerprint)
+                if any(m != "Lexical" for m in remote):
+                    with span("es.embed_query", model=model_name):
+                        q_emb = np.asarray(cached_query_embedding(model_name, query, encode_query), dtype=np.float32)
+                        q_emb = [round(float(v), 6) for v in q_emb / (np.linalg.norm(q_emb) + 1e-8)]
+                else:
+                    q_emb = None
+                searches = self._bodies(remote, query, q_emb, filters, hybrid_weight, top_k, fusion)
+                lines = []
+                for _, body in searches:
+                    lines.extend([{"index": name}, body])
+                with span("es.msearch", searches=len(searches)):
+                    responses = self._request("POST", "/_msearch", ndjson=_ndjson(lines))["responses"]
+        grouped = {}
+        for (mode, _), response in zip(searches if remote else [], responses if remote else []):
+            grouped.setdefault(mode, []).append(response)
+        for mode in remote:
+            with start_trace(mode, query=query, backend=self.name) as trace:
+                for response in grouped[mode]:
+                    if "error" in response:
+                        incr("errors", stage="es.msearch")
+                        error = response["error"]
+                        raise ElasticsearchError(f"{mode} search failed: {error.get('reason', error) if isinstance(error, dict) else error}")
+                hits = [response["hits"]["hits"] for response in grouped[mode]]
+                with span("es.hits", hits=sum(len(h) for h in hits)):
+                    if len(hits) == 2:
+                        sources = {hit["_id"]: hit["_source"] for hit in hits[0] + hits[1]}
+                        results = [
+                            {**sources[doc_id], "score": score, "method": ES_METHODS[mode]}
+                            for doc_id, score in linear_blend(*hits, hybrid_weight, top_k)
+                        ]
+                    else:
+                        results = [
+                            {**hit["_source"], "score": float(score), "method": ES_METHODS[mode]}
+                            for hit, score in zip(hits[0], local_scale(mode, hits[0]))
+                        ]
+            by_mode[mode] = {"results": results, "trace": trace.to_dict()}
+        if local:
+            by_mode.update(search(query, local, filters, hybrid_weight, top_k, fusion, user_docs)["modes"])
+        return {"query": query, "plan_trace": plan_trace.to_dict(), "modes": {m: by_mode[m] for m in modes}}
+
+_BACKENDS = {}
+_BACKENDS_LOCK = threading.Lock()
+
+def get_backend(name=None):
+    name = name or SEARCH_BACKEND
+    if name not in SEARCH_BACKENDS:
+        raise ValueError(f"Unknown SEARCH_BACKEND '{name}'; expected one of {', '.join(SEARCH_BACKENDS)}")
+    with _BACKENDS_LOCK:
+        backend = _BACKENDS.get(name)
+        if backend is None:
+            backend = _BACKENDS[name] = LocalBackend() if name == "local" else ElasticsearchBackend()
+        return backend
@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+
+# Process-wide pool of provider clients and resolved secrets, shared by
+# retrieval and explanations so connections are reused across requests
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 32))
+# Streamlit-style secrets files, read directly so the engine runs without
+# Streamlit; earlier paths win, then the environment
+# Set but empty, SECRETS_PATH reads no files at all (environment variables only)
+SECRETS_PATHS = [p for p in os.environ["SECRETS_PATH"].split(os.pathsep) if p] if "SECRETS_PATH" in os.environ else [
+    os.path.join(".streamlit", "secrets.toml"),
+    os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"),
+]
+
+_CLIENTS = {}
+# Guards only the two dicts; each client is created under its own key's lock
+_CLIENTS_LOCK = threading.Lock()
+_CREATE_LOCKS = {}
+_SECRETS = {}
+_SECRETS_LOCK = threading.Lock()
+_SECRETS_FILE = None
+
+def _read_toml(path):
+    try:
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except ImportError:
+        # Python < 3.11
+        import toml
+        return toml.load(path)
+
+def _file_secrets():
+    global _SECRETS_FILE
+    if _SECRETS_FILE is None:
+        _SECRETS_FILE = {}
+        for path in reversed(SECRETS_PATHS):
+            if not os.path.exists(path):
+                continue
+            try:
+                _SECRETS_FILE.update(_read_toml(path))
+            except Exception as e:
+                logging.error(f"Could not read secrets file {path}: {e}")
+    return _SECRETS_FILE
+
+def get_secret(name):
+    with _SECRETS_LOCK:
+        if name not in _SECRETS:
+            _SECRETS[name] = _file_secrets().get(name) or os.environ.get(name.upper()) or os.environ.get(name)
+        return _SECRETS[name]
+
+def clear_secrets():
+    global _SECRETS_FILE
+    with _SECRETS_LOCK:
+        _SECRETS.clear()
+        _SECRETS_FILE = None
+
+def _get_or_create(key, factory):
+    # A slow factory (a model load) blocks only callers of the same key
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is not None:
+            return client
+        lock = _CREATE_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(key)
+        if client is None:
+            client = factory()
+            with _CLIENTS_LOCK:
+                _CLIENTS[key] = client
+                _CREATE_LOCKS.pop(key, None)
+        return client
+
+def get_http_session():
+    def create():
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+    return _get_or_create(("http",), create)
+
+def get_openai_client(api_key, timeout=None):
+    def create():
+        import openai
+        kwargs = {"api_key": api_key}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return openai.OpenAI(**kwargs)
+    return _get_or_create(("openai", api_key, timeout), create)
+
+def get_cohere_client(api_key, timeout=None):
+    def create():
+        import cohere
+        if timeout is not None:
+            return cohere.Client(api_key, timeout=timeout)
+        return cohere.Client(api_key)
+    return _get_or_create(("cohere", api_key, timeout), create)
+
+def get_gemini_model(api_key, model):
+    def create():
+        import google.generativeai as genai
+        # genai keeps a single global configuration
+        genai.configure(api_key=api_key)
+        return genai.GenerativeModel(model)
+    return _get_or_create(("gemini", api_key, model), create)
+
+def get_sentence_transformer(model_name):
+    def create():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device="cpu")
+    return _get_or_create(("sentence-transformers", model_name), create)
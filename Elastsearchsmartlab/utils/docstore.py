@@ -0,0 +1,215 @@
+import argparse
+import json
+import operator
+import os
+from array import array
+from collections.abc import Sequence
+import numpy as np
+from utils.lexical import CorpusHasher
+
+# Documents in the DOCS schema: free text is stored as UTF-8 buffers with an
+# offsets table, short values (date, author, type, tags) as codes into one
+# shared vocabulary of interned strings
+TEXT_FIELDS = ("title", "snippet")
+CODE_FIELDS = ("date", "author", "type")
+DOCSTORE_VERSION = 1
+
+def _code_dtype(size):
+    return np.uint16 if size <= np.iinfo(np.uint16).max + 1 else np.int32
+
+class DocStoreBuilder:
+    """Accumulates documents chunk by chunk into columns; ``build`` returns the DocStore."""
+
+    def __init__(self):
+        self.vocab = []
+        self._codes = {}
+        self.text = {field: bytearray() for field in TEXT_FIELDS}
+        self.offsets = {field: array("q", [0]) for field in TEXT_FIELDS}
+        self.codes = {field: array("i") for field in CODE_FIELDS}
+        self.tag_codes = array("i")
+        self.tag_offsets = array("q", [0])
+
+    def __len__(self):
+        return len(self.codes["date"])
+
+    def _code(self, value):
+        value = "" if value is None else str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.vocab)
+            self.vocab.append(value)
+        return code
+
+    def add(self, docs):
+        for doc in docs:
+            for field in TEXT_FIELDS:
+                self.text[field] += str(doc.get(field) or "").encode("utf-8")
+                self.offsets[field].append(len(self.text[field]))
+            for field in CODE_FIELDS:
+                self.codes[field].append(self._code(doc.get(field)))
+            tags = doc.get("tags") or []
+            self.tag_codes.extend(self._code(tag) for tag in (tags if isinstance(tags, list) else [tags]))
+            self.tag_offsets.append(len(self.tag_codes))
+
+    def build(self, fingerprint=None):
+        dtype = _code_dtype(len(self.vocab))
+        columns = {}
+        for field in TEXT_FIELDS:
+            columns[f"{field}_text"] = np.frombuffer(bytes(self.text[field]), dtype=np.uint8)
+            columns[f"{field}_offsets"] = np.frombuffer(self.offsets[field], dtype=np.int64).copy()
+        for field in CODE_FIELDS:
+            columns[field] = np.frombuffer(self.codes[field], dtype=np.int32).astype(dtype)
+        columns["tag_codes"] = np.frombuffer(self.tag_codes, dtype=np.int32).astype(dtype)
+        columns["tag_offsets"] = np.frombuffer(self.tag_offsets, dtype=np.int64).copy()
+        return DocStore(columns, self.vocab, fingerprint=fingerprint)
+
+class DocStore(Sequence):
+    """A read-only document collection held column by column.
+
+    It is a sequence of documents, so it stands in for the list of dicts
+    anywhere; ``docs[i]`` builds the dict for one document on demand, so
+    only the results actually shown are ever materialised. Slicing and
+    ``take`` return views over the same columns. A store saved with
+    ``save`` is opened memory-mapped by ``open_docstore``, so forked or
+    restarted processes share its pages instead of re-parsing the corpus.
+    Only the DOCS schema fields are kept.
+    """
+
+    def __init__(self, columns, vocab, rows=None, fingerprint=None):
+        self.columns = columns
+        self.vocab = vocab
+        self.rows = rows
+        self._fingerprint = fingerprint
+
+    @classmethod
+    def from_docs(cls, docs, fingerprint=None):
+        builder = DocStoreBuilder()
+        builder.add(docs)
+        return builder.build(fingerprint)
+
+    def __len__(self):
+        return len(self.rows) if self.rows is not None else len(self.columns["date"])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(np.arange(len(self))[i])
+        i = operator.index(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+        return self._doc(int(self.rows[i]) if self.rows is not None else i)
+
+    def __iter__(self):
+        for row in (self.rows if self.rows is not None else range(len(self))):
+            yield self._doc(int(row))
+
+    def take(self, ids):
+        """A view of the documents at positions ``ids``, sharing these columns."""
+        ids = np.asarray(ids, dtype=np.int64)
+        return DocStore(self.columns, self.vocab, ids if self.rows is None else self.rows[ids])
+
+    def _text(self, field, row):
+        offsets = self.columns[f"{field}_offsets"]
+        return self.columns[f"{field}_text"][offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def _doc(self, row):
+        vocab = self.vocab
+        offsets = self.columns["tag_offsets"]
+        return {
+            "title": self._text("title", row),
+            "snippet": self._text("snippet", row),
+            "date": vocab[self.columns["date"][row]],
+            "author": vocab[self.columns["author"][row]],
+            "tags": [vocab[c] for c in self.columns["tag_codes"][offsets[row]:offsets[row + 1]]],
+            "type": vocab[self.columns["type"][row]],
+        }
+
+    def titles(self):
+        # The one field every query path reads in bulk (embedding lookups)
+        rows = self.rows if self.rows is not None else range(len(self))
+        return [self._text("title", row) for row in rows]
+
+    @property
+    def fingerprint(self):
+        # Same digest as corpus_fingerprint over the equivalent list of dicts
+        if self._fingerprint is None:
+            hasher = CorpusHasher()
+            hasher.update(self)
+            self._fingerprint = hasher.hexdigest()
+        return self._fingerprint
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values()) + sum(len(v) for v in self.vocab)
+
+    def save(self, directory):
+        if self.rows is not None:
+            return DocStore.from_docs(self, self.fingerprint).save(directory)
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), column)
+        with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        # Written last: a directory without it is an incomplete store
+        meta = {"version": DOCSTORE_VERSION, "docs": len(self), "fingerprint": self.fingerprint,
+                "columns": sorted(self.columns)}
+        tmp_path = os.path.join(directory, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(directory, "meta.json"))
+        return directory
+
+class DocView(Sequence):
+    """The documents of any sequence at positions ``ids``, fetched on access."""
+
+    def __init__(self, docs, ids):
+        self.docs = docs
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(np.arange(len(self))[i])
+        return self.docs[int(self.ids[i])]
+
+    def take(self, ids):
+        return DocView(self.docs, self.ids[np.asarray(ids, dtype=np.int64)])
+
+    def titles(self):
+        return [self.docs[int(i)]["title"] for i in self.ids]
+
+def is_docstore(path):
+    return os.path.isfile(os.path.join(path, "meta.json"))
+
+def open_docstore(directory):
+    """Open a saved DocStore with its columns memory-mapped read-only."""
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("version") != DOCSTORE_VERSION:
+        raise ValueError(f"{directory}: unsupported document store version {meta.get('version')}")
+    with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+        vocab = json.load(f)
+    columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in meta["columns"]}
+    return DocStore(columns, vocab, fingerprint=meta["fingerprint"])
+
+def doc_titles(docs):
+    return docs.titles() if hasattr(docs, "titles") else [doc["title"] for doc in docs]
+
+def main():
+    from utils.ingest import ingest
+    parser = argparse.ArgumentParser(description="Build a memory-mappable document store from a JSON/JSONL corpus")
+    parser.add_argument("corpus", help="JSON array or JSONL file of documents")
+    parser.add_argument("output", help="directory to write the store to")
+    args = parser.parse_args()
+    with open(args.corpus, "rb") as f:
+        result = ingest(f, build_index=False)
+    if result.skipped:
+        print(f"Skipped {result.skipped} invalid records: {result.errors[:3]}")
+    result.docs.save(args.output)
+    print(f"{len(result.docs)} documents, {result.docs.nbytes / 2**20:.1f} MB -> {args.output}")
+
+if __name__ == "__main__":
+    main()
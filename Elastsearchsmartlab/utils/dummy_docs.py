@@ -81,3 +81,12 @@ DOCS = [
         "type": "Whitepaper"
     },
 ]
+
+# Example queries offered in the sidebar, also pre-ranked into the result cache at startup
+SAMPLE_QUERIES = [
+    "elasticsearch performance",
+    "bm25 ranking",
+    "semantic vector search",
+    "hybrid retrieval",
+    "scaling search systems",
+]
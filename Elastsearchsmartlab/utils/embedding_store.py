@@ -0,0 +1,225 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from utils.tracing import incr
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialised within a process
+    fcntl = None
+
+DEFAULT_STORE_DIR = os.environ.get(
+    "EMBEDDING_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "embeddings"),
+)
+
+# A 40-character sha1 hex digest and a newline per row of hashes.log
+HASH_LINE_BYTES = 41
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-8)
+
+class EmbeddingStore:
+    """Content-addressed, on-disk embedding store for a single model.
+
+    Vectors are L2-normalised and appended to a raw float32 file that is
+    memory-mapped for reads; ``hashes.log`` holds the text hash of each row,
+    one fixed-width line per row, so appending never rewrites it. Only texts
+    that have never been seen by this model are encoded. Appends take a file
+    lock, so processes sharing the directory (API and shard workers) agree
+    on row numbers.
+    """
+
+    def __init__(self, model_name, root=DEFAULT_STORE_DIR, batch_size=96):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.path = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._hashes_path = os.path.join(self.path, "hashes.log")
+        self._meta_path = os.path.join(self.path, "meta.json")
+        self._lock = threading.Lock()
+        self._matrix_cache = OrderedDict()
+        self.dim = None
+        self.rows = {}
+        self._matrix = None
+        os.makedirs(self.path, exist_ok=True)
+        with self._file_lock():
+            self._migrate_index()
+            self._load_new_rows()
+            self._repair()
+        self._remap()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @contextmanager
+    def _file_lock(self):
+        # Serialises appends across processes; threads are serialised by self._lock
+        with open(os.path.join(self.path, "lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _migrate_index(self):
+        # Stores written before hashes.log kept the whole map in index.json
+        index_path = os.path.join(self.path, "index.json")
+        if not os.path.exists(index_path) or os.path.exists(self._hashes_path):
+            return
+        with open(index_path) as f:
+            meta = json.load(f)
+        self._write_meta(meta["dim"])
+        with open(self._hashes_path, "w") as f:
+            f.writelines(h + "\n" for h, _ in sorted(meta["rows"].items(), key=lambda item: item[1]))
+        os.remove(index_path)
+
+    def _write_meta(self, dim):
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": self.model_name, "dim": dim}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _load_new_rows(self):
+        # Picks up rows appended by other processes since this one last looked
+        if self.dim is None and os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if not os.path.exists(self._hashes_path):
+            return False
+        complete = os.path.getsize(self._hashes_path) // HASH_LINE_BYTES
+        if complete <= len(self.rows):
+            return False
+        with open(self._hashes_path, "rb") as f:
+            f.seek(len(self.rows) * HASH_LINE_BYTES)
+            data = f.read((complete - len(self.rows)) * HASH_LINE_BYTES).decode("ascii")
+        for line in data.splitlines():
+            self.rows[line] = len(self.rows)
+        return True
+
+    def _repair(self):
+        # Vectors are written before their hashes, so a crash between the two
+        # (or a torn write) leaves extra bytes that no row refers to; drop them
+        if self.dim is None:
+            return
+        vector_rows = os.path.getsize(self._vectors_path) // (self.dim * 4) if os.path.exists(self._vectors_path) else 0
+        if vector_rows < len(self.rows):
+            logging.error(f"Embedding store {self.path}: {len(self.rows) - vector_rows} rows lost their vectors")
+            self.rows = {h: row for h, row in self.rows.items() if row < vector_rows}
+        for path, size in ((self._vectors_path, len(self.rows) * self.dim * 4),
+                           (self._hashes_path, len(self.rows) * HASH_LINE_BYTES)):
+            if os.path.exists(path) and os.path.getsize(path) != size:
+                os.truncate(path, size)
+
+    def all_vectors(self):
+        if self._matrix is None:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        return np.asarray(self._matrix)
+
+    def _remap(self):
+        n = len(self.rows)
+        if n == 0 or self.dim is None:
+            self._matrix = None
+            return
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    def _append(self, hashes, vectors):
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        with self._file_lock():
+            self._load_new_rows()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._write_meta(self.dim)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vectors.shape[1]} does not match store dim {self.dim}")
+            # Another process may have stored some of these meanwhile
+            keep = [i for i, h in enumerate(hashes) if h not in self.rows]
+            if keep:
+                with open(self._vectors_path, "ab") as f:
+                    f.write(vectors[keep].tobytes())
+                with open(self._hashes_path, "a") as f:
+                    f.writelines(hashes[i] + "\n" for i in keep)
+                for i in keep:
+                    self.rows[hashes[i]] = len(self.rows)
+        self._remap()
+
+    def _encode_missing(self, hashes, texts, encode_fn):
+        if self._load_new_rows():
+            self._remap()
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in self.rows and h not in missing:
+                missing[h] = t
+        missing_hashes = list(missing)
+        # Encoders may ask for bigger batches, e.g. to keep a process pool busy
+        batch_size = getattr(encode_fn, "batch_size", None) or self.batch_size
+        for start in range(0, len(missing_hashes), batch_size):
+            batch = missing_hashes[start:start + batch_size]
+            self._append(batch, encode_fn([missing[h] for h in batch]))
+        if missing_hashes:
+            incr("embeddings_encoded", len(missing_hashes), model=self.model_name)
+        return len(missing_hashes)
+
+    def add(self, texts, encode_fn):
+        """Encode and persist any of ``texts`` not yet stored; returns how many were new."""
+        with self._lock:
+            return self._encode_missing([text_hash(t) for t in texts], texts, encode_fn)
+
+    def get_rows(self, texts, encode_fn):
+        """Store row of each of ``texts``, encoding any missing ones first."""
+        hashes = [text_hash(t) for t in texts]
+        with self._lock:
+            self._encode_missing(hashes, texts, encode_fn)
+            return np.fromiter((self.rows[h] for h in hashes), dtype=np.int64, count=len(hashes))
+
+    def vectors_at(self, rows):
+        # Reads only the requested rows of the memory-mapped file
+        with self._lock:
+            matrix = self._matrix
+        return np.asarray(matrix[rows], dtype=np.float32)
+
+    def get_embeddings(self, texts, encode_fn):
+        """Return an (n, dim) matrix of normalised embeddings for ``texts``.
+
+        ``encode_fn`` is called only for texts missing from the store, in
+        batches of ``batch_size``.
+        """
+        hashes = [text_hash(t) for t in texts]
+        key = hashlib.sha1("".join(hashes).encode("ascii")).hexdigest()
+        with self._lock:
+            cached = self._matrix_cache.get(key)
+            if cached is not None:
+                self._matrix_cache.move_to_end(key)
+                incr("cache_hits", cache="embedding_matrix")
+                return cached
+            incr("cache_misses", cache="embedding_matrix")
+            self._encode_missing(hashes, texts, encode_fn)
+            if not hashes:
+                return np.zeros((0, self.dim or 0), dtype=np.float32)
+            matrix = np.ascontiguousarray(self._matrix[[self.rows[h] for h in hashes]])
+            self._matrix_cache[key] = matrix
+            while len(self._matrix_cache) > 4:
+                self._matrix_cache.popitem(last=False)
+            return matrix
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+def get_embedding_store(model_name):
+    with _STORES_LOCK:
+        store = _STORES.get(model_name)
+        if store is None:
+            store = _STORES[model_name] = EmbeddingStore(model_name)
+        return store
@@ -0,0 +1,215 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+from utils.clients import get_sentence_transformer
+from utils.tracing import span
+
+# Local sentence-transformers backends: "torch" (the stock model),
+# "quantized" (torch dynamic int8 Linear layers), "onnx" (ONNX Runtime) and
+# "onnx-int8" (ONNX Runtime with dynamically quantized weights). The ONNX
+# backends need the optional onnxruntime package; the model is exported once
+# and cached under ONNX_CACHE_DIR.
+ST_BACKEND = os.environ.get("ST_BACKEND", "torch")
+ST_BACKENDS = ("torch", "quantized", "onnx", "onnx-int8")
+# Worker processes for bulk encoding (1 = encode in this process) and texts per forward pass
+ENCODE_PROCESSES = int(os.environ.get("ENCODE_PROCESSES", 1))
+ENCODE_BATCH_SIZE = int(os.environ.get("ENCODE_BATCH_SIZE", 64))
+# Batches handed to a worker per task, to amortise inter-process transfer
+ENCODE_BATCHES_PER_TASK = 8
+ONNX_CACHE_DIR = os.environ.get(
+    "ONNX_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "onnx"),
+)
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+class TorchEncoder:
+    def __init__(self, model):
+        self.model = model
+
+    def encode(self, texts, batch_size=None):
+        vectors = self.model.encode(list(texts), batch_size=batch_size or ENCODE_BATCH_SIZE,
+                                    show_progress_bar=False, convert_to_numpy=True)
+        return _normalize(vectors)
+
+class OnnxEncoder:
+    """Transformer forward pass in ONNX Runtime, then the same mean pooling
+    and L2 normalisation as the sentence-transformers pipeline."""
+
+    def __init__(self, model_path, tokenizer, max_seq_length, threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.max_seq_length = max_seq_length
+
+    def encode(self, texts, batch_size=None):
+        texts = list(texts)
+        batch_size = batch_size or ENCODE_BATCH_SIZE
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        # Longest first, so each batch pads to similar lengths
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        out = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            ids = order[start:start + batch_size]
+            batch = self.tokenizer([texts[i] for i in ids], padding=True, truncation=True,
+                                   max_length=self.max_seq_length, return_tensors="np")
+            feeds = {name: value.astype(np.int64) for name, value in batch.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            for i, vector in zip(ids, pooled):
+                out[i] = vector
+        return _normalize(np.stack(out))
+
+def _onnx_paths(model_name, backend):
+    directory = os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "_"))
+    return directory, os.path.join(directory, "model-int8.onnx" if backend == "onnx-int8" else "model.onnx")
+
+def export_onnx(model_name, backend="onnx"):
+    """Export the model's transformer to ONNX (and its int8 variant) once."""
+    directory, path = _onnx_paths(model_name, backend)
+    float_path = os.path.join(directory, "model.onnx")
+    if not os.path.exists(float_path):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        transformer = SentenceTransformer(model_name, device="cpu")[0]
+        model = transformer.auto_model.eval()
+
+        class LastHiddenState(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids=None):
+                return self.model(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+
+        sample = transformer.tokenizer(["export sample"], return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+        axes = {n: {0: "batch", 1: "sequence"} for n in names + ["last_hidden_state"]}
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = float_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(LastHiddenState(model), tuple(sample[n] for n in names), tmp_path,
+                              input_names=names, output_names=["last_hidden_state"],
+                              dynamic_axes=axes, opset_version=14)
+        os.replace(tmp_path, float_path)
+        transformer.tokenizer.save_pretrained(directory)
+        with open(os.path.join(directory, "max_seq_length"), "w") as f:
+            f.write(str(transformer.max_seq_length))
+    if backend == "onnx-int8" and not os.path.exists(path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(float_path, path + ".tmp", weight_type=QuantType.QInt8)
+        os.replace(path + ".tmp", path)
+    return directory, path
+
+def load_encoder(model_name, backend=None, threads=None):
+    backend = backend or ST_BACKEND
+    if backend not in ST_BACKENDS:
+        raise ValueError(f"Unknown ST_BACKEND '{backend}'; expected one of {', '.join(ST_BACKENDS)}")
+    with span("semantic.model_load", model=model_name, backend=backend):
+        if backend in ("onnx", "onnx-int8"):
+            from transformers import AutoTokenizer
+            directory, path = export_onnx(model_name, backend)
+            with open(os.path.join(directory, "max_seq_length")) as f:
+                max_seq_length = int(f.read())
+            return OnnxEncoder(path, AutoTokenizer.from_pretrained(directory), max_seq_length, threads)
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        if backend == "torch":
+            return TorchEncoder(get_sentence_transformer(model_name))
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device="cpu")
+        return TorchEncoder(torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+_ENCODERS = {}
+_ENCODERS_LOCK = threading.Lock()
+
+def get_encoder(model_name, backend=None):
+    key = (model_name, backend or ST_BACKEND)
+    with _ENCODERS_LOCK:
+        encoder = _ENCODERS.get(key)
+        if encoder is None:
+            encoder = _ENCODERS[key] = load_encoder(*key)
+        return encoder
+
+def store_name(model_name, backend=None):
+    # Embedding store per backend, so approximate backends never mix with the reference vectors
+    backend = backend or ST_BACKEND
+    return model_name if backend == "torch" else f"{model_name}-{backend}"
+
+# Worker-process side of the encoding pool
+_WORKER_ENCODER = None
+
+def _init_worker(model_name, backend, threads):
+    global _WORKER_ENCODER
+    _WORKER_ENCODER = load_encoder(model_name, backend, threads)
+
+def _encode_in_worker(texts, batch_size):
+    return _WORKER_ENCODER.encode(texts, batch_size)
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_encode_pool(model_name, backend=None, processes=None):
+    backend = backend or ST_BACKEND
+    processes = processes or ENCODE_PROCESSES
+    key = (model_name, backend, processes)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            # Spawned, not forked: torch and ONNX Runtime thread pools do not survive fork.
+            # Cores are split between workers so they do not oversubscribe the CPU.
+            threads = max(1, (os.cpu_count() or 1) // processes)
+            pool = _POOLS[key] = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_name, backend, threads),
+            )
+        return pool
+
+def shutdown_pools():
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        _POOLS.clear()
+
+atexit.register(shutdown_pools)
+
+def encode_texts(texts, model_name, backend=None, processes=None, batch_size=None):
+    """Encode ``texts`` into L2-normalised float32 rows, spreading batches
+    over a process pool when ``processes`` > 1 and there is enough work."""
+    texts = list(texts)
+    backend = backend or ST_BACKEND
+    processes = processes or ENCODE_PROCESSES
+    batch_size = batch_size or ENCODE_BATCH_SIZE
+    task_size = batch_size * ENCODE_BATCHES_PER_TASK
+    with span("embed.encode", backend=backend, texts=len(texts), processes=processes):
+        if processes <= 1 or len(texts) <= task_size:
+            return get_encoder(model_name, backend).encode(texts, batch_size)
+        tasks = [texts[i:i + task_size] for i in range(0, len(texts), task_size)]
+        pool = get_encode_pool(model_name, backend, processes)
+        return np.concatenate(list(pool.map(_encode_in_worker, tasks, repeat(batch_size))))
+
+def bulk_encoder(model_name, backend=None, processes=None, batch_size=None):
+    """``encode_texts`` bound to one model, asking the embedding store for
+    chunks big enough to keep every worker busy."""
+    processes = processes or ENCODE_PROCESSES
+    batch_size = batch_size or ENCODE_BATCH_SIZE
+
+    def encode(texts):
+        return encode_texts(texts, model_name, backend, processes, batch_size)
+    encode.batch_size = batch_size * ENCODE_BATCHES_PER_TASK * max(1, processes)
+    return encode
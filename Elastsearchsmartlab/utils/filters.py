@@ -0,0 +1,112 @@
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+
+TERM_FIELDS = ("tags", "type", "author")
+
+def _parse_dates(values):
+    try:
+        return np.array(values, dtype="datetime64[D]")
+    except ValueError:
+        out = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[D]")
+        for i, value in enumerate(values):
+            try:
+                out[i] = np.datetime64(value, "D")
+            except ValueError:
+                pass
+        return out
+
+def filters_key(filters):
+    return json.dumps(filters or {}, sort_keys=True, default=str)
+
+class FilterIndex:
+    """Per-field posting arrays and a date column, built once per corpus.
+
+    Filters are a dict such as::
+
+        {"tags": ["bm25", "vector"], "tags_match": "any", "type": "Guide",
+         "author": ["Alex Kim"], "date_from": "2024-01-01", "date_to": "2024-12-31"}
+
+    A term field takes one value or a list (any of them matches; tags can
+    require all with ``tags_match="all"``). Fields are combined with AND and
+    term matching is case-insensitive.
+    """
+
+    def __init__(self, docs):
+        self.num_docs = len(docs)
+        raw = {field: {} for field in TERM_FIELDS}
+        self.labels = {field: {} for field in TERM_FIELDS}
+        for i, doc in enumerate(docs):
+            for field in TERM_FIELDS:
+                values = doc.get(field) or []
+                for value in (values if isinstance(values, list) else [values]):
+                    key = str(value).lower()
+                    raw[field].setdefault(key, []).append(i)
+                    self.labels[field].setdefault(key, str(value))
+        self.postings = {
+            field: {key: np.unique(np.asarray(ids, dtype=np.int32)) for key, ids in raw[field].items()}
+            for field in TERM_FIELDS
+        }
+        self.dates = _parse_dates([doc.get("date") or "" for doc in docs])
+
+    def values(self, field):
+        # Display labels for a term field, most frequent first
+        postings = self.postings[field]
+        return [self.labels[field][v] for v in sorted(postings, key=lambda v: (-len(postings[v]), v))]
+
+    def date_bounds(self):
+        valid = self.dates[~np.isnat(self.dates)]
+        if not len(valid):
+            return None, None
+        return valid.min(), valid.max()
+
+    def _term_mask(self, field, values, match_all=False):
+        mask = np.ones(self.num_docs, dtype=bool) if match_all else np.zeros(self.num_docs, dtype=bool)
+        for value in values:
+            ids = self.postings[field].get(str(value).lower(), np.zeros(0, dtype=np.int32))
+            if match_all:
+                term = np.zeros(self.num_docs, dtype=bool)
+                term[ids] = True
+                mask &= term
+            else:
+                mask[ids] = True
+        return mask
+
+    def mask(self, filters):
+        mask = np.ones(self.num_docs, dtype=bool)
+        if not filters:
+            return mask
+        for field in TERM_FIELDS:
+            values = filters.get(field)
+            if not values:
+                continue
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            mask &= self._term_mask(field, values, field == "tags" and filters.get("tags_match") == "all")
+        if filters.get("date_from"):
+            mask &= self.dates >= np.datetime64(str(filters["date_from"]), "D")
+        if filters.get("date_to"):
+            mask &= self.dates <= np.datetime64(str(filters["date_to"]), "D")
+        return mask
+
+    def candidates(self, filters):
+        return np.flatnonzero(self.mask(filters))
+
+_INDEX_CACHE = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+
+def get_filter_index(docs, fingerprint):
+    # Segmented snapshots answer filters from their per-segment indexes
+    if getattr(docs, "segments", None) is not None:
+        return docs
+    with _INDEX_LOCK:
+        index = _INDEX_CACHE.get(fingerprint)
+        if index is not None:
+            _INDEX_CACHE.move_to_end(fingerprint)
+            return index
+    index = FilterIndex(docs)
+    with _INDEX_LOCK:
+        _INDEX_CACHE[fingerprint] = index
+        while len(_INDEX_CACHE) > 8:
+            _INDEX_CACHE.popitem(last=False)
+    return index
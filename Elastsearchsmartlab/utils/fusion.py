@@ -0,0 +1,88 @@
+import os
+import numpy as np
+
+# All functions work along the last axis, so a (num_docs,) vector scores one
+# query and a (num_queries, num_docs) matrix fuses a whole batch at once
+HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "linear")
+HYBRID_NORMALIZATION = os.environ.get("HYBRID_NORMALIZATION", "min_max")
+RRF_K = int(os.environ.get("RRF_K", 60))
+
+def max_norm(scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    peak = scores.max(axis=-1, keepdims=True) if scores.shape[-1] else np.zeros(scores.shape[:-1] + (1,), np.float32)
+    return np.divide(scores, peak, out=np.zeros_like(scores), where=peak > 0)
+
+def min_max(scores):
+    # Constant rows map to 1 when positive (e.g. a single document) and 0 otherwise
+    scores = np.asarray(scores, dtype=np.float32)
+    if not scores.shape[-1]:
+        return scores
+    low = scores.min(axis=-1, keepdims=True)
+    high = scores.max(axis=-1, keepdims=True)
+    spread = high - low
+    constant = np.broadcast_to(np.where(high > 0, 1.0, 0.0), scores.shape).astype(np.float32)
+    return np.divide(scores - low, spread, out=constant.copy(), where=spread > 0)
+
+def z_score(scores):
+    scores = np.asarray(scores, dtype=np.float32)
+    if not scores.shape[-1]:
+        return scores
+    mean = scores.mean(axis=-1, keepdims=True)
+    std = scores.std(axis=-1, keepdims=True)
+    return np.divide(scores - mean, std, out=np.zeros_like(scores), where=std > 0)
+
+NORMALIZERS = {
+    "min_max": min_max,
+    "z_score": z_score,
+    "max": max_norm,
+    "none": lambda scores: np.asarray(scores, dtype=np.float32),
+}
+
+def ranks(scores):
+    # 1-based descending ranks; tied scores share the best rank among them
+    # (competition ranking, like scipy's rankdata(method="min"))
+    scores = np.asarray(scores)
+    order = np.argsort(-scores, axis=-1, kind="stable")
+    ordered = np.take_along_axis(scores, order, axis=-1)
+    positions = np.broadcast_to(np.arange(scores.shape[-1]), scores.shape)
+    starts = np.ones(scores.shape, dtype=bool)
+    starts[..., 1:] = ordered[..., 1:] != ordered[..., :-1]
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=-1)
+    out = np.empty_like(order)
+    np.put_along_axis(out, order, first + 1, axis=-1)
+    return out
+
+def weighted_linear(signals, weights, normalize=None):
+    norm = NORMALIZERS[normalize or HYBRID_NORMALIZATION]
+    return sum(w * norm(s) for s, w in zip(signals, weights))
+
+def reciprocal_rank_fusion(signals, weights=None, k=None):
+    # Scaled so a document ranked first by every signal scores 1
+    k = k or RRF_K
+    weights = weights if weights is not None else [1.0] * len(signals)
+    # A zero or missing score carries no information (BM25 without a term
+    # match, LLM scores lost to a deadline), so it contributes nothing
+    fused = sum(
+        np.where(np.isfinite(s) & (s != 0), w / (k + ranks(s)), 0.0)
+        for s, w in ((np.asarray(s, dtype=np.float32), w) for s, w in zip(signals, weights))
+    )
+    total = sum(weights)
+    return (fused * (k + 1) / total).astype(np.float32) if total > 0 else np.zeros_like(fused, dtype=np.float32)
+
+def fuse(signals, weights, method=None, normalize=None):
+    method = method or HYBRID_FUSION
+    if method == "rrf":
+        return reciprocal_rank_fusion(signals, weights)
+    if method == "linear":
+        return weighted_linear(signals, weights, normalize)
+    raise ValueError(f"Unknown fusion method '{method}'")
+
+def top_k(scores, k):
+    """Indices of the ``k`` highest scores, best first, via argpartition."""
+    scores = np.asarray(scores)
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.zeros(scores.shape[:-1] + (0,), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
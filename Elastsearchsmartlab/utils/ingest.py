@@ -0,0 +1,163 @@
+import codecs
+import datetime
+import json
+import re
+from utils.docstore import DocStoreBuilder
+from utils.lexical import CorpusHasher, LexicalIndexBuilder, put_lexical_index
+
+INGEST_CHUNK_SIZE = 1000
+READ_SIZE = 1 << 16
+MAX_REPORTED_ERRORS = 20
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+class IngestError(ValueError):
+    pass
+
+def is_iso_date(value):
+    # YYYY-MM-DD naming a real calendar day; anything else would become NaT
+    # in the filter index and drop out of every date range
+    if not isinstance(value, str) or not DATE_RE.match(value):
+        return False
+    try:
+        datetime.date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+class IngestResult:
+    def __init__(self):
+        self.docs = []
+        self.errors = []
+        self.skipped = 0
+        self.fingerprint = None
+
+def validate_record(record, position):
+    # Returns a document in the DOCS schema or raises IngestError
+    if not isinstance(record, dict):
+        raise IngestError(f"record {position}: expected an object, got {type(record).__name__}")
+    for field in ("title", "snippet"):
+        if not isinstance(record.get(field), str) or not record[field].strip():
+            raise IngestError(f"record {position}: '{field}' must be a non-empty string")
+    for field in ("author", "type", "date"):
+        if not isinstance(record.get(field, ""), str):
+            raise IngestError(f"record {position}: '{field}' must be a string")
+    date = record.get("date", "")
+    if date and not is_iso_date(date):
+        raise IngestError(f"record {position}: 'date' must be a valid YYYY-MM-DD date, got '{date}'")
+    tags = record.get("tags", [])
+    if not isinstance(tags, list) or not all(isinstance(t, str) for t in tags):
+        raise IngestError(f"record {position}: 'tags' must be a list of strings")
+    return {
+        "title": record["title"],
+        "snippet": record["snippet"],
+        "date": date,
+        "author": record.get("author", ""),
+        "tags": tags,
+        "type": record.get("type", ""),
+    }
+
+def _iter_json_array(reader, buf):
+    decoder = json.JSONDecoder()
+    pos = buf.index("[") + 1
+    eof = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return
+        try:
+            record, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise IngestError(f"invalid or truncated JSON array: {e}")
+            # The next record is not fully buffered yet: read more
+            chunk = reader.read(READ_SIZE)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        yield record
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        # Reported and skipped like any other invalid record
+        return IngestError(f"invalid JSON line: {e}")
+
+def _iter_json_lines(reader, buf):
+    while True:
+        lines = buf.split("\n")
+        buf = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+        chunk = reader.read(READ_SIZE)
+        if not chunk:
+            break
+        buf += chunk
+    if buf.strip():
+        yield _parse_line(buf)
+
+def iter_records(fileobj):
+    """Yield raw records from a binary JSON-array or JSONL stream, incrementally."""
+    reader = codecs.getreader("utf-8-sig")(fileobj)
+    buf = ""
+    while not buf.strip():
+        chunk = reader.read(READ_SIZE)
+        if not chunk:
+            return
+        buf += chunk
+    if buf.lstrip().startswith("["):
+        yield from _iter_json_array(reader, buf)
+    else:
+        yield from _iter_json_lines(reader, buf)
+
+def ingest(fileobj, total_bytes=None, chunk_size=INGEST_CHUNK_SIZE, on_chunk=None, progress=None, build_index=True):
+    """Parse, validate and index a document upload in chunks.
+
+    Each chunk of valid documents is added to a lexical index builder and
+    passed to ``on_chunk`` (e.g. the embedding encoder); ``progress`` is
+    called with (fraction of bytes read or None, documents loaded). The
+    finished lexical index is registered under the corpus fingerprint so
+    the first query does not rebuild it; pass ``build_index=False`` when the
+    documents go into a SegmentedIndex instead. ``result.docs`` is a
+    columnar DocStore rather than a list of dicts.
+    """
+    result = IngestResult()
+    store = DocStoreBuilder()
+    builder = LexicalIndexBuilder()
+    hasher = CorpusHasher()
+    chunk = []
+
+    def flush():
+        if build_index:
+            builder.add(chunk)
+        hasher.update(chunk)
+        if on_chunk:
+            on_chunk(chunk)
+        store.add(chunk)
+        if progress:
+            fraction = min(fileobj.tell() / total_bytes, 1.0) if total_bytes else None
+            progress(fraction, len(store))
+
+    for position, record in enumerate(iter_records(fileobj)):
+        try:
+            if isinstance(record, IngestError):
+                raise IngestError(f"record {position}: {record}")
+            chunk.append(validate_record(record, position))
+        except IngestError as e:
+            result.skipped += 1
+            if len(result.errors) < MAX_REPORTED_ERRORS:
+                result.errors.append(str(e))
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+            chunk = []
+    if chunk:
+        flush()
+    result.fingerprint = hasher.hexdigest()
+    result.docs = store.build(result.fingerprint)
+    if result.docs and build_index:
+        put_lexical_index(result.fingerprint, builder.build())
+    return result
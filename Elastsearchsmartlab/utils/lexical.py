@@ -0,0 +1,149 @@
+import hashlib
+import json
+import math
+import re
+import threading
+from array import array
+from collections import Counter, OrderedDict
+import numpy as np
+from utils.tracing import incr
+
+TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+class CorpusHasher:
+    # Incremental form of corpus_fingerprint for documents arriving in chunks
+    def __init__(self):
+        self._hash = hashlib.sha1()
+
+    def update(self, docs):
+        for doc in docs:
+            self._hash.update(json.dumps(doc, sort_keys=True, default=str).encode("utf-8"))
+            self._hash.update(b"\0")
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+def corpus_fingerprint(docs):
+    # Stable hash over the full content of every document, in order;
+    # segmented snapshots carry their own
+    if getattr(docs, "fingerprint", None):
+        return docs.fingerprint
+    hasher = CorpusHasher()
+    hasher.update(docs)
+    return hasher.hexdigest()
+
+class LexicalIndexBuilder:
+    """Accumulates raw postings chunk by chunk; ``build`` computes the IDF
+    and BM25 impacts once the whole corpus has been seen."""
+
+    def __init__(self, fields=("title", "snippet"), k1=1.2, b=0.75):
+        self.fields = fields
+        self.k1 = k1
+        self.b = b
+        self.num_docs = 0
+        self.doc_lens = array("f")
+        self.postings = {}
+
+    def add(self, docs):
+        for doc in docs:
+            tokens = tokenize(" ".join(str(doc.get(f, "")) for f in self.fields))
+            self.doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                posting = self.postings.get(term)
+                if posting is None:
+                    posting = self.postings[term] = (array("i"), array("f"))
+                posting[0].append(self.num_docs)
+                posting[1].append(tf)
+            self.num_docs += 1
+
+    def build(self):
+        return LexicalIndex.from_builder(self)
+
+class LexicalIndex:
+    """BM25 inverted index built once per corpus.
+
+    Postings hold, per term, the ids of the documents containing it and the
+    precomputed BM25 impact of the term in each of them, so a query only
+    walks the postings of its own terms.
+    """
+
+    def __init__(self, docs, fields=("title", "snippet"), k1=1.2, b=0.75):
+        builder = LexicalIndexBuilder(fields, k1, b)
+        builder.add(docs)
+        self._load(builder)
+
+    @classmethod
+    def from_builder(cls, builder):
+        index = cls.__new__(cls)
+        index._load(builder)
+        return index
+
+    def _load(self, builder):
+        self.fields = builder.fields
+        self.k1 = k1 = builder.k1
+        self.b = b = builder.b
+        self.num_docs = builder.num_docs
+        doc_lens = np.frombuffer(builder.doc_lens, dtype=np.float32).copy()
+        self.doc_lens = doc_lens
+        self.avgdl = float(doc_lens.mean()) if self.num_docs else 0.0
+        # Per-document length normalisation, shared by every term
+        length_norm = k1 * (1 - b + b * doc_lens / (self.avgdl or 1.0))
+        self.idf = {}
+        self.postings = {}
+        for term, (ids, tfs) in builder.postings.items():
+            ids = np.frombuffer(ids, dtype=np.int32).copy()
+            tfs = np.frombuffer(tfs, dtype=np.float32)
+            df = len(ids)
+            idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+            self.idf[term] = idf
+            impacts = idf * tfs * (k1 + 1) / (tfs + length_norm[ids])
+            self.postings[term] = (ids, impacts.astype(np.float32))
+
+    def search(self, query, candidates=None):
+        # With ``candidates`` only their postings are accumulated, into one
+        # score per candidate
+        if candidates is None:
+            scores = np.zeros(self.num_docs, dtype=np.float32)
+        else:
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            positions = np.full(self.num_docs, -1, dtype=np.int64)
+            positions[candidates] = np.arange(len(candidates))
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            ids, impacts = posting
+            if candidates is None:
+                scores[ids] += impacts
+            else:
+                pos = positions[ids]
+                hit = pos >= 0
+                scores[pos[hit]] += impacts[hit]
+        return scores
+
+_INDEX_CACHE = OrderedDict()
+_INDEX_CACHE_SIZE = 8
+_INDEX_LOCK = threading.Lock()
+
+def get_lexical_index(docs, fingerprint=None):
+    key = fingerprint or corpus_fingerprint(docs)
+    with _INDEX_LOCK:
+        index = _INDEX_CACHE.get(key)
+        if index is not None:
+            _INDEX_CACHE.move_to_end(key)
+            incr("cache_hits", cache="lexical_index")
+            return index
+    incr("cache_misses", cache="lexical_index")
+    index = LexicalIndex(docs)
+    put_lexical_index(key, index)
+    return index
+
+def put_lexical_index(fingerprint, index):
+    with _INDEX_LOCK:
+        _INDEX_CACHE[fingerprint] = index
+        _INDEX_CACHE.move_to_end(fingerprint)
+        while len(_INDEX_CACHE) > _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
@@ -1,102 +1,168 @@
-import streamlit as st
-import time
+import json
 import os
+import threading
+import time
+from collections import deque
+from utils.providers import get_registry, GROQ_API_URL
+from utils.clients import get_secret, get_http_session, get_openai_client, get_cohere_client, get_gemini_model
+from utils.tracing import incr, observe
+
+EXPLAIN_CACHE_TTL = float(os.environ.get("EXPLAIN_CACHE_TTL", 3600))
+
+# (mode, provider, model) -> (explanation text, created at)
+_EXPLANATIONS = {}
+_EXPLANATIONS_LOCK = threading.Lock()
+# Most recent explanation timings, newest last
+EXPLAIN_STATS = deque(maxlen=50)
+
+def _openai_stream(api_key, model, prompt):
+    client = get_openai_client(api_key)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=200,
+        temperature=0.3,
+        stream=True
+    )
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices and chunk.choices[0].delta else None
+        if delta:
+            yield delta
+
+def _cohere_stream(api_key, model, prompt):
+    co = get_cohere_client(api_key)
+    for token in co.generate(
+        model=model,
+        prompt=prompt,
+        max_tokens=200,
+        temperature=0.3,
+        stream=True,
+    ):
+        text = getattr(token, "text", None)
+        if text:
+            yield text
+
+def _groq_stream(api_key, model, prompt):
+    # OpenAI-compatible server-sent events
+    with get_http_session().post(
+        GROQ_API_URL,
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json={
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": 200,
+            "temperature": 0.3,
+            "stream": True
+        },
+        timeout=10,
+        stream=True
+    ) as groq_resp:
+        groq_resp.raise_for_status()
+        for line in groq_resp.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+            if delta:
+                yield delta
+
+def _gemini_stream(api_key, model, prompt):
+    gemini = get_gemini_model(api_key, model)
+    for chunk in gemini.generate_content(prompt, stream=True):
+        if chunk.text:
+            yield chunk.text
+
+EXPLAIN_PROVIDERS = {
+    "OpenAI": ("openai_api_key", "gpt-4", _openai_stream),
+    "Cohere": ("cohere_api_key", "command-r-plus", _cohere_stream),
+    "Groq": ("groq_api_key", "llama3-70b-8192", _groq_stream),
+    "Gemini": ("gemini_api_key", "gemini-pro", _gemini_stream),
+}
+
+def _cached_explanation(key):
+    with _EXPLANATIONS_LOCK:
+        entry = _EXPLANATIONS.get(key)
+        if entry and time.time() - entry[1] < EXPLAIN_CACHE_TTL:
+            return entry[0]
+        _EXPLANATIONS.pop(key, None)
+        return None
+
+def _record(mode, provider, model, ttft, total, cached):
+    EXPLAIN_STATS.append({
+        "mode": mode,
+        "provider": provider,
+        "model": model,
+        "ttft_s": ttft,
+        "total_s": total,
+        "cached": cached,
+    })
+
+def last_explanation_stats():
+    return EXPLAIN_STATS[-1] if EXPLAIN_STATS else None
+
+def clear_explanation_cache():
+    with _EXPLANATIONS_LOCK:
+        _EXPLANATIONS.clear()
 
 def explain_retrieval_strategy_stream(mode):
     prompt = f"""
 Explain in 3-5 sentences, for a developer audience, how a '{mode}' search mode works in a modern search system. Include the pros, cons, and typical use cases. Use clear, technical language.
 """
     errors = []
-    # OpenAI (new API)
-    try:
-        import openai
-        openai_key = st.secrets.get("openai_api_key", None) or os.environ.get("OPENAI_API_KEY") or os.environ.get("openai_api_key")
-        if openai_key:
-            client = openai.OpenAI(api_key=openai_key)
-            stream = client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=200,
-                temperature=0.3,
-                stream=True
-            )
-            buffer = ""
-            for chunk in stream:
-                delta = chunk.choices[0].delta.content if chunk.choices[0].delta else None
-                if delta:
-                    buffer += delta
-                    yield delta
-                    time.sleep(0.05)
-            if buffer:
-                return
-    except Exception as e:
-        errors.append(f"[OpenAI error: {e}]")
-    # Cohere
-    try:
-        import cohere
-        cohere_key = st.secrets.get("cohere_api_key", None) or os.environ.get("COHERE_API_KEY") or os.environ.get("cohere_api_key")
-        if cohere_key:
-            co = cohere.Client(cohere_key)
-            resp = co.generate(
-                model="command-r-plus",
-                prompt=prompt,
-                max_tokens=200,
-                temperature=0.3,
-            )
-            text = resp.generations[0].text.strip()
-            if text:
-                for sent in text.split('.'):
-                    if sent.strip():
-                        yield sent.strip() + '.'
-                        time.sleep(0.1)
-                return
-    except Exception as e:
-        errors.append(f"[Cohere error: {e}]")
-    # Groq
-    try:
-        import requests
-        groq_key = st.secrets.get("groq_api_key", None) or os.environ.get("GROQ_API_KEY") or os.environ.get("groq_api_key")
-        if groq_key:
-            groq_resp = requests.post(
-                "https://api.groq.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {groq_key}", "Content-Type": "application/json"},
-                json={
-                    "model": "llama3-70b-8192",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 200,
-                    "temperature": 0.3
-                },
-                timeout=10
-            )
-            try:
-                text = groq_resp.json()["choices"][0]["message"]["content"].strip()
-                if text:
-                    for sent in text.split('.'):
-                        if sent.strip():
-                            yield sent.strip() + '.'
-                            time.sleep(0.1)
-                    return
-            except Exception as e:
-                errors.append(f"[Groq response error: {e}]")
-    except Exception as e:
-        errors.append(f"[Groq error: {e}]")
-    # Gemini
-    try:
-        import google.generativeai as genai
-        gemini_key = st.secrets.get("gemini_api_key", None) or os.environ.get("GEMINI_API_KEY") or os.environ.get("gemini_api_key")
-        if gemini_key:
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-pro')
-            resp = model.generate_content(prompt)
-            text = resp.text.strip()
-            if text:
-                for sent in text.split('.'):
-                    if sent.strip():
-                        yield sent.strip() + '.'
-                        time.sleep(0.1)
+    attempted = False
+    registry = get_registry()
+    # Healthiest provider first; open circuits are skipped until their probe is due
+    for provider in registry.order(list(EXPLAIN_PROVIDERS)):
+        secret, model, stream_fn = EXPLAIN_PROVIDERS[provider]
+        api_key = get_secret(secret)
+        if not api_key:
+            continue
+        key = (mode, provider, model)
+        start = time.perf_counter()
+        cached = _cached_explanation(key)
+        if cached:
+            incr("cache_hits", cache="explanation")
+            _record(mode, provider, model, time.perf_counter() - start, time.perf_counter() - start, True)
+            yield cached
+            return
+        if not registry.allow(provider):
+            incr("circuit_rejections", provider=provider)
+            continue
+        incr("cache_misses", cache="explanation")
+        if attempted:
+            incr("provider_fallbacks", signal="explain", provider=provider)
+        attempted = True
+        # Timed by hand rather than with a span: a span's context would stay
+        # active in the caller between yields
+        chunks = []
+        ttft = None
+        try:
+            for chunk in stream_fn(api_key, model, prompt):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            incr("errors", stage="explain", provider=provider)
+            errors.append(f"[{provider} error: {e}]")
+            registry.record_failure(provider, time.perf_counter() - start)
+            if chunks:
+                # Part of the answer is already on screen; don't repeat it from another provider
                 return
-    except Exception as e:
-        errors.append(f"[Gemini error: {e}]")
+            continue
+        total = time.perf_counter() - start
+        if chunks:
+            registry.record_success(provider, total)
+            observe("explain.first_token", ttft, provider=provider)
+            observe("explain.total", total, provider=provider)
+            with _EXPLANATIONS_LOCK:
+                _EXPLANATIONS[key] = ("".join(chunks), time.time())
+            _record(mode, provider, model, ttft, total, False)
+            return
+        incr("errors", stage="explain", provider=provider)
+        registry.record_failure(provider, total)
     # If all fail, only then yield errors
     if errors:
         for err in errors:
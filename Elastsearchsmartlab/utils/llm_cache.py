@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "llm_scores.sqlite3"),
+)
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE", "1").lower() not in ("0", "false", "no", "off")
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 100000))
+
+def normalize_query(query):
+    # Cache key form of a query, shared by every cache: case and whitespace
+    # do not change BM25 tokens or an LLM's relevance judgement
+    return " ".join(query.lower().split())
+
+def doc_content_hash(doc):
+    content = json.dumps([doc.get("title", ""), doc.get("snippet", "")], ensure_ascii=False)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+class LLMScoreCache:
+    """SQLite cache of LLM relevance scores with a TTL and LRU eviction.
+
+    Entries are keyed by (normalised query, document content hash, provider,
+    model); reads refresh the access time used for eviction.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "key TEXT PRIMARY KEY, score REAL NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scores_accessed ON scores (accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(query, doc, provider, model):
+        raw = json.dumps([normalize_query(query), doc_content_hash(doc), provider, model])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, score FROM scores WHERE key IN ({','.join('?' * len(chunk))}) AND created >= ?",
+                    (*chunk, now - self.ttl),
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany("UPDATE scores SET accessed = ? WHERE key = ?", [(now, k) for k in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (key, score, created, accessed) VALUES (?, ?, ?, ?)",
+                [(k, float(score), now, now) for k, score in items.items()],
+            )
+            self._conn.execute("DELETE FROM scores WHERE created < ?", (now - self.ttl,))
+            size = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            if size > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM scores WHERE key IN (SELECT key FROM scores ORDER BY accessed ASC LIMIT ?)",
+                    (size - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM scores")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": size,
+        }
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_llm_cache():
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = LLMScoreCache()
+        return _CACHE
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+from utils.tracing import span, incr
+
+PROVIDER_ORDER = ["OpenAI", "Cohere", "Groq", "Gemini"]
+
+# OpenAI and Cohere SDKs honour OPENAI_BASE_URL / CO_API_URL; Groq is called
+# directly, so its endpoint is configurable here for local stubs
+GROQ_API_URL = os.environ.get("GROQ_API_URL", "https://api.groq.com/v1/chat/completions")
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 3))
+CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_COOLDOWN", 30))
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class ProviderHealth:
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.error_rate = 0.0
+        self.latency = None
+        self.opened_at = None
+        self.probing = False
+
+    def state(self, now, cooldown):
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at >= cooldown:
+            return "half-open"
+        return "open"
+
+class ProviderRegistry:
+    """Per-provider error rate, latency and circuit breaker state.
+
+    After ``failure_threshold`` consecutive failures a provider's circuit
+    opens and calls to it fail fast. Once ``cooldown`` seconds have passed
+    the next ordering puts it first for a single probe call; success closes
+    the circuit, failure re-opens it.
+    """
+
+    def __init__(self, providers=PROVIDER_ORDER, failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown=CIRCUIT_COOLDOWN, alpha=0.3, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._health = {name: ProviderHealth(name, i) for i, name in enumerate(providers)}
+
+    def _get(self, name):
+        if name not in self._health:
+            self._health[name] = ProviderHealth(name, len(self._health))
+        return self._health[name]
+
+    def order(self, names=None):
+        """Providers to try, best first: a due probe, then closed circuits by
+        error rate and latency. Open circuits are left out."""
+        now = self.clock()
+        with self._lock:
+            health = [self._get(n) for n in (names or list(self._health))]
+            probes, closed = [], []
+            for h in health:
+                state = h.state(now, self.cooldown)
+                if state == "closed":
+                    closed.append(h)
+                elif state == "half-open" and not h.probing:
+                    probes.append(h)
+            closed.sort(key=lambda h: (round(h.error_rate, 1), h.latency if h.latency is not None else float("inf"), h.priority))
+            return [h.name for h in probes + closed]
+
+    def allow(self, name):
+        now = self.clock()
+        with self._lock:
+            h = self._get(name)
+            state = h.state(now, self.cooldown)
+            if state == "closed":
+                return True
+            if state == "half-open" and not h.probing:
+                h.probing = True
+                return True
+            return False
+
+    def record_success(self, name, latency):
+        with self._lock:
+            h = self._get(name)
+            h.successes += 1
+            h.consecutive_failures = 0
+            h.error_rate = (1 - self.alpha) * h.error_rate
+            h.latency = latency if h.latency is None else (1 - self.alpha) * h.latency + self.alpha * latency
+            h.opened_at = None
+            h.probing = False
+
+    def record_failure(self, name, latency=None):
+        with self._lock:
+            h = self._get(name)
+            h.failures += 1
+            h.consecutive_failures += 1
+            h.error_rate = (1 - self.alpha) * h.error_rate + self.alpha
+            if h.probing or h.consecutive_failures >= self.failure_threshold:
+                h.opened_at = self.clock()
+            h.probing = False
+
+    def track(self, name, fn):
+        """Wrap ``fn`` so every call is gated by the circuit and recorded."""
+        def tracked(*args, **kwargs):
+            if not self.allow(name):
+                incr("circuit_rejections", provider=name)
+                raise CircuitOpenError(f"{name} circuit is open")
+            start = time.perf_counter()
+            try:
+                with span("llm.request", provider=name):
+                    result = fn(*args, **kwargs)
+            except Exception:
+                self.record_failure(name, time.perf_counter() - start)
+                raise
+            self.record_success(name, time.perf_counter() - start)
+            return result
+        return tracked
+
+    def snapshot(self):
+        now = self.clock()
+        with self._lock:
+            return [
+                {
+                    "provider": h.name,
+                    "state": h.state(now, self.cooldown),
+                    "successes": h.successes,
+                    "failures": h.failures,
+                    "error_rate": h.error_rate,
+                    "latency_s": h.latency,
+                }
+                for h in self._health.values()
+            ]
+
+_REGISTRY = ProviderRegistry()
+
+def get_registry():
+    return _REGISTRY
@@ -0,0 +1,194 @@
+import argparse
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils.fusion import top_k
+
+# "none" scores float32 vectors directly; "int8" and "binary" keep only
+# quantized codes in memory for a first-pass scan and rescore the top
+# QUANTIZED_RESCORE_K candidates exactly from the float vectors on disk
+QUANTIZATION = os.environ.get("SEMANTIC_QUANTIZATION", "none")
+QUANTIZED_RESCORE_K = int(os.environ.get("SEMANTIC_RESCORE_K", 100))
+QUANTIZATION_MODES = ("int8", "binary")
+
+# Rows decoded per step of a scan; small enough for the decoded block to stay in cache
+SCAN_ROWS = 2048
+
+# Set bits per 16-bit value, for Hamming distances over packed codes
+_POPCOUNT16 = np.unpackbits(np.arange(1 << 16, dtype=np.uint16).view(np.uint8)).reshape(-1, 16).sum(axis=1, dtype=np.uint8)
+
+class QuantizedIndex:
+    """Quantized codes for L2-normalised vectors, with exact float rescoring.
+
+    ``int8`` scales every dimension symmetrically into [-127, 127] (4x less
+    memory); ``binary`` keeps one sign bit per dimension (32x less) and
+    estimates cosine similarity from the Hamming distance. ``fetch(ids)``
+    must return the float32 rows for exact rescoring, so the full-precision
+    matrix can stay on disk.
+    """
+
+    def __init__(self, mode, codes, fetch, dim, scale=None, scan_rows=SCAN_ROWS):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization '{mode}'")
+        self.mode = mode
+        self.fetch = fetch
+        self.dim = dim
+        self.scale = scale
+        self.scan_rows = scan_rows
+        if mode == "binary" and codes.shape[1] % 2:
+            # Pad to whole 16-bit words; padding bits are 0 for codes and queries alike
+            codes = np.pad(codes, ((0, 0), (0, 1)))
+        self.codes = codes
+
+    @classmethod
+    def build(cls, mode, fetch, num_rows, chunk_size=65536):
+        # Rows are read through ``fetch`` a chunk at a time, so the float
+        # matrix is never fully resident
+        def chunks():
+            for start in range(0, num_rows, chunk_size):
+                yield start, fetch(np.arange(start, min(start + chunk_size, num_rows)))
+        if not num_rows:
+            raise ValueError("cannot quantize an empty set of vectors")
+        dim = fetch(np.arange(1)).shape[1]
+        if mode == "binary":
+            codes = np.empty((num_rows, (dim + 7) // 8), dtype=np.uint8)
+            for start, chunk in chunks():
+                codes[start:start + len(chunk)] = np.packbits(chunk > 0, axis=1)
+            return cls(mode, codes, fetch, dim)
+        peak = np.zeros(dim, dtype=np.float32)
+        for _, chunk in chunks():
+            peak = np.maximum(peak, np.abs(chunk).max(axis=0))
+        scale = (np.maximum(peak, 1e-8) / 127.0).astype(np.float32)
+        codes = np.empty((num_rows, dim), dtype=np.int8)
+        for start, chunk in chunks():
+            codes[start:start + len(chunk)] = np.clip(np.rint(chunk / scale), -127, 127)
+        return cls(mode, codes, fetch, dim, scale)
+
+    @classmethod
+    def from_vectors(cls, mode, vectors, chunk_size=65536):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return cls.build(mode, lambda ids: vectors[ids], len(vectors), chunk_size)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def approximate(self, q, ids=None):
+        """First-pass similarity for every row (or the rows in ``ids``)."""
+        q = np.asarray(q, dtype=np.float32)
+        n = len(self.codes) if ids is None else len(ids)
+        out = np.empty(n, dtype=np.float32)
+        if self.mode == "binary":
+            q_bits = np.zeros(self.codes.shape[1], dtype=np.uint8)
+            packed = np.packbits(q > 0)
+            q_bits[:len(packed)] = packed
+            q_bits = q_bits.view(np.uint16)
+        else:
+            q_scaled = q * self.scale
+        for start in range(0, n, self.scan_rows):
+            stop = min(start + self.scan_rows, n)
+            chunk = self.codes[start:stop] if ids is None else self.codes[ids[start:stop]]
+            if self.mode == "binary":
+                hamming = _POPCOUNT16[np.bitwise_xor(chunk.view(np.uint16), q_bits)].sum(axis=1, dtype=np.int32)
+                out[start:stop] = np.cos(np.pi * hamming / self.dim)
+            else:
+                out[start:stop] = chunk.astype(np.float32) @ q_scaled
+        return out
+
+    def scores(self, q, ids=None, rescore_k=None):
+        """Similarity of every row (or of ``ids``) to ``q``. The top
+        ``rescore_k`` first-pass candidates get exact float scores; the rest
+        keep their estimate, capped below the rescored ones so the top of
+        the ranking is always exact."""
+        scores = self.approximate(q, ids)
+        top = top_k(scores, rescore_k or QUANTIZED_RESCORE_K)
+        if not len(top):
+            return scores
+        rows = top if ids is None else np.asarray(ids)[top]
+        # Sorted reads are kinder to a memory-mapped file
+        order = np.argsort(rows)
+        exact = np.empty(len(rows), dtype=np.float32)
+        exact[order] = self.fetch(rows[order]) @ np.asarray(q, dtype=np.float32)
+        np.minimum(scores, exact.min(), out=scores)
+        scores[top] = exact
+        return scores
+
+_INDEX_CACHE = OrderedDict()
+_INDEX_LOCK = threading.Lock()
+
+def get_quantized_index(key, build_fn):
+    # ``build_fn`` runs only when ``key`` is not cached
+    with _INDEX_LOCK:
+        index = _INDEX_CACHE.get(key)
+        if index is not None:
+            _INDEX_CACHE.move_to_end(key)
+            return index
+    index = build_fn()
+    with _INDEX_LOCK:
+        _INDEX_CACHE[key] = index
+        while len(_INDEX_CACHE) > 4:
+            _INDEX_CACHE.popitem(last=False)
+    return index
+
+def quantization_report(vectors, queries, k=10, modes=QUANTIZATION_MODES, rescore_ks=(0, 50, 100, 400)):
+    """Memory and recall@k of each quantization against exact cosine scoring."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    start = time.perf_counter()
+    truth = [set(top_k(vectors @ q, k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    rows = []
+    for mode in modes:
+        start = time.perf_counter()
+        index = QuantizedIndex.from_vectors(mode, vectors)
+        build_s = time.perf_counter() - start
+        for rescore_k in rescore_ks:
+            hits = 0
+            start = time.perf_counter()
+            for q, expected in zip(queries, truth):
+                scores = index.scores(q, rescore_k=rescore_k) if rescore_k else index.approximate(q)
+                hits += len(expected.intersection(top_k(scores, k).tolist()))
+            rows.append({
+                "mode": mode,
+                "rescore_k": rescore_k,
+                "float_mb": vectors.nbytes / 2**20,
+                "quantized_mb": index.nbytes / 2**20,
+                "saved_pct": 100 * (1 - index.nbytes / vectors.nbytes),
+                "recall_at_k": hits / (k * len(queries)),
+                "query_ms": (time.perf_counter() - start) * 1000 / len(queries),
+                "exact_ms": exact_ms,
+                "build_s": build_s,
+            })
+    return rows
+
+def main():
+    from utils.ann import _synthetic_vectors
+    parser = argparse.ArgumentParser(description="Memory saved and recall lost by quantized embeddings")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--modes", nargs="*", default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument("--rescore-k", type=int, nargs="*", default=[0, 50, 100, 400],
+                        help="candidates rescored exactly (0 = first pass only)")
+    parser.add_argument("--store", help="Use vectors from the embedding store of this model instead of synthetic ones")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    if args.store:
+        from utils.embedding_store import get_embedding_store
+        vectors = get_embedding_store(args.store).all_vectors()
+    else:
+        vectors = _synthetic_vectors(args.docs, args.dim, max(1, args.docs // 100), rng)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    print(f"{'mode':>6} {'rescore':>7} {'float MB':>9} {'quant MB':>9} {'saved':>6} "
+          f"{'recall@' + str(args.k):>10} {'query ms':>9} {'exact ms':>9}")
+    for row in quantization_report(vectors, queries, args.k, args.modes, args.rescore_k):
+        print(f"{row['mode']:>6} {row['rescore_k']:>7} {row['float_mb']:>9.1f} {row['quantized_mb']:>9.1f} "
+              f"{row['saved_pct']:>5.0f}% {row['recall_at_k']:>10.3f} {row['query_ms']:>9.2f} {row['exact_ms']:>9.2f}")
+
+if __name__ == "__main__":
+    main()
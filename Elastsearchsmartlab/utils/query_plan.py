@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils.lexical import corpus_fingerprint
+from utils.fusion import fuse, min_max, top_k as top_k_indices
+from utils.llm_cache import normalize_query
+from utils.result_cache import degraded_scope, mark_degraded
+from utils.tracing import incr
+
+class QueryPlan:
+    """Raw score vectors for one (query, corpus, filter), each computed at most once.
+
+    ``scorers`` maps a signal name to ``fn(query, corpus, fingerprint,
+    candidates)`` returning one score per candidate document (every document
+    when ``candidates`` is None). ``docs`` holds the candidates in score
+    order; the per-mode rankings are derived from the cached vectors, so
+    changing the hybrid weight only re-blends two arrays.
+    """
+
+    def __init__(self, query, corpus, scorers, fingerprint=None, candidates=None, filter_key=""):
+        self.query = query
+        self.corpus = corpus
+        self.candidates = candidates
+        self.filter_key = filter_key
+        # Columnar corpora hand out a view; documents are only built for results
+        if candidates is None:
+            self.docs = corpus
+        elif hasattr(corpus, "take"):
+            self.docs = corpus.take(candidates)
+        else:
+            self.docs = [corpus[i] for i in candidates]
+        self.scorers = scorers
+        self.fingerprint = fingerprint or corpus_fingerprint(corpus)
+        self._signals = {}
+        self._partial = {name: {} for name in scorers}
+        self._locks = {name: threading.Lock() for name in scorers}
+        self._degraded = set()
+
+    def signal(self, name):
+        if name not in self._signals:
+            with self._locks[name]:
+                if name not in self._signals:
+                    with degraded_scope() as degraded:
+                        scores = self.scorers[name](self.query, self.corpus, fingerprint=self.fingerprint, candidates=self.candidates)
+                    # Degraded scores (provider errors, deadline) are shared by
+                    # every mode of this plan, but no ranking built on them is cached
+                    if degraded:
+                        self._degraded.add(name)
+                    self._signals[name] = np.asarray(scores, dtype=np.float32)
+        if name in self._degraded:
+            mark_degraded()
+        return self._signals[name]
+
+    def signal_subset(self, name, ids):
+        # Score only the given documents, reusing any already scored by this plan
+        if name in self._signals:
+            return self.signal(name)[ids]
+        with self._locks[name]:
+            known = self._partial[name]
+            missing = [i for i in ids if i not in known]
+            if missing:
+                with degraded_scope() as degraded:
+                    scores = self.scorers[name](self.query, [self.docs[i] for i in missing])
+                if degraded:
+                    self._degraded.add(name)
+                known.update(zip(missing, np.asarray(scores, dtype=np.float32)))
+        if name in self._degraded:
+            mark_degraded()
+        return np.array([known[i] for i in ids], dtype=np.float32)
+
+    @property
+    def degraded(self):
+        return bool(self._degraded)
+
+    def cascade(self, hybrid_weight=0.6, top_k=20, llm_weight=0.7, fusion=None):
+        """Retrieve the top ``top_k`` hybrid candidates and rerank them with the LLM.
+
+        Returns candidate ids, fused scores and the per-stage scores, best first.
+        Without usable LLM scores (no provider configured, or a degraded
+        signal) the candidates keep their retrieve order and the stages
+        hold no ``rerank`` entry.
+        """
+        hybrid = self.scores("Hybrid", hybrid_weight, fusion)
+        ids = top_k_indices(hybrid, top_k)
+        retrieve = hybrid[ids]
+        rerank = self.signal_subset("llm", ids.tolist())
+        if "llm" in self._degraded or not rerank.any():
+            # Zeros weighted at llm_weight would cap every fused score below the display threshold
+            fused = min_max(retrieve)
+            order = np.argsort(-fused, kind="stable")
+            return ids[order], fused[order], {"retrieve": retrieve[order]}
+        fused = llm_weight * rerank + (1 - llm_weight) * min_max(retrieve)
+        order = np.argsort(-fused, kind="stable")
+        return ids[order], fused[order], {"retrieve": retrieve[order], "rerank": rerank[order]}
+
+    def scores(self, mode, hybrid_weight=0.6, fusion=None):
+        if mode == "Lexical":
+            return self.signal("lexical")
+        if mode == "Semantic":
+            return self.signal("semantic")
+        if mode == "LLM":
+            return self.signal("llm")
+        return fuse([self.signal("semantic"), self.signal("lexical")], [hybrid_weight, 1 - hybrid_weight], fusion)
+
+_PLAN_CACHE = OrderedDict()
+_PLAN_CACHE_SIZE = 32
+_PLAN_LOCK = threading.Lock()
+
+def get_query_plan(query, docs, scorers, fingerprint=None, candidates=None, filter_key=""):
+    fingerprint = fingerprint or corpus_fingerprint(docs)
+    # Keyed like the result cache, while signals and prompts see the query as typed
+    key = (normalize_query(query), fingerprint, filter_key)
+    with _PLAN_LOCK:
+        plan = _PLAN_CACHE.get(key)
+        # A plan holding degraded signals serves one render; the next one retries the providers
+        if plan is None or plan.degraded:
+            incr("cache_misses", cache="query_plan")
+            plan = _PLAN_CACHE[key] = QueryPlan(query, docs, scorers, fingerprint, candidates, filter_key)
+            while len(_PLAN_CACHE) > _PLAN_CACHE_SIZE:
+                _PLAN_CACHE.popitem(last=False)
+        else:
+            incr("cache_hits", cache="query_plan")
+            _PLAN_CACHE.move_to_end(key)
+        return plan
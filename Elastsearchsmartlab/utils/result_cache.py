@@ -0,0 +1,120 @@
+import contextvars
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from utils.fusion import HYBRID_FUSION
+from utils.llm_cache import normalize_query
+from utils.tracing import incr
+
+# Final ranked results per (query, mode, weight, fusion, top-k, filters, corpus)
+# and query embeddings per (model, query); 0 disables either cache
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 1024))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 4096))
+
+class LRUCache:
+    """Thread-safe LRU with hit/miss statistics, exported as the
+    ``cache_hits``/``cache_misses`` counters under ``cache=<name>``."""
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+        incr("cache_misses" if value is None else "cache_hits", cache=self.name)
+        return value
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        # Drop every entry, or those whose key matches ``predicate``
+        with self._lock:
+            stale = [k for k in self._entries if predicate is None or predicate(k)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+RESULTS = LRUCache("results", RESULT_CACHE_SIZE)
+QUERY_EMBEDDINGS = LRUCache("query_embedding", QUERY_EMBEDDING_CACHE_SIZE)
+
+# Set while a ranking is computed; scorers flag it when they fall back to partial data
+_DEGRADED = contextvars.ContextVar("result_degraded", default=None)
+
+def mark_degraded():
+    """Keep the ranking being computed out of the cache (e.g. LLM scores
+    missing after a deadline or provider errors), so it is retried."""
+    flag = _DEGRADED.get()
+    if flag is not None:
+        flag.append(True)
+
+@contextmanager
+def degraded_scope():
+    """Collect ``mark_degraded`` calls made inside the block; the yielded
+    list is non-empty if any were."""
+    flag = []
+    token = _DEGRADED.set(flag)
+    try:
+        yield flag
+    finally:
+        _DEGRADED.reset(token)
+
+def result_key(query, fingerprint, filter_key, mode, hybrid_weight, top_k, fusion):
+    # Corpus changes give a new fingerprint, so stale entries are never hit and age out
+    return (normalize_query(query), mode, round(float(hybrid_weight), 6), fusion or HYBRID_FUSION,
+            top_k, filter_key, fingerprint)
+
+def cached_results(key, rank_fn):
+    # ``rank_fn`` runs only on a miss; its result is cached unless it was degraded
+    results = RESULTS.get(key)
+    if results is not None:
+        return [dict(r) for r in results]
+    with degraded_scope() as degraded:
+        results = rank_fn()
+    if not degraded:
+        RESULTS.put(key, [dict(r) for r in results])
+    return results
+
+def cached_query_embedding(model_name, query, encode_query):
+    key = (model_name, normalize_query(query))
+    vector = QUERY_EMBEDDINGS.get(key)
+    if vector is None:
+        vector = encode_query(query)
+        QUERY_EMBEDDINGS.put(key, vector)
+    return vector
+
+def invalidate_corpus(fingerprint):
+    """Drop cached results for a corpus that has been replaced."""
+    return RESULTS.invalidate(lambda key: key[-1] == fingerprint)
+
+def cache_stats():
+    return {"results": RESULTS.stats(), "query_embedding": QUERY_EMBEDDINGS.stats()}
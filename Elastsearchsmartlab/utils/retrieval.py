@@ -1,224 +1,525 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import streamlit as st
 from utils.dummy_docs import DOCS
-from rank_bm25 import BM25Okapi
+from utils.lexical import get_lexical_index, corpus_fingerprint
+from utils.embedding_store import get_embedding_store
+from utils.docstore import doc_titles
+from utils.segments import Snapshot
+from utils.shards import use_shards, get_sharded_corpus
+from utils.ann import use_ann, get_ann_index
+from utils.quantize import QuantizedIndex, get_quantized_index, QUANTIZATION
+from utils.encoders import get_encoder, bulk_encoder, store_name
+from utils.query_plan import get_query_plan
+from utils.result_cache import cached_results, cached_query_embedding, mark_degraded, result_key
+from utils.filters import get_filter_index, filters_key
+from utils.fusion import max_norm, top_k as top_k_indices
+from utils.llm_cache import get_llm_cache, LLM_CACHE_ENABLED
+from utils.providers import get_registry, GROQ_API_URL
+from utils.clients import get_secret, get_http_session, get_openai_client, get_cohere_client, get_gemini_model, get_sentence_transformer
+from utils.tracing import span, incr, start_trace
 import os
+import re
+import json
+import time
 import logging
+import contextvars
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+
+ST_MODEL_NAME = "all-MiniLM-L6-v2"
+COHERE_EMBED_MODEL = "embed-english-v3.0"
+
+# LLM relevance scoring: pool size, per-request timeout and overall deadline (seconds)
+LLM_MAX_WORKERS = int(os.environ.get("LLM_MAX_WORKERS", 8))
+LLM_REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", 10))
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 30))
+# Documents packed into one listwise scoring prompt (1 = one prompt per document)
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE", 10))
+# Cascade: hybrid candidates sent to the LLM and the LLM share of the fused score
+RERANK_TOP_K = int(os.environ.get("RERANK_TOP_K", 20))
+RERANK_LLM_WEIGHT = float(os.environ.get("RERANK_LLM_WEIGHT", 0.7))
+BATCH_SCORE_RE = re.compile(r'"id"\s*:\s*(\d+)\s*,\s*"score"\s*:\s*([0-9]*\.?[0-9]+)')
+SEARCH_MODES = ["Lexical", "Semantic", "Hybrid", "LLM Rerank"]
+EMBED_CACHE_SIZE = 1024
+
+# Process-wide LRU of sentence-transformers encodings, keyed by the texts
+_EMBED_CACHE = OrderedDict()
+_EMBED_LOCK = threading.Lock()
 
-@st.cache_resource
 def get_model():
-    return SentenceTransformer('all-MiniLM-L6-v2')
+    return get_sentence_transformer(ST_MODEL_NAME)
 
-@st.cache_data
 def embed_texts(texts):
-    model = get_model()
-    return model.encode(texts, show_progress_bar=False)
+    key = tuple(texts)
+    with _EMBED_LOCK:
+        cached = _EMBED_CACHE.get(key)
+        if cached is not None:
+            _EMBED_CACHE.move_to_end(key)
+            return cached
+    vectors = get_encoder(ST_MODEL_NAME).encode(list(texts))
+    with _EMBED_LOCK:
+        _EMBED_CACHE[key] = vectors
+        while len(_EMBED_CACHE) > EMBED_CACHE_SIZE:
+            _EMBED_CACHE.popitem(last=False)
+    return vectors
 
 def filter_docs(docs, filters):
-    return docs  # Filtering logic can be added if needed
+    if not filters:
+        return docs
+    candidates = get_filter_index(docs, corpus_fingerprint(docs)).candidates(filters)
+    return [docs[i] for i in candidates]
+
+def get_bm25_scores(query, docs, fingerprint=None, candidates=None):
+    # BM25 over a cached inverted index, built once per corpus fingerprint,
+    # or over the segments of a segmented collection
+    if isinstance(docs, Snapshot):
+        with span("lexical.search", segments=len(docs.segments)):
+            scores = docs.bm25_scores(query)
+    elif use_shards(len(docs)):
+        with span("lexical.index", docs=len(docs)):
+            sharded = get_sharded_corpus(docs, fingerprint or corpus_fingerprint(docs))
+        with span("lexical.search", shards=len(sharded)):
+            scores = sharded.bm25(query)
+    else:
+        with span("lexical.index", docs=len(docs)):
+            index = get_lexical_index(docs, fingerprint)
+        with span("lexical.search"):
+            return max_norm(index.search(query, candidates))
+    if candidates is not None:
+        scores = scores[candidates]
+    return max_norm(scores)
+
+def _cosine_scores(doc_embs, q_emb, model_name, fingerprint, candidates=None):
+    # doc_embs are normalised by the store; a large unfiltered corpus goes
+    # through the IVF index and documents outside the probed lists score just
+    # below the lowest probed one, so they rank last without the min-max of
+    # Hybrid seeing an invented 0. A filtered candidate set is always scored
+    # exactly, since the probed lists of the whole-corpus index may hold few
+    # or none of its documents
+    q_emb = np.asarray(q_emb, dtype=np.float32)
+    q_emb = q_emb / (np.linalg.norm(q_emb) + 1e-8)
+    if candidates is not None:
+        return doc_embs[candidates] @ q_emb
+    if not use_ann(len(doc_embs)):
+        return doc_embs @ q_emb
+    index = get_ann_index((model_name, fingerprint), doc_embs)
+    ids, sims = index.candidates(q_emb)
+    floor = float(sims.min()) - 1e-3 if len(sims) else -1.0
+    scores = np.full(len(doc_embs), floor, dtype=np.float32)
+    scores[ids] = sims
+    return scores
 
-def get_bm25_scores(query, docs):
-    # Try lunr.py (Python port of lunr.js) first, fallback to BM25
+def _quantized_scores(store, titles, encode, q_emb, model_name, fingerprint, candidates=None):
+    # First pass over int8/binary codes held in memory; only the top
+    # candidates are rescored from the float vectors on disk
+    def build():
+        rows = store.get_rows(titles, encode)
+        return QuantizedIndex.build(QUANTIZATION, lambda ids: store.vectors_at(rows[ids]), len(rows))
+    index = get_quantized_index((model_name, fingerprint, QUANTIZATION), build)
+    q_emb = np.asarray(q_emb, dtype=np.float32)
+    return index.scores(q_emb / (np.linalg.norm(q_emb) + 1e-8), candidates)
+
+def _segment_scores(snapshot, model_name, encode, encode_query, query, candidates=None):
+    # Exact cosine per segment; each segment reads its embedding rows once
+    with span("semantic.embed_query", model=model_name):
+        q_emb = cached_query_embedding(model_name, query, encode_query)
+    with span("semantic.search", segments=len(snapshot.segments)):
+        scores = snapshot.semantic_scores(get_embedding_store(model_name), encode, q_emb)
+    return scores if candidates is None else scores[candidates]
+
+def _sharded_scores(docs, fingerprint, model_name, encode, encode_query, query, candidates=None):
+    # Exact cosine, computed by every shard's worker over its own embedding slice
+    sharded = get_sharded_corpus(docs, fingerprint)
+    with span("semantic.embed_docs", model=model_name, docs=len(docs)):
+        sharded.ensure_embeddings(get_embedding_store(model_name), encode)
+    with span("semantic.embed_query", model=model_name):
+        q_emb = cached_query_embedding(model_name, query, encode_query)
+    with span("semantic.search", shards=len(sharded)):
+        scores = sharded.semantic(model_name, q_emb)
+    return scores if candidates is None else scores[candidates]
+
+def embedding_backend():
+    # (model name, batch encoder, query encoder) for the active embedding provider
+    cohere_key = get_secret("cohere_api_key")
+    if cohere_key:
+        co = get_cohere_client(cohere_key)
+        def encode(texts):
+            with span("embed.request", provider="Cohere", texts=len(texts)):
+                return co.embed(texts=texts, model=COHERE_EMBED_MODEL).embeddings
+        return COHERE_EMBED_MODEL, encode, lambda query: np.array(encode([query])[0])
+    return store_name(ST_MODEL_NAME), bulk_encoder(ST_MODEL_NAME), lambda query: embed_texts([query])[0]
+
+def index_embeddings(docs):
+    # Pre-populate the embedding store for a chunk of documents during ingestion
     try:
-        from lunr import lunr
-        # Build lunr index
-        documents = [
-            {"id": str(i), "title": doc["title"], "snippet": doc["snippet"]}
-            for i, doc in enumerate(docs)
-        ]
-        idx = lunr(ref="id", fields=("title", "snippet"), documents=documents)
-        results = idx.search(query)
-        # Map lunr results to scores (normalize to 0-1)
-        score_map = {r['ref']: r['score'] for r in results}
-        max_score = max(score_map.values()) if score_map else 1.0
-        scores = [score_map.get(str(i), 0.0)/max_score for i in range(len(docs))]
-        return np.array(scores)
-    except Exception:
-        # Fallback to BM25
-        tokenized_corpus = [doc['snippet'].lower().split() for doc in docs]
-        bm25 = BM25Okapi(tokenized_corpus)
-        tokenized_query = query.lower().split()
-        scores = bm25.get_scores(tokenized_query)
-        # Normalize BM25 scores to 0-1
-        max_score = max(scores) if len(scores) > 0 else 1.0
-        return np.array(scores) / max_score
-
-def get_semantic_scores(query, docs):
+        model_name, encode, _ = embedding_backend()
+        return get_embedding_store(model_name).add(doc_titles(docs), encode)
+    except Exception as e:
+        incr("errors", stage="index_embeddings")
+        logging.error(f"Embedding indexing error: {e}")
+        return 0
+
+def get_semantic_scores(query, docs, fingerprint=None, candidates=None):
+    # Document embeddings come from the on-disk store; only unseen titles are encoded
+    fingerprint = fingerprint or corpus_fingerprint(docs)
     # Try Cohere embeddings first, fallback to sentence-transformers
+    st_name = store_name(ST_MODEL_NAME)
+    model_name = st_name
     try:
-        import cohere
-        cohere_key = st.secrets.get("cohere_api_key", None) or os.environ.get("COHERE_API_KEY") or os.environ.get("cohere_api_key")
-        if cohere_key:
-            co = cohere.Client(cohere_key)
-            texts = [doc["title"] for doc in docs]
-            doc_embs = co.embed(texts=texts, model="embed-english-v3.0").embeddings
-            q_emb = co.embed(texts=[query], model="embed-english-v3.0").embeddings[0]
-            doc_embs = np.array(doc_embs)
-            q_emb = np.array(q_emb)
-            scores = np.dot(doc_embs, q_emb) / (np.linalg.norm(doc_embs, axis=1) * np.linalg.norm(q_emb) + 1e-8)
-            return scores
+        with span("semantic.backend"):
+            model_name, encode, encode_query = embedding_backend()
+        if isinstance(docs, Snapshot):
+            return _segment_scores(docs, model_name, encode, encode_query, query, candidates)
+        if use_shards(len(docs)):
+            return _sharded_scores(docs, fingerprint, model_name, encode, encode_query, query, candidates)
+        titles = doc_titles(docs)
+        if QUANTIZATION != "none":
+            with span("semantic.embed_query", model=model_name):
+                q_emb = cached_query_embedding(model_name, query, encode_query)
+            with span("semantic.search", quantization=QUANTIZATION):
+                return _quantized_scores(get_embedding_store(model_name), titles, encode, q_emb, model_name, fingerprint, candidates)
+        with span("semantic.embed_docs", model=model_name, docs=len(titles)):
+            doc_embs = get_embedding_store(model_name).get_embeddings(titles, encode)
+        with span("semantic.embed_query", model=model_name):
+            q_emb = cached_query_embedding(model_name, query, encode_query)
+        with span("semantic.search", ann=candidates is None and use_ann(len(doc_embs))):
+            return _cosine_scores(doc_embs, q_emb, model_name, fingerprint, candidates)
     except Exception:
-        pass
-    # Fallback to sentence-transformers
-    titles = [doc["title"] for doc in docs]
-    doc_embs = embed_texts(titles)
-    q_emb = embed_texts([query])[0]
-    scores = np.dot(doc_embs, q_emb) / (np.linalg.norm(doc_embs, axis=1) * np.linalg.norm(q_emb) + 1e-8)
-    return scores
+        if model_name == st_name:
+            raise
+    # Fallback to sentence-transformers; rankings from it are not cached, so
+    # the primary provider is retried once it recovers
+    incr("provider_fallbacks", signal="semantic", provider=st_name)
+    mark_degraded()
+    if isinstance(docs, Snapshot):
+        return _segment_scores(docs, st_name, bulk_encoder(ST_MODEL_NAME), lambda text: embed_texts([text])[0], query, candidates)
+    if use_shards(len(docs)):
+        return _sharded_scores(docs, fingerprint, st_name, bulk_encoder(ST_MODEL_NAME), lambda text: embed_texts([text])[0], query, candidates)
+    titles = doc_titles(docs)
+    with span("semantic.embed_docs", model=st_name, docs=len(titles)):
+        doc_embs = get_embedding_store(st_name).get_embeddings(titles, bulk_encoder(ST_MODEL_NAME))
+    with span("semantic.embed_query", model=st_name):
+        q_emb = cached_query_embedding(st_name, query, lambda text: embed_texts([text])[0])
+    with span("semantic.search"):
+        return _cosine_scores(doc_embs, q_emb, st_name, fingerprint, candidates)
 
-def get_llm_scores(query, docs):
-    import logging
-    scores = []
-    errors = []
-    # Try OpenAI (new API)
+def _relevance_prompt(query, doc):
+    return f"Given the query: '{query}', rate the relevance of the following document (0-1):\nTitle: {doc['title']}\nSnippet: {doc['snippet']}"
+
+def _batch_prompt(query, docs):
+    entries = "\n\n".join(
+        f"[{i}] Title: {doc['title']}\nSnippet: {doc['snippet']}" for i, doc in enumerate(docs)
+    )
+    return (
+        f"Given the query: '{query}', rate the relevance of each document below (0-1).\n"
+        f"Respond with only a JSON array with one object per document, e.g. "
+        f'[{{"id": 0, "score": 0.8}}, {{"id": 1, "score": 0.1}}].\n\n{entries}'
+    )
+
+def _parse_batch_scores(provider, text, num_docs):
+    # Returns {position in batch: score}; tolerates prose around the array,
+    # bare score lists and responses truncated mid-array
+    scores = {}
+    start, end = text.find("["), text.rfind("]")
     try:
-        import openai
-        api_key = st.secrets.get("openai_api_key", None) or os.environ.get("OPENAI_API_KEY") or os.environ.get("openai_api_key")
-        if api_key:
-            client = openai.OpenAI(api_key=api_key)
-            for doc in docs:
-                prompt = f"Given the query: '{query}', rate the relevance of the following document (0-1):\nTitle: {doc['title']}\nSnippet: {doc['snippet']}"
-                try:
-                    response = client.chat.completions.create(
-                        model="gpt-4",
-                        messages=[{"role": "user", "content": prompt}],
-                        max_tokens=10,
-                        temperature=0.0,
-                        stream=False
-                    )
-                    text = response.choices[0].message.content.strip()
-                    try:
-                        score = float(text.split()[0]) if text.split() else 0.0
-                    except Exception as e:
-                        logging.error(f"OpenAI LLM returned non-numeric score: '{text}'. Error: {e}")
-                        score = 0.0
-                except Exception as e:
-                    logging.error(f"OpenAI LLM error: {e}")
-                    errors.append(f"[OpenAI error: {e}]")
-                    score = 0.0
-                scores.append(score)
-            return np.array(scores)
-    except Exception as e:
-        logging.error(f"OpenAI LLM outer error: {e}")
-        errors.append(f"[OpenAI outer error: {e}]")
-    # Try Cohere
+        items = json.loads(text[start:end + 1] if start != -1 and end > start else "")
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON array")
+        for pos, item in enumerate(items):
+            if isinstance(item, dict):
+                doc_id, score = int(item.get("id", pos)), item.get("score")
+            else:
+                doc_id, score = pos, item
+            if 0 <= doc_id < num_docs and score is not None:
+                scores[doc_id] = float(score)
+    except Exception:
+        for doc_id, score in BATCH_SCORE_RE.findall(text):
+            if 0 <= int(doc_id) < num_docs:
+                scores[int(doc_id)] = float(score)
+    if len(scores) < num_docs:
+        logging.warning(f"{provider} LLM batch response scored {len(scores)}/{num_docs} documents: '{text[:200]}'")
+    return {i: min(max(score, 0.0), 1.0) for i, score in scores.items()}
+
+def _parse_score(provider, text):
     try:
-        import cohere
-        cohere_key = st.secrets.get("cohere_api_key", None) or os.environ.get("COHERE_API_KEY") or os.environ.get("cohere_api_key")
-        if cohere_key:
-            co = cohere.Client(cohere_key)
-            for doc in docs:
-                prompt = f"Given the query: '{query}', rate the relevance of the following document (0-1):\nTitle: {doc['title']}\nSnippet: {doc['snippet']}"
-                try:
-                    resp = co.generate(
-                        model="command-r-plus",
-                        prompt=prompt,
-                        max_tokens=10,
-                        temperature=0.0,
-                    )
-                    text = resp.generations[0].text.strip()
-                    try:
-                        score = float(text.split()[0]) if text.split() else 0.0
-                    except Exception as e:
-                        logging.error(f"Cohere LLM returned non-numeric score: '{text}'. Error: {e}")
-                        score = 0.0
-                except Exception as e:
-                    logging.error(f"Cohere LLM error: {e}")
-                    errors.append(f"[Cohere error: {e}]")
-                    score = 0.0
-                scores.append(score)
-            return np.array(scores)
+        return float(text.split()[0]) if text.split() else 0.0
     except Exception as e:
-        logging.error(f"Cohere LLM outer error: {e}")
-        errors.append(f"[Cohere outer error: {e}]")
-    # Try Groq
+        incr("errors", stage="llm.parse", provider=provider)
+        logging.error(f"{provider} LLM returned non-numeric score: '{text}'. Error: {e}")
+        return 0.0
+
+def _openai_completion(api_key, model):
+    client = get_openai_client(api_key, timeout=LLM_REQUEST_TIMEOUT)
+    def complete(prompt, max_tokens=10):
+        response = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0.0,
+            stream=False
+        )
+        return response.choices[0].message.content.strip()
+    return complete
+
+def _cohere_completion(api_key, model):
+    co = get_cohere_client(api_key, timeout=LLM_REQUEST_TIMEOUT)
+    def complete(prompt, max_tokens=10):
+        resp = co.generate(
+            model=model,
+            prompt=prompt,
+            max_tokens=max_tokens,
+            temperature=0.0,
+        )
+        return resp.generations[0].text.strip()
+    return complete
+
+def _groq_completion(api_key, model):
+    session = get_http_session()
+    def complete(prompt, max_tokens=10):
+        response = session.post(
+            GROQ_API_URL,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            json={
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": max_tokens,
+                "temperature": 0.0
+            },
+            timeout=LLM_REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"].strip()
+    return complete
+
+def _gemini_completion(api_key, model):
+    gemini = get_gemini_model(api_key, model)
+    def complete(prompt, max_tokens=10):
+        resp = gemini.generate_content(
+            prompt,
+            generation_config={"max_output_tokens": max_tokens},
+            request_options={"timeout": LLM_REQUEST_TIMEOUT},
+        )
+        return resp.text.strip()
+    return complete
+
+# name -> (secret, model, factory returning a (prompt, max_tokens) -> text callable);
+# the call order comes from the provider registry
+LLM_PROVIDERS = {
+    "OpenAI": ("openai_api_key", "gpt-4", _openai_completion),
+    "Cohere": ("cohere_api_key", "command-r-plus", _cohere_completion),
+    "Groq": ("groq_api_key", "llama3-70b-8192", _groq_completion),
+    "Gemini": ("gemini_api_key", "gemini-pro", _gemini_completion),
+}
+
+def _score_batch(provider, complete, query, docs, ids):
+    if len(ids) == 1:
+        return {ids[0]: _parse_score(provider, complete(_relevance_prompt(query, docs[ids[0]])))}
+    text = complete(_batch_prompt(query, [docs[i] for i in ids]), max_tokens=20 * len(ids) + 20)
+    parsed = _parse_batch_scores(provider, text, len(ids))
+    result = {ids[pos]: score for pos, score in parsed.items()}
+    # Documents the batch response dropped are rescored one at a time
+    for i in ids:
+        if i not in result:
+            result[i] = _parse_score(provider, complete(_relevance_prompt(query, docs[i])))
+    return result
+
+def score_concurrently(provider, complete, query, docs, max_workers=None, deadline=None, batch_size=None):
+    # Fan batches of documents out over a bounded pool; documents that have
+    # not been scored when the deadline hits keep a score of 0 and are left
+    # unset in the returned completed mask
+    max_workers = max_workers or LLM_MAX_WORKERS
+    deadline = deadline if deadline is not None else LLM_DEADLINE
+    batch_size = max(1, batch_size or LLM_BATCH_SIZE)
+    scores = np.zeros(len(docs))
+    completed = np.zeros(len(docs), dtype=bool)
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    batches = [list(range(i, min(i + batch_size, len(docs)))) for i in range(0, len(docs), batch_size)]
+    # Each batch runs in a copy of the caller's context so its spans join the active trace
+    futures = {
+        executor.submit(contextvars.copy_context().run, _score_batch, provider, complete, query, docs, ids): ids
+        for ids in batches
+    }
+    done = 0
     try:
-        import requests
-        groq_key = st.secrets.get("groq_api_key", None) or os.environ.get("GROQ_API_KEY") or os.environ.get("groq_api_key")
-        if groq_key:
-            for doc in docs:
-                prompt = f"Given the query: '{query}', rate the relevance of the following document (0-1):\nTitle: {doc['title']}\nSnippet: {doc['snippet']}"
-                try:
-                    response = requests.post(
-                        "https://api.groq.com/v1/chat/completions",
-                        headers={"Authorization": f"Bearer {groq_key}", "Content-Type": "application/json"},
-                        json={
-                            "model": "llama3-70b-8192",
-                            "messages": [{"role": "user", "content": prompt}],
-                            "max_tokens": 10,
-                            "temperature": 0.0
-                        },
-                        timeout=10
+        for future in as_completed(futures, timeout=deadline):
+            try:
+                for i, score in future.result().items():
+                    scores[i] = score
+                    completed[i] = True
+            except Exception as e:
+                logging.error(f"{provider} LLM error: {e}")
+            done += len(futures[future])
+    except FuturesTimeout:
+        incr("deadline_hits", provider=provider)
+        logging.warning(f"{provider} LLM deadline of {deadline}s hit; {done}/{len(docs)} documents completed")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return scores, completed
+
+def _score_with_cache(provider, model, complete, query, docs, max_workers, deadline, batch_size, use_cache):
+    if not use_cache:
+        return score_concurrently(provider, complete, query, docs, max_workers, deadline, batch_size)
+    cache = get_llm_cache()
+    keys = [cache.key(query, doc, provider, model) for doc in docs]
+    cached = cache.get_many(keys)
+    scores = np.array([cached.get(k, 0.0) for k in keys])
+    completed = np.array([k in cached for k in keys], dtype=bool)
+    missing = np.flatnonzero(~completed)
+    incr("cache_hits", len(keys) - len(missing), cache="llm_scores")
+    incr("cache_misses", len(missing), cache="llm_scores")
+    if len(missing):
+        fresh, fresh_ok = score_concurrently(provider, complete, query, [docs[i] for i in missing], max_workers, deadline, batch_size)
+        scores[missing] = fresh
+        completed[missing] = fresh_ok
+        # Only scores that actually came back are cached, never deadline fill-ins
+        cache.put_many({keys[i]: score for i, score, ok in zip(missing, fresh, fresh_ok) if ok})
+    return scores, completed
+
+def get_llm_scores(query, docs, fingerprint=None, candidates=None, max_workers=None, deadline=None, batch_size=None, use_cache=None):
+    # Providers are tried healthiest-first; documents a provider could not
+    # score (errors, open circuit) fall through to the next one, all within
+    # one overall deadline
+    if candidates is not None:
+        docs = [docs[i] for i in candidates]
+    use_cache = LLM_CACHE_ENABLED if use_cache is None else use_cache
+    deadline = deadline if deadline is not None else LLM_DEADLINE
+    end_time = time.monotonic() + deadline
+    registry = get_registry()
+    scores = np.zeros(len(docs))
+    remaining = np.arange(len(docs))
+    errors = []
+    attempted = False
+    for provider in registry.order(list(LLM_PROVIDERS)):
+        secret, model, factory = LLM_PROVIDERS[provider]
+        time_left = end_time - time.monotonic()
+        if not len(remaining) or time_left <= 0:
+            break
+        try:
+            api_key = get_secret(secret)
+            if api_key:
+                if attempted:
+                    incr("provider_fallbacks", signal="llm", provider=provider)
+                attempted = True
+                with span("llm.provider", provider=provider, docs=len(remaining)) as attrs:
+                    complete = registry.track(provider, factory(api_key, model))
+                    sub_scores, completed = _score_with_cache(
+                        provider, model, complete, query, [docs[i] for i in remaining],
+                        max_workers, time_left, batch_size, use_cache,
                     )
-                    text = response.json()["choices"][0]["message"]["content"].strip()
-                    try:
-                        score = float(text.split()[0]) if text.split() else 0.0
-                    except Exception as e:
-                        logging.error(f"Groq LLM returned non-numeric score: '{text}'. Error: {e}")
-                        score = 0.0
-                except Exception as e:
-                    logging.error(f"Groq LLM error: {e}")
-                    errors.append(f"[Groq error: {e}]")
-                    score = 0.0
-                scores.append(score)
-            return np.array(scores)
-    except Exception as e:
-        logging.error(f"Groq LLM outer error: {e}")
-        errors.append(f"[Groq outer error: {e}]")
-    # Try Gemini
-    try:
-        import google.generativeai as genai
-        gemini_key = st.secrets.get("gemini_api_key", None) or os.environ.get("GEMINI_API_KEY") or os.environ.get("gemini_api_key")
-        if gemini_key:
-            genai.configure(api_key=gemini_key)
-            model = genai.GenerativeModel('gemini-pro')
-            for doc in docs:
-                prompt = f"Given the query: '{query}', rate the relevance of the following document (0-1):\nTitle: {doc['title']}\nSnippet: {doc['snippet']}"
-                try:
-                    resp = model.generate_content(prompt)
-                    text = resp.text.strip()
-                    try:
-                        score = float(text.split()[0]) if text.split() else 0.0
-                    except Exception as e:
-                        logging.error(f"Gemini LLM returned non-numeric score: '{text}'. Error: {e}")
-                        score = 0.0
-                except Exception as e:
-                    logging.error(f"Gemini LLM error: {e}")
-                    errors.append(f"[Gemini error: {e}]")
-                    score = 0.0
-                scores.append(score)
-            return np.array(scores)
-    except Exception as e:
-        logging.error(f"Gemini LLM outer error: {e}")
-        errors.append(f"[Gemini outer error: {e}]")
-    # If all fail, log and return zeros
-    if errors:
+                    attrs["scored"] = int(completed.sum())
+                scores[remaining[completed]] = sub_scores[completed]
+                if not completed.all():
+                    errors.append(f"[{provider}: {int((~completed).sum())}/{len(remaining)} documents unscored]")
+                remaining = remaining[~completed]
+        except Exception as e:
+            registry.record_failure(provider)
+            logging.error(f"{provider} LLM outer error: {e}")
+            errors.append(f"[{provider} outer error: {e}]")
+    # Unscored documents keep 0; unless no provider is configured at all, that
+    # is a transient gap (errors, deadline, open circuits) the result cache must not keep
+    if len(remaining) and any(get_secret(secret) for secret, _, _ in LLM_PROVIDERS.values()):
+        mark_degraded()
+    # Log whatever could not be scored
+    if len(remaining) and errors:
         for err in errors:
             logging.error(err)
-    return np.zeros(len(docs))
+    return scores
+
+SIGNAL_SCORERS = {
+    "lexical": get_bm25_scores,
+    "semantic": get_semantic_scores,
+    "llm": get_llm_scores,
+}
+
+MODE_METHODS = {
+    "Lexical": "BM25 (cached inverted index)",
+    "Semantic": "Cohere Embedding (fallback: sentence-transformers)",
+    "LLM": "LLM (healthiest of OpenAI/Cohere/Groq/Gemini)",
+    "Hybrid": "Hybrid (Semantic + Lexical)",
+    "LLM Rerank": "Hybrid top-K → LLM rerank",
+}
 
-def get_simulated_results(query, mode, filters=None, hybrid_weight=0.6, user_docs=None):
+def plan_query(query, filters=None, user_docs=None):
+    # Filters run first, so every scorer only touches the surviving candidates
     docs = user_docs if user_docs is not None else DOCS
-    docs = filter_docs(docs, filters)
     if not docs:
+        return None
+    with span("fingerprint", docs=len(docs)):
+        fingerprint = corpus_fingerprint(docs)
+    candidates = None
+    if filters:
+        with span("filter") as attrs:
+            candidates = get_filter_index(docs, fingerprint).candidates(filters)
+            attrs["candidates"] = len(candidates)
+        if not len(candidates):
+            return None
+    return get_query_plan(query, docs, SIGNAL_SCORERS, fingerprint, candidates, filters_key(filters))
+
+def rank_plan(plan, mode, hybrid_weight=0.6, top_k=5, fusion=None):
+    if plan is None:
         return []
-    if mode == "Lexical":
-        scores = get_bm25_scores(query, docs)
-        method = "Lunr.js (Python) or BM25 fallback"
-    elif mode == "Semantic":
-        scores = get_semantic_scores(query, docs)
-        method = "Cohere Embedding (fallback: sentence-transformers)"
-    elif mode == "LLM":
-        scores = get_llm_scores(query, docs)
-        method = "LLM (OpenAI→Cohere→Groq→Gemini)"
-    else:  # Hybrid
-        sem_scores = get_semantic_scores(query, docs)
-        lex_scores = get_bm25_scores(query, docs)
-        scores = hybrid_weight*sem_scores + (1-hybrid_weight)*lex_scores
-        method = f"Hybrid (Semantic + Lexical)"
-    idxs = np.argsort(scores)[-5:][::-1]
+    key = result_key(plan.query, plan.fingerprint, plan.filter_key, mode, hybrid_weight, top_k, fusion)
+
+    def rank():
+        with span("rank", mode=mode):
+            return _rank(plan, mode, hybrid_weight, top_k, fusion)
+    return cached_results(key, rank)
+
+def _rank(plan, mode, hybrid_weight, top_k, fusion):
+    if mode == "LLM Rerank":
+        ids, fused, stages = plan.cascade(hybrid_weight, RERANK_TOP_K, RERANK_LLM_WEIGHT, fusion)
+        reranked = "rerank" in stages
+        return [
+            {
+                **plan.docs[i],
+                "score": fused[rank],
+                "method": MODE_METHODS[mode] if reranked else f"{MODE_METHODS['Hybrid']} (LLM rerank unavailable)",
+                "stage_scores": {stage: values[rank] for stage, values in stages.items()},
+                **({} if reranked else {"degraded": True}),
+            }
+            for rank, i in enumerate(ids[:top_k])
+        ]
+    scores = plan.scores(mode, hybrid_weight, fusion)
+    method = MODE_METHODS.get(mode, MODE_METHODS["Hybrid"])
+    idxs = top_k_indices(scores, top_k)
     return [
-        {**docs[i], "score": scores[i], "method": method}
+        {**plan.docs[i], "score": scores[i], "method": method}
         for i in idxs
     ]
+
+def _result_json(result):
+    out = {**result, "score": float(result["score"])}
+    if "stage_scores" in out:
+        out["stage_scores"] = {stage: float(score) for stage, score in out["stage_scores"].items()}
+    return out
+
+def search(query, modes=None, filters=None, hybrid_weight=0.6, top_k=5, fusion=None, user_docs=None):
+    """Rank ``query`` under each mode from one shared query plan.
+
+    Returns a JSON-serialisable dict: ``{"query", "plan_trace", "modes":
+    {mode: {"results", "trace"}}}``, with each trace as ``Trace.to_dict()``.
+    """
+    modes = modes or SEARCH_MODES
+    unknown = [m for m in modes if m not in MODE_METHODS]
+    if unknown:
+        raise ValueError(f"Unknown search mode(s): {', '.join(unknown)}")
+    with start_trace("Query plan", query=query) as plan_trace:
+        plan = plan_query(query, filters, user_docs)
+    by_mode = {}
+    for mode in modes:
+        with start_trace(mode, query=query) as trace:
+            results = rank_plan(plan, mode, hybrid_weight, top_k, fusion)
+        by_mode[mode] = {"results": [_result_json(r) for r in results], "trace": trace.to_dict()}
+    return {"query": query, "plan_trace": plan_trace.to_dict(), "modes": by_mode}
+
+def prewarm_results(queries, user_docs=None, modes=("Lexical", "Semantic", "Hybrid"), hybrid_weight=0.6, top_k=5, fusion=None):
+    # Rank ``queries`` ahead of time so their first search is a cache hit.
+    # LLM modes are left out by default: warming them costs provider calls.
+    for query in queries:
+        plan = plan_query(query, user_docs=user_docs)
+        for mode in modes:
+            rank_plan(plan, mode, hybrid_weight, top_k, fusion)
+
+def get_simulated_results(query, mode, filters=None, hybrid_weight=0.6, user_docs=None, fusion=None):
+    with start_trace(mode, query=query):
+        return rank_plan(plan_query(query, filters, user_docs), mode, hybrid_weight, fusion=fusion)
@@ -0,0 +1,30 @@
+import os
+from utils.clients import get_http_session
+
+# When set, the Streamlit app sends searches to the search API (api.py) at
+# this URL instead of running the engine in-process
+SEARCH_API_URL = os.environ.get("SEARCH_API_URL", "").rstrip("/")
+SEARCH_API_TIMEOUT = float(os.environ.get("SEARCH_API_TIMEOUT", 60))
+
+def remote_search(query, modes=None, filters=None, hybrid_weight=0.6, top_k=5, fusion=None, base_url=None):
+    # Same response shape as utils.retrieval.search
+    response = get_http_session().post(
+        f"{base_url or SEARCH_API_URL}/search",
+        json={
+            "query": query,
+            "modes": modes,
+            "filters": filters or None,
+            "hybrid_weight": hybrid_weight,
+            "top_k": top_k,
+            "fusion": fusion,
+            "trace": True,
+        },
+        timeout=SEARCH_API_TIMEOUT,
+    )
+    if response.status_code >= 400:
+        try:
+            message = response.json().get("error")
+        except ValueError:
+            message = response.text[:200]
+        raise RuntimeError(f"search API returned {response.status_code}: {message}")
+    return response.json()
@@ -0,0 +1,357 @@
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import uuid
+from collections import Counter
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from utils.docstore import DocStore, DocView
+from utils.filters import FilterIndex
+from utils.lexical import LexicalIndexBuilder, tokenize
+from utils.tracing import span, incr
+
+# Merge policy: once there are more than SEGMENT_MERGE_FACTOR segments the
+# smallest ones are merged, and a segment whose deleted share exceeds
+# SEGMENT_MAX_DELETED is rewritten without its tombstoned documents
+SEGMENT_MERGE_FACTOR = int(os.environ.get("SEGMENT_MERGE_FACTOR", 8))
+SEGMENT_MAX_DELETED = float(os.environ.get("SEGMENT_MAX_DELETED", 0.3))
+
+def doc_key(doc):
+    # Documents are identified by an explicit "id" or else by their content
+    if doc.get("id") is not None:
+        return str(doc["id"])
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class Segment:
+    """An immutable slice of a collection, indexed once when it is written.
+
+    Postings keep raw term frequencies rather than BM25 impacts, so IDF and
+    the average length come from all segments at query time. Deletes never
+    touch a segment; they live in the owning index's per-segment live masks.
+    """
+
+    _ids = itertools.count()
+
+    def __init__(self, docs, keys, k1=1.2, b=0.75):
+        self.id = next(Segment._ids)
+        self.docs = docs if isinstance(docs, DocStore) else DocStore.from_docs(docs)
+        self.keys = keys
+        self.k1 = k1
+        self.b = b
+        builder = LexicalIndexBuilder(k1=k1, b=b)
+        builder.add(docs)
+        self.doc_lens = np.frombuffer(builder.doc_lens, dtype=np.float32).copy()
+        self.postings = {
+            term: (np.frombuffer(ids, dtype=np.int32).copy(), np.frombuffer(tfs, dtype=np.float32).copy())
+            for term, (ids, tfs) in builder.postings.items()
+        }
+        self.filters = FilterIndex(docs)
+        self._vectors = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def bm25(self, terms, idf, avgdl):
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        length_norm = None
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            if length_norm is None:
+                length_norm = self.k1 * (1 - self.b + self.b * self.doc_lens / (avgdl or 1.0))
+            ids, tfs = posting
+            scores[ids] += idf[term] * tfs * (self.k1 + 1) / (tfs + length_norm[ids])
+        return scores
+
+    def vectors(self, store, encode):
+        # Embedding rows are fetched once per segment and model, encoding only unseen titles
+        with self._lock:
+            vectors = self._vectors.get(store.model_name)
+            if vectors is None:
+                rows = store.get_rows(self.docs.titles(), encode)
+                vectors = self._vectors[store.model_name] = store.vectors_at(rows)
+            return vectors
+
+class Snapshot(Sequence):
+    """The live documents of a SegmentedIndex at one generation.
+
+    It is a sequence of documents, so it can be searched like any corpus;
+    the engine recognises it and scores each segment separately instead of
+    building whole-corpus indexes. Documents stay in their segments'
+    columnar stores until they are read.
+    """
+
+    def __init__(self, segments, fingerprint, uid=None):
+        self.segments = segments
+        self.fingerprint = fingerprint
+        # The owning SegmentedIndex, the same for every generation
+        self.uid = uid
+        self._positions = [np.flatnonzero(live) for _, live in segments]
+        self._starts = np.cumsum([0] + [len(p) for p in self._positions])
+
+    def __len__(self):
+        return int(self._starts[-1])
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(np.arange(len(self))[i])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+        s = int(np.searchsorted(self._starts, i, side="right")) - 1
+        return self.segments[s][0].docs[int(self._positions[s][i - self._starts[s]])]
+
+    def __iter__(self):
+        for (segment, _), positions in zip(self.segments, self._positions):
+            for position in positions:
+                yield segment.docs[int(position)]
+
+    def take(self, ids):
+        return DocView(self, ids)
+
+    def entries(self):
+        # (document key, segment id) of every live document, in snapshot order
+        return [(segment.keys[int(position)], segment.id)
+                for (segment, _), positions in zip(self.segments, self._positions) for position in positions]
+
+    def titles(self):
+        titles = []
+        for (segment, _), positions in zip(self.segments, self._positions):
+            titles.extend(segment.docs.take(positions).titles())
+        return titles
+
+    def _gather(self, per_segment):
+        # Scatter a scorer over the segments, keep live documents, in snapshot order
+        if not self.segments:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([per_segment(segment)[live] for segment, live in self.segments]).astype(np.float32)
+
+    def bm25_scores(self, query):
+        # Collection statistics span all segments and, as in Lucene, count
+        # deleted documents until a merge drops them
+        terms = set(tokenize(query))
+        num_docs = sum(len(segment) for segment, _ in self.segments)
+        avgdl = sum(float(segment.doc_lens.sum()) for segment, _ in self.segments) / max(num_docs, 1)
+        df = Counter()
+        for segment, _ in self.segments:
+            for term in terms:
+                posting = segment.postings.get(term)
+                if posting is not None:
+                    df[term] += len(posting[0])
+        idf = {term: math.log(1 + (num_docs - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+        return self._gather(lambda segment: segment.bm25(df, idf, avgdl))
+
+    def semantic_scores(self, store, encode, q_emb):
+        q_emb = np.asarray(q_emb, dtype=np.float32)
+        q_emb = q_emb / (np.linalg.norm(q_emb) + 1e-8)
+        return self._gather(lambda segment: segment.vectors(store, encode) @ q_emb)
+
+    # The FilterIndex interface, answered per segment
+
+    def mask(self, filters):
+        return np.concatenate([segment.filters.mask(filters)[live] for segment, live in self.segments]) \
+            if self.segments else np.zeros(0, dtype=bool)
+
+    def candidates(self, filters):
+        return np.flatnonzero(self.mask(filters))
+
+    def values(self, field):
+        counts = Counter()
+        labels = {}
+        for segment, live in self.segments:
+            for value, ids in segment.filters.postings[field].items():
+                alive = int(live[ids].sum())
+                if alive:
+                    counts[value] += alive
+                    labels.setdefault(value, segment.filters.labels[field][value])
+        return [labels[v] for v in sorted(counts, key=lambda v: (-counts[v], v))]
+
+    def date_bounds(self):
+        dates = np.concatenate([segment.filters.dates[live] for segment, live in self.segments]) \
+            if self.segments else np.zeros(0, dtype="datetime64[D]")
+        valid = dates[~np.isnat(dates)]
+        if not len(valid):
+            return None, None
+        return valid.min(), valid.max()
+
+_MERGE_POOL = None
+_MERGE_POOL_LOCK = threading.Lock()
+
+def _get_merge_pool():
+    global _MERGE_POOL
+    with _MERGE_POOL_LOCK:
+        if _MERGE_POOL is None:
+            _MERGE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segment-merge")
+        return _MERGE_POOL
+
+class SegmentedIndex:
+    """A document collection indexed as immutable segments, as in Lucene.
+
+    ``add`` indexes only the new documents into a fresh segment, ``delete``
+    tombstones documents in place, and merges run on a background thread.
+    ``snapshot()`` returns the searchable live documents.
+    """
+
+    def __init__(self, docs=(), merge_factor=None, max_deleted=None, background_merges=True):
+        self.merge_factor = merge_factor or SEGMENT_MERGE_FACTOR
+        self.max_deleted = SEGMENT_MAX_DELETED if max_deleted is None else max_deleted
+        self.background_merges = background_merges
+        self._uid = uuid.uuid4().hex[:12]
+        self._lock = threading.Lock()
+        self._segments = []
+        self._where = {}
+        self._generation = 0
+        self._snapshot = None
+        self._merging = False
+        if docs:
+            self.add(docs)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._where)
+
+    def snapshot(self):
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = Snapshot(list(self._segments), f"segments-{self._uid}-{self._generation}",
+                                          f"segments-{self._uid}")
+            return self._snapshot
+
+    def _changed(self):
+        self._generation += 1
+        self._snapshot = None
+
+    def _delete_locked(self, keys):
+        by_segment = {}
+        for key in keys:
+            where = self._where.pop(key, None)
+            if where is not None:
+                by_segment.setdefault(where[0], []).append(where[1])
+        # Live masks are copied on write, so existing snapshots keep their view
+        for i, (segment, live) in enumerate(self._segments):
+            positions = by_segment.get(segment.id)
+            if positions:
+                live = live.copy()
+                live[positions] = False
+                self._segments[i] = (segment, live)
+        return sum(len(p) for p in by_segment.values())
+
+    def add(self, docs):
+        """Index ``docs`` as a new segment; a document whose key is already
+        live replaces the old version. Returns how many were added."""
+        latest = {}
+        for doc in docs:
+            latest[doc_key(doc)] = doc
+        if not latest:
+            return 0
+        with span("segments.flush", docs=len(latest)):
+            segment = Segment(list(latest.values()), list(latest))
+        with self._lock:
+            self._delete_locked(segment.keys)
+            self._segments.append((segment, np.ones(len(segment), dtype=bool)))
+            for position, key in enumerate(segment.keys):
+                self._where[key] = (segment.id, position)
+            self._changed()
+        incr("segment_flushes")
+        self._maybe_merge()
+        return len(segment)
+
+    def delete(self, keys):
+        """Tombstone the documents with these keys; returns how many were live."""
+        with self._lock:
+            deleted = self._delete_locked(set(keys))
+            if deleted:
+                self._changed()
+        if deleted:
+            self._maybe_merge()
+        return deleted
+
+    def sync(self, docs):
+        """Make the live documents match ``docs`` (e.g. a re-uploaded file),
+        indexing only what was added and tombstoning what disappeared.
+        Returns (added, deleted)."""
+        keys = {doc_key(doc): doc for doc in docs}
+        with self._lock:
+            current = set(self._where)
+        deleted = self.delete(current - set(keys))
+        added = self.add([doc for key, doc in keys.items() if key not in current])
+        return added, deleted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "generation": self._generation,
+                "live_docs": len(self._where),
+                "segments": [{"id": s.id, "docs": len(s), "live": int(live.sum())} for s, live in self._segments],
+            }
+
+    def _pick_merge(self):
+        # Rewrite a segment with too many deletes, else merge the smallest
+        # segments once there are too many of them
+        for segment, live in self._segments:
+            if len(segment) and 1 - live.sum() / len(segment) > self.max_deleted:
+                return [segment.id]
+        if len(self._segments) > self.merge_factor:
+            smallest = sorted(self._segments, key=lambda s: int(s[1].sum()))[:self.merge_factor]
+            return [segment.id for segment, _ in smallest]
+        return None
+
+    def _maybe_merge(self):
+        with self._lock:
+            if self._merging:
+                return
+            ids = self._pick_merge()
+            if not ids:
+                return
+            self._merging = True
+        if self.background_merges:
+            _get_merge_pool().submit(self._merge, ids)
+        else:
+            self._merge(ids)
+
+    def _merge(self, ids):
+        try:
+            with self._lock:
+                chosen = [(segment, live) for segment, live in self._segments if segment.id in ids]
+            with span("segments.merge", segments=len(chosen)):
+                taken = [np.flatnonzero(live) for _, live in chosen]
+                docs = DocStore.from_docs(segment.docs[i] for (segment, _), positions in zip(chosen, taken) for i in positions)
+                keys = [segment.keys[i] for (segment, _), positions in zip(chosen, taken) for i in positions]
+                merged = Segment(docs, keys) if len(docs) else None
+                if merged is not None:
+                    # Embeddings carry over; nothing is re-encoded
+                    models = set.intersection(*(set(segment._vectors) for segment, _ in chosen))
+                    for model in models:
+                        merged._vectors[model] = np.concatenate(
+                            [segment._vectors[model][positions] for (segment, _), positions in zip(chosen, taken)])
+            with self._lock:
+                current = {segment.id: live for segment, live in self._segments}
+                # Deletes that arrived while merging still apply to the merged copy
+                live = np.concatenate([current[segment.id][positions] for (segment, _), positions in zip(chosen, taken)]) \
+                    if merged is not None else None
+                first = min(i for i, (segment, _) in enumerate(self._segments) if segment.id in ids)
+                rest = [(segment, mask) for segment, mask in self._segments if segment.id not in ids]
+                if merged is not None and live.any():
+                    rest.insert(first, (merged, live))
+                    for position in np.flatnonzero(live):
+                        self._where[merged.keys[position]] = (merged.id, int(position))
+                self._segments = rest
+                self._changed()
+            incr("segment_merges")
+        except Exception as e:
+            incr("errors", stage="segments.merge")
+            logging.error(f"Segment merge error: {e}")
+            return
+        finally:
+            with self._lock:
+                self._merging = False
+        # Keep going until the policy is satisfied
+        self._maybe_merge()
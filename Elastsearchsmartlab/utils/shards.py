@@ -0,0 +1,245 @@
+import atexit
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from utils.docstore import DocStore, doc_titles
+from utils.embedding_store import EmbeddingStore, text_hash
+from utils.fusion import top_k as top_k_indices
+from utils.lexical import tokenize
+from utils.segments import Segment
+
+# Corpora of at least SHARD_MIN_DOCS documents are split into SHARD_COUNT
+# shards, each scored by its own worker process (1 = score in-process)
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 1))
+SHARD_MIN_DOCS = int(os.environ.get("SHARD_MIN_DOCS", 50000))
+
+def use_shards(num_docs):
+    return SHARD_COUNT > 1 and num_docs >= SHARD_MIN_DOCS
+
+def _top(scores, k, offset):
+    ids = top_k_indices(scores, k)
+    return ids + offset, scores[ids]
+
+def _shard_docs(docs, start, stop):
+    # A spawned worker receives its slice pickled, so send just that slice:
+    # a DocStore view would carry every column of the whole corpus
+    part = docs[start:stop]
+    return part if isinstance(part, list) else DocStore.from_docs(part)
+
+def _shard_main(conn, docs, offset, parent):
+    # Worker process owning one shard: its BM25 postings, and embedding
+    # slices loaded from the on-disk store the first time a model is used
+    shard = Segment(docs, None)
+    conn.send(("ok", {
+        "docs": len(shard),
+        "length": float(shard.doc_lens.sum()),
+        "df": {term: len(ids) for term, (ids, _) in shard.postings.items()},
+    }))
+    vectors = {}
+    while True:
+        # Forked siblings hold copies of this pipe, so EOF alone may never
+        # come if the parent dies; check that it is still there
+        if not conn.poll(1.0):
+            if os.getppid() != parent:
+                break
+            continue
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            break
+        if op == "close":
+            break
+        try:
+            if op == "bm25":
+                terms, idf, avgdl, k = args
+                scores = shard.bm25(terms, idf, avgdl)
+            elif op == "semantic":
+                model_name, q_emb, k = args
+                if model_name not in vectors:
+                    store = EmbeddingStore(model_name)
+                    rows = np.array([store.rows[text_hash(title)] for title in shard.docs.titles()], dtype=np.int64)
+                    vectors[model_name] = store.vectors_at(rows)
+                scores = vectors[model_name] @ q_emb
+            else:
+                raise ValueError(f"unknown shard operation '{op}'")
+            conn.send(("ok", _top(scores, k, offset) if k else scores))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+class ShardedCorpus:
+    """A corpus split into contiguous shards, each held by a worker process.
+
+    Scoring scatters one request to every shard and gathers the replies:
+    either full score slices (for fusion, which needs every document) or
+    each shard's top ``k``, merged exactly since every global top-``k``
+    document is in its own shard's top ``k``. BM25 uses collection-wide
+    statistics, so scores equal those of a single whole-corpus index.
+    """
+
+    def __init__(self, docs, num_shards=None):
+        num_shards = max(1, min(num_shards or SHARD_COUNT, len(docs)))
+        # Spawned, not forked: the app and API are multi-threaded, and a fork
+        # could copy a lock another thread holds into every worker
+        ctx = multiprocessing.get_context("spawn")
+        bounds = np.linspace(0, len(docs), num_shards + 1).astype(int)
+        self.docs = docs
+        self.offsets = bounds[:-1]
+        self._lock = threading.Lock()
+        self._embedded = set()
+        self._workers = []
+        # Set once a worker's pipe fails; get_sharded_corpus then replaces the corpus
+        self.broken = False
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            conn, child = ctx.Pipe()
+            process = ctx.Process(target=_shard_main, args=(child, _shard_docs(docs, start, stop), int(start), os.getpid()), daemon=True)
+            process.start()
+            child.close()
+            self._workers.append((process, conn))
+        # Shards index in parallel, then report their collection statistics
+        self.num_docs = 0
+        self.total_length = 0.0
+        self.df = Counter()
+        try:
+            replies = self._gather()
+        except Exception:
+            self.close()
+            raise
+        for stats in replies:
+            self.num_docs += stats["docs"]
+            self.total_length += stats["length"]
+            self.df.update(stats["df"])
+
+    def __len__(self):
+        return len(self._workers)
+
+    def _gather(self, workers=None):
+        # Every reply is read before raising, so no stale reply is left in a
+        # pipe to be taken as the answer to the next request
+        replies, errors = [], []
+        for _, conn in (self._workers if workers is None else workers):
+            try:
+                status, value = conn.recv()
+            except (EOFError, OSError) as e:
+                self.broken = True
+                errors.append(f"worker gone ({type(e).__name__})")
+                continue
+            if status != "ok":
+                errors.append(value)
+            replies.append(value)
+        if errors:
+            raise RuntimeError(f"shard error: {'; '.join(errors)}")
+        return replies
+
+    def _scatter(self, op, args):
+        # One query at a time: every shard works on it in parallel
+        with self._lock:
+            if self.broken:
+                raise RuntimeError("shard error: sharded corpus is broken")
+            sent = []
+            for worker in self._workers:
+                try:
+                    worker[1].send((op, args))
+                except OSError:
+                    self.broken = True
+                    break
+                sent.append(worker)
+            replies = self._gather(sent)
+            if self.broken:
+                raise RuntimeError("shard error: worker gone (send failed)")
+            return replies
+
+    def _merge(self, replies, k):
+        if not k:
+            return np.concatenate(replies).astype(np.float32)
+        ids = np.concatenate([r[0] for r in replies])
+        scores = np.concatenate([r[1] for r in replies]).astype(np.float32)
+        best = top_k_indices(scores, k)
+        return ids[best], scores[best]
+
+    def bm25(self, query, k=None):
+        """BM25 score of every document, or the exact top ``k`` as (ids, scores)."""
+        terms = [term for term in set(tokenize(query)) if term in self.df]
+        idf = {term: math.log(1 + (self.num_docs - self.df[term] + 0.5) / (self.df[term] + 0.5)) for term in terms}
+        avgdl = self.total_length / max(self.num_docs, 1)
+        return self._merge(self._scatter("bm25", (terms, idf, avgdl, k)), k)
+
+    def ensure_embeddings(self, store, encode):
+        # Shards read their slices straight from the store, so every title must be in it first
+        if store.model_name not in self._embedded:
+            store.add(doc_titles(self.docs), encode)
+            self._embedded.add(store.model_name)
+
+    def semantic(self, model_name, q_emb, k=None):
+        """Cosine similarity of every document, or the exact top ``k``."""
+        q_emb = np.asarray(q_emb, dtype=np.float32)
+        q_emb = q_emb / (np.linalg.norm(q_emb) + 1e-8)
+        return self._merge(self._scatter("semantic", (model_name, q_emb, k)), k)
+
+    def close(self):
+        with self._lock:
+            for process, conn in self._workers:
+                try:
+                    conn.send(("close", None))
+                    conn.close()
+                except OSError:
+                    pass
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
+            self._workers = []
+
+_SHARDED = OrderedDict()
+# Guards only the two dicts; a corpus is built under its own fingerprint's lock
+_SHARDED_LOCK = threading.Lock()
+_BUILD_LOCKS = {}
+
+def _cached(fingerprint):
+    sharded = _SHARDED.get(fingerprint)
+    if sharded is not None and not sharded.broken:
+        _SHARDED.move_to_end(fingerprint)
+        return sharded
+    return None
+
+def get_sharded_corpus(docs, fingerprint):
+    # Few corpora are kept: each holds SHARD_COUNT processes and a copy of its indexes.
+    # Starting the workers takes seconds, and only callers of the same corpus wait for it
+    with _SHARDED_LOCK:
+        sharded = _cached(fingerprint)
+        if sharded is not None:
+            return sharded
+        lock = _BUILD_LOCKS.setdefault(fingerprint, threading.Lock())
+    with lock:
+        with _SHARDED_LOCK:
+            sharded = _cached(fingerprint)
+            if sharded is not None:
+                return sharded
+            broken = _SHARDED.pop(fingerprint, None)
+        if broken is not None:
+            # A worker died or its pipe failed: start a fresh set of shards
+            logging.error("Sharded corpus lost a worker; restarting its shards")
+            broken.close()
+        sharded = ShardedCorpus(docs)
+        evicted = []
+        with _SHARDED_LOCK:
+            _SHARDED[fingerprint] = sharded
+            _BUILD_LOCKS.pop(fingerprint, None)
+            while len(_SHARDED) > 2:
+                evicted.append(_SHARDED.popitem(last=False)[1])
+        for corpus in evicted:
+            corpus.close()
+        return sharded
+
+def close_all():
+    with _SHARDED_LOCK:
+        for sharded in _SHARDED.values():
+            try:
+                sharded.close()
+            except Exception as e:
+                logging.error(f"Shard shutdown error: {e}")
+        _SHARDED.clear()
+
+atexit.register(close_all)
@@ -0,0 +1,195 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Optional sinks for dashboards: every finished trace is appended to
+# TRACE_LOG_PATH as one JSON line, and METRICS_PROM_PATH is rewritten with the
+# Prometheus text exposition (for a node_exporter textfile collector)
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH", "")
+METRICS_PROM_PATH = os.environ.get("METRICS_PROM_PATH", "")
+METRICS_PREFIX = "smartlab"
+# Stage latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Span attributes that become Prometheus labels besides the stage name
+HISTOGRAM_LABELS = ("provider",)
+
+_TRACE = contextvars.ContextVar("trace", default=None)
+_STACK = contextvars.ContextVar("span_stack", default=())
+
+class Trace:
+    """Spans and counters recorded while one unit of work (a result column,
+    a query plan) was active. Thread pools must submit work through
+    ``contextvars.copy_context().run`` for their spans to land here."""
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration, parent, depth, attrs):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": (start - self._start) * 1000,
+                "duration_ms": duration * 1000,
+                "parent": parent,
+                "depth": depth,
+                "attrs": attrs,
+            })
+
+    def count(self, key, value):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        self.spans.sort(key=lambda s: s["start_ms"])
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "trace": self.name,
+                "attrs": self.attrs,
+                "started_at": self.started_at,
+                "duration_ms": (self.duration or 0.0) * 1000,
+                "spans": list(self.spans),
+                "counters": dict(self.counters),
+            }
+
+_METRICS_LOCK = threading.Lock()
+# (stage, labels) -> [bucket counts..., +Inf count], sum
+_HISTOGRAMS = {}
+# (counter name, labels) -> value
+_COUNTERS = {}
+# Most recent finished traces, newest last
+RECENT_TRACES = deque(maxlen=200)
+_SINK_LOCK = threading.Lock()
+
+def _labels(**labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+def observe(stage, seconds, **labels):
+    key = (stage, _labels(**labels))
+    with _METRICS_LOCK:
+        entry = _HISTOGRAMS.get(key)
+        if entry is None:
+            entry = _HISTOGRAMS[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                entry[0][i] += 1
+        entry[0][-1] += 1
+        entry[1] += seconds
+
+def incr(name, value=1, **labels):
+    """Bump a process-wide counter, and the active trace's copy of it."""
+    key = (name, _labels(**labels))
+    with _METRICS_LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+    trace = _TRACE.get()
+    if trace is not None:
+        trace.count(_format_name(name, key[1]), value)
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage. Yields the attribute dict so callers can add details
+    (sizes, cache hits) once they are known; an exception escaping the span
+    is recorded on it and counted under ``errors``."""
+    stack = _STACK.get()
+    token = _STACK.set(stack + (name,))
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception as e:
+        attrs["error"] = f"{type(e).__name__}: {e}"
+        incr("errors", stage=name)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _STACK.reset(token)
+        observe(name, duration, **{k: attrs.get(k) for k in HISTOGRAM_LABELS})
+        trace = _TRACE.get()
+        if trace is not None:
+            trace.add_span(name, start, duration, stack[-1] if stack else None, len(stack), attrs)
+
+@contextmanager
+def start_trace(name, **attrs):
+    trace = Trace(name, **attrs)
+    token = _TRACE.set(trace)
+    stack_token = _STACK.set(())
+    try:
+        yield trace
+    finally:
+        _STACK.reset(stack_token)
+        _TRACE.reset(token)
+        trace.finish()
+        RECENT_TRACES.append(trace)
+        _write_sinks(trace)
+
+def current_trace():
+    return _TRACE.get()
+
+def _write_sinks(trace):
+    try:
+        with _SINK_LOCK:
+            if TRACE_LOG_PATH:
+                with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.to_dict(), default=str) + "\n")
+            if METRICS_PROM_PATH:
+                tmp_path = f"{METRICS_PROM_PATH}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(export_prometheus())
+                os.replace(tmp_path, METRICS_PROM_PATH)
+    except OSError:
+        # Metrics sinks must never break a search
+        pass
+
+def export_jsonl(traces=None):
+    traces = list(RECENT_TRACES) if traces is None else traces
+    return "".join(json.dumps(t.to_dict(), default=str) + "\n" for t in traces)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_name(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+def export_prometheus():
+    """Stage latency histograms and counters in the Prometheus text format."""
+    with _METRICS_LOCK:
+        histograms = {key: ([*counts], total) for key, (counts, total) in _HISTOGRAMS.items()}
+        counters = dict(_COUNTERS)
+    metric = f"{METRICS_PREFIX}_stage_duration_seconds"
+    lines = [
+        f"# HELP {metric} Time spent in each search stage.",
+        f"# TYPE {metric} histogram",
+    ]
+    for (stage, labels), (counts, total) in sorted(histograms.items()):
+        labels = (("stage", stage),) + labels
+        for bound, count in zip([*map(str, LATENCY_BUCKETS), "+Inf"], counts):
+            lines.append(f"{_format_name(metric + '_bucket', labels + (('le', bound),))} {count}")
+        lines.append(f"{_format_name(metric + '_sum', labels)} {total:.6f}")
+        lines.append(f"{_format_name(metric + '_count', labels)} {counts[-1]}")
+    for name in sorted({name for name, _ in counters}):
+        metric = f"{METRICS_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter, labels), value in sorted(counters.items()):
+            if counter == name:
+                lines.append(f"{_format_name(metric, labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+def reset_metrics():
+    with _METRICS_LOCK:
+        _HISTOGRAMS.clear()
+        _COUNTERS.clear()
+    RECENT_TRACES.clear()
@@ -0,0 +1,73 @@
+import logging
+import os
+import threading
+import time
+from utils.tracing import observe, start_trace, span
+
+# Set to 0 to load the embedding model on the first semantic query instead of at startup
+MODEL_WARMUP = os.environ.get("MODEL_WARMUP", "1") != "0"
+# Set to 0 to skip ranking the sample queries into the result cache during warm-up
+RESULT_PREWARM = os.environ.get("RESULT_PREWARM", "1") != "0"
+# Startup timings are measured from the first import of the engine in this process
+STARTED = time.perf_counter()
+
+_STATE = {"status": "idle", "error": None, "seconds": None}
+_STARTUP = {}
+_LOCK = threading.Lock()
+_THREAD = None
+
+def _warm(docs, queries):
+    from utils.lexical import corpus_fingerprint, get_lexical_index
+    from utils.retrieval import embedding_backend, index_embeddings, prewarm_results
+    start = time.perf_counter()
+    try:
+        with start_trace("Warm-up", docs=len(docs or ())):
+            # Loads the local model (or opens the Cohere client) and runs one
+            # encode, so the first semantic query pays for neither
+            with span("warmup.model"):
+                _, _, encode_query = embedding_backend()
+                encode_query("warm up")
+            if docs:
+                with span("warmup.index", docs=len(docs)):
+                    get_lexical_index(docs, corpus_fingerprint(docs))
+                    index_embeddings(docs)
+            if queries and RESULT_PREWARM:
+                with span("warmup.results", queries=len(queries)):
+                    prewarm_results(queries, user_docs=docs)
+        with _LOCK:
+            _STATE.update(status="ready", seconds=time.perf_counter() - start)
+        mark_startup("model_ready")
+    except Exception as e:
+        logging.error(f"Model warm-up error: {e}")
+        with _LOCK:
+            _STATE.update(status="failed", error=str(e), seconds=time.perf_counter() - start)
+
+def start_warmup(docs=None, queries=None):
+    """Warm the embedding model (and ``docs``' indexes and the results of
+    ``queries`` over them) in a background thread, once per process."""
+    global _THREAD
+    with _LOCK:
+        if _THREAD is not None or not MODEL_WARMUP:
+            return
+        _STATE["status"] = "warming"
+        _THREAD = threading.Thread(target=_warm, args=(docs, queries), name="model-warmup", daemon=True)
+        _THREAD.start()
+
+def warmup_status():
+    # {"status": "idle" | "warming" | "ready" | "failed", "error": ..., "seconds": ...}
+    with _LOCK:
+        return dict(_STATE)
+
+def mark_startup(event):
+    """Record the first time ``event`` happens in this process, as seconds
+    since startup; later calls return the recorded value."""
+    with _LOCK:
+        if event in _STARTUP:
+            return _STARTUP[event]
+        seconds = _STARTUP[event] = time.perf_counter() - STARTED
+    observe(f"startup.{event}", seconds)
+    return seconds
+
+def startup_timings():
+    with _LOCK:
+        return dict(_STARTUP)